@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Stand-in for verifyta that produces realistic simulate output without synthesizing anything.
+
+It accepts the same command line as verifyta, i.e., a model file, an optional query file and any
+number of ``--<option> [value]`` arguments. For every simulate query in the query file, of the form
+``simulate <runs> [<=<time>] { <variables> }``, it prints one trajectory per variable and run. The
+output can be tuned with the following environment variables:
+
+- ``FAKE_VERIFYTA_TUPLES``: the number of points per trajectory (default 100).
+- ``FAKE_VERIFYTA_RUNS``: the number of runs, overriding the one in the query.
+- ``FAKE_VERIFYTA_VARIABLES``: comma-separated variable names used when there is no query file.
+- ``FAKE_VERIFYTA_DELAY``: the time in seconds spent "learning" before printing (default 0).
+- ``FAKE_VERIFYTA_SEED``: the random seed (default 0).
+"""
+import os
+import random
+import re
+import sys
+import time
+
+SIMULATE_RE = re.compile(r"simulate\s*(\d*)\s*\[\s*<=\s*([^\]]+)\]\s*\{([^}]*)\}")
+
+
+def evaluate(expression):
+    """
+    Evaluate a simple arithmetic expression with ``+`` and ``*``, like ``12*60+1``.
+    """
+    total = 0.0
+    for term in expression.split("+"):
+        product = 1.0
+        for factor in term.split("*"):
+            product *= float(factor)
+        total += product
+    return total
+
+
+def trajectory(var, tuples, end, rng):
+    """
+    Create a trajectory with step discontinuities, like those Uppaal Stratego prints.
+    """
+    tuples = max(tuples, 2)
+    if var == "t":
+        times = [end * i / (tuples - 1) for i in range(tuples)]
+        return " ".join(f"({t:g},{t:g})" for t in times)
+    points = []
+    value = 0.0
+    steps = tuples // 2
+    for i in range(steps):
+        t = end * i / max(steps - 1, 1)
+        points.append((t, value))
+        value = round(value + rng.uniform(-1.0, 1.0), 4)
+        points.append((t, value))
+    return " ".join(f"({t:g},{v:g})" for t, v in points)
+
+
+def simulate_output(variables, tuples=100, runs=1, end=100.0, seed=0):
+    """
+    Create the output of a satisfied simulate query.
+
+    :param variables: The variable names.
+    :type variables: list
+    :param tuples: The number of points per trajectory.
+    :type tuples: int
+    :param runs: The number of runs per variable.
+    :type runs: int
+    :param end: The end time of the simulation.
+    :type end: float
+    :param seed: The random seed.
+    :type seed: int
+    :return: The simulate output.
+    :rtype: str
+    """
+    rng = random.Random(seed)
+    lines = [" -- Formula is satisfied."]
+    for var in variables:
+        lines.append(var + ":")
+        for run in range(runs):
+            lines.append(f"[{run}]: " + trajectory(var, tuples, end, rng))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv):
+    if "--version" in argv:
+        print("fake verifyta 1.0")
+        return 0
+    files = [arg for arg in argv if not arg.startswith("--")]
+    with open(files[0], "r") as f:
+        f.read()
+    queries = []
+    if len(files) > 1 and os.path.exists(files[1]):
+        with open(files[1], "r") as f:
+            queries = SIMULATE_RE.findall(f.read())
+    if not queries:
+        variables = os.environ.get("FAKE_VERIFYTA_VARIABLES", "t,x")
+        queries = [("1", "100", variables)]
+
+    time.sleep(float(os.environ.get("FAKE_VERIFYTA_DELAY", "0")))
+    tuples = int(os.environ.get("FAKE_VERIFYTA_TUPLES", "100"))
+    seed = int(os.environ.get("FAKE_VERIFYTA_SEED", "0"))
+    output = ["Options for the verification:", "  Generating no trace",
+              "Verifying formula 1 at /fake.q:1", " -- Formula is satisfied."]
+    for i, (runs, end, variables) in enumerate(queries):
+        runs = int(os.environ.get("FAKE_VERIFYTA_RUNS", runs or "1"))
+        names = [v.strip() for v in variables.split(",") if v.strip()]
+        output.append(f"Verifying formula {i + 2} at /fake.q:{2 * i + 3}")
+        output.append(simulate_output(names, tuples, runs, evaluate(end), seed))
+    sys.stdout.write("\n".join(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
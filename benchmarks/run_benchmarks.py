@@ -0,0 +1,177 @@
+"""
+Benchmarks of the Python-side overhead of strategoutil.
+
+Uppaal Stratego is replaced by ``fake_verifyta.py``, such that only the time spent in
+strategoutil and in starting processes is measured. Run from the repository root with::
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json
+
+The second command exits with a non-zero status if any benchmark is slower than the baseline by more
+than the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import strategoutil as sutil  # noqa: E402
+from fake_verifyta import simulate_output  # noqa: E402
+
+FAKE_VERIFYTA = os.path.join(HERE, "fake_verifyta.py")
+
+
+def measure(func, repeat):
+    """
+    Time a function a number of times.
+
+    :param func: The function to time, without arguments.
+    :type func: callable
+    :param repeat: The number of times to call the function.
+    :type repeat: int
+    :return: Dictionary with the ``min`` and ``median`` time in seconds and the ``repeat``.
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def variable_names(count):
+    return ["t"] + [f"x{i}" for i in range(count - 1)]
+
+
+def bench_parsing(results, sizes, repeat):
+    for variables, tuples in sizes:
+        names = variable_names(variables)
+        text = simulate_output(names, tuples, 1, 100.0)
+        label = f"[vars={variables},tuples={tuples}]"
+        results["get_float_tuples" + label] = measure(lambda: sutil.get_float_tuples(text), repeat)
+        results["extract_state" + label] = measure(
+            lambda: [sutil.extract_state(text, name, 10) for name in names], repeat)
+        results["parse_simulate_output" + label] = measure(
+            lambda: sutil.parse_simulate_output(text), repeat)
+
+
+def bench_insert_state(results, sizes, repeat, directory):
+    for tags, size in sizes:
+        template = os.path.join(directory, f"template_{tags}_{size}.xml")
+        filler = "<!-- filler -->\n" * (size * 1024 // 16)
+        with open(template, "w") as f:
+            f.write(filler)
+            for i in range(tags):
+                f.write(f"double v{i} = //TAG_v{i};\n")
+            f.write(filler)
+        controller = sutil.StrategoController(template, {f"v{i}": float(i) for i in range(tags)})
+        results[f"insert_state[tags={tags},kb={2 * size}]"] = measure(controller.insert_state,
+                                                                      repeat)
+        controller.remove_simfile()
+
+
+def bench_spawn(results, repeat, directory):
+    model = os.path.join(directory, "spawn.xml")
+    with open(model, "w") as f:
+        f.write("<nta/>")
+    os.environ["FAKE_VERIFYTA_TUPLES"] = "10"
+    results["run_stratego_spawn"] = measure(
+        lambda: sutil.run_stratego(model, verifyta_command=FAKE_VERIFYTA), repeat)
+
+
+def bench_mpc(results, sizes, repeat, directory):
+    for variables, steps in sizes:
+        names = variable_names(variables)
+        template = os.path.join(directory, f"mpc_{variables}.xml")
+        with open(template, "w") as f:
+            for name in names:
+                f.write(f"clock {name} = //TAG_{name};\n")
+        os.environ["FAKE_VERIFYTA_TUPLES"] = "100"
+
+        def run():
+            # Discard the progress bar.
+            with sutil.Workspace() as workspace, contextlib.redirect_stdout(io.StringIO()):
+                setup = sutil.MPCsetup(template, os.path.join(workspace.directory, "out.csv"),
+                                       "query.q", {name: 0.0 for name in names},
+                                       verifyta_command=FAKE_VERIFYTA, workspace=workspace)
+                setup.run(10, 2, steps)
+        results[f"mpc_run[vars={variables},steps={steps}]"] = measure(run, repeat)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the median times against a baseline.
+
+    :param results: The benchmark results.
+    :type results: dict
+    :param baseline: The baseline benchmark results.
+    :type baseline: dict
+    :param tolerance: The allowed relative slowdown.
+    :type tolerance: float
+    :return: The names of the benchmarks that regressed, with their relative slowdown.
+    :rtype: list
+    """
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats["median"] / baseline[name]["median"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="JSON file with baseline results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown compared to the baseline")
+    parser.add_argument("--quick", action="store_true", help="run smaller sizes fewer times")
+    args = parser.parse_args()
+
+    repeat = 3 if args.quick else 10
+    parse_sizes = [(2, 100), (10, 1000)] if args.quick else [(2, 100), (10, 1000), (50, 1000),
+                                                            (10, 10000)]
+    insert_sizes = [(5, 64)] if args.quick else [(5, 64), (50, 64), (50, 1024)]
+    mpc_sizes = [(2, 5)] if args.quick else [(2, 5), (10, 20), (50, 20)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bench_parsing(results, parse_sizes, repeat)
+        bench_insert_state(results, insert_sizes, repeat, directory)
+        bench_spawn(results, repeat, directory)
+        bench_mpc(results, mpc_sizes, max(1, repeat // 3), directory)
+
+    for name, stats in results.items():
+        print(f"{name:50s} median {stats['median'] * 1000:10.3f} ms   "
+              f"min {stats['min'] * 1000:10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                       "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, slowdown in regressions:
+            print(f"REGRESSION {name}: {100 * slowdown:.1f}% slower than the baseline")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
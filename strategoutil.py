@@ -1,8 +1,56 @@
+import abc
+import asyncio
+import bisect
+import codecs
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import itertools
+import mmap
+import hashlib
+import hmac
+import inspect
+import io
+import json
 import re
+import secrets
+import shlex
+import socket
+import socketserver
+import struct
 import subprocess
 import shutil
 import os
+import pickle
+import queue
 import sys
+import tempfile
+import threading
+import time
+import weakref
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+_SIMULATE_RUN_RE = re.compile(r"\[(\d+)\]:")
+_SIMULATE_RUN_START_RE = re.compile(r"[ \t\r]*\[(\d+)\]:")
+_SIMULATE_TUPLE_RE = re.compile(r"\(([^,()\s]+),([^,()\s]+)\)")
+_EXPECTED_COST_PATTERN = r"E\((?:max|min)\)\s*=\s*([-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)"
 
 
 def get_int_tuples(text):
@@ -65,18 +113,438 @@ def extract_state(text, var, control_period):
             "Output of Stratego has not the expected format. Please check the output manually for "
             "error messages: \n" + text)
     float_tuples = get_float_tuples(result.group())
+    times = [t[0] for t in float_tuples]
+    values = [t[1] for t in float_tuples]
+    return interpolate_at_last_period(times, values, control_period)
+
+
+class SimulateParser:
+    """
+    Incremental parser for the simulate output of Uppaal Stratego.
+
+    The output is fed either one line at a time with :meth:`feed`, or in chunks of arbitrary size
+    with :meth:`feed_chunk`, such that it can be parsed while Uppaal Stratego is still running. The
+    output is split into sections per variable (a line ``<name>:``), each followed by one line per
+    simulation run (``[<k>]: (t,v) (t,v) ...``). Lines that are not part of such a section are
+    ignored.
+
+    With a *memory_limit*, the parsed runs are moved to a temporary spill file whenever they take
+    more than *memory_limit* bytes. After :meth:`close`, the spilled runs are memory-mapped and
+    their times and values are :class:`memoryview` objects of doubles instead of arrays.
+
+    :param memory_limit: The maximum number of bytes of parsed runs kept in memory.
+    :type memory_limit: int
+    :param spill_directory: The directory of the spill file. Defaults to the system's temporary
+        directory.
+    :type spill_directory: str
+    :ivar trajectories: Dictionary containing pairs of variable name and a list of its simulation
+        runs, where each run is a pair ``(times, values)`` of :class:`array.array` of doubles.
+    :vartype trajectories: dict
+    :ivar failed: Whether Uppaal Stratego reported that a formula is not satisfied.
+    :vartype failed: bool
+    :ivar spilled_bytes: The number of bytes written to the spill file.
+    :vartype spilled_bytes: int
+    """
+
+    def __init__(self, memory_limit=None, spill_directory=None):
+        self.trajectories = {}
+        self.failed = False
+        self.memory_limit = memory_limit
+        self.spill_directory = spill_directory
+        self.spilled_bytes = 0
+        self._var = None
+        self._pending = ""
+        self._in_run = False
+        self._run = None
+        self._stored_bytes = 0
+        self._in_memory = []
+        self._spill = None
+        self._spill_records = {}
+
+    def feed(self, line):
+        """
+        Parse a single line of the Uppaal Stratego output.
+
+        :param line: The line of output, with or without trailing newline.
+        :type line: str
+        """
+        line = line.strip()
+        if not line:
+            return
+        run = _SIMULATE_RUN_RE.match(line)
+        if run is not None:
+            if self._var is None:
+                return
+            pairs = _SIMULATE_TUPLE_RE.findall(line, run.end())
+            times = array("d", [float(t) for t, _ in pairs])
+            values = array("d", [float(v) for _, v in pairs])
+            self._start_run(times, values)
+            self._store(len(times))
+        elif line.endswith(":"):
+            self._var = line[:-1]
+        else:
+            self._var = None
+            if "Formula is not satisfied" in line:
+                self.failed = True
+
+    def feed_chunk(self, chunk):
+        """
+        Parse a chunk of the Uppaal Stratego output. Chunks may end anywhere, also within a line or
+        a number. Only the incomplete end of the chunk is kept, so a long simulation run is never
+        held as a whole line of text.
+
+        :param chunk: The chunk of output.
+        :type chunk: str
+        """
+        self._pending += chunk
+        while self._pending:
+            newline = self._pending.find("\n")
+            if self._in_run:
+                end = len(self._pending) if newline < 0 else newline
+                if newline < 0:
+                    # Leave an incomplete tuple at the end for the next chunk.
+                    end = self._pending.rfind(")", 0, end) + 1
+                if self._run is not None:
+                    pairs = _SIMULATE_TUPLE_RE.findall(self._pending, 0, end)
+                    self._run[0].extend([float(t) for t, _ in pairs])
+                    self._run[1].extend([float(v) for _, v in pairs])
+                    self._store(len(pairs))
+                if newline < 0:
+                    self._pending = self._pending[end:]
+                    return
+                self._pending = self._pending[newline + 1:]
+                self._in_run = False
+                self._run = None
+                continue
+            run = _SIMULATE_RUN_START_RE.match(self._pending)
+            if run is not None and (newline < 0 or run.end() <= newline):
+                self._in_run = True
+                if self._var is not None:
+                    self._run = self._start_run(array("d"), array("d"))
+                self._pending = self._pending[run.end():]
+                continue
+            if newline < 0:
+                return
+            self.feed(self._pending[:newline])
+            self._pending = self._pending[newline + 1:]
+
+    def close(self):
+        """
+        Parse the remaining output after the last chunk and memory-map the spilled runs.
+        """
+        if self._pending:
+            self.feed_chunk("\n")
+        if self._spill is None:
+            return
+        self._spill_runs()
+        self._spill.flush()
+        if self.spilled_bytes == 0:
+            return
+        doubles = memoryview(mmap.mmap(self._spill.fileno(), 0, access=mmap.ACCESS_READ)).cast("d")
+        for (var, index), (offset, count) in self._spill_records.items():
+            start = 2 * offset
+            stop = 2 * (offset + count)
+            self.trajectories[var][index] = (doubles[start:stop:2], doubles[start + 1:stop:2])
+        self._spill_records = {}
+
+    def _start_run(self, times, values):
+        """
+        Add a new run of the current variable.
+        """
+        run = (times, values)
+        runs = self.trajectories.setdefault(self._var, [])
+        self._in_memory.append((self._var, len(runs)))
+        runs.append(run)
+        return run
+
+    def _store(self, count):
+        """
+        Account for *count* parsed pairs and spill the runs if the memory limit is exceeded.
+        """
+        self._stored_bytes += 16 * count
+        if self.memory_limit is not None and self._stored_bytes > self.memory_limit:
+            self._spill_runs()
+
+    def _spill_runs(self):
+        """
+        Append the runs in memory to the spill file as interleaved (time, value) pairs.
+
+        Runs are parsed one after another, so a run that was partially spilled before is always
+        the last one in the spill file and the remainder is appended right after it.
+        """
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=self.spill_directory)
+        for var, index in self._in_memory:
+            times, values = self.trajectories[var][index]
+            pairs = array("d", itertools.chain.from_iterable(zip(times, values)))
+            pairs.tofile(self._spill)
+            offset, count = self._spill_records.get((var, index),
+                                                    (self.spilled_bytes // 16, 0))
+            self._spill_records[(var, index)] = (offset, count + len(times))
+            self.spilled_bytes += 16 * len(times)
+            # Empty the arrays in place, as the current run may still be appended to.
+            del times[:]
+            del values[:]
+        self._in_memory = [] if self._run is None else self._in_memory[-1:]
+        self._stored_bytes = 0
+
+
+def parse_simulate_output(text):
+    """
+    Parse all trajectories of the simulate queries in the Uppaal Stratego output in a single pass.
+
+    :param text: The input string containing the Uppaal Stratego output.
+    :type text: str
+    :return: Dictionary containing pairs of variable name and a list of its simulation runs, where
+        each run is a pair ``(times, values)`` of :class:`array.array` of doubles.
+    :rtype: dict
+    """
+    parser = SimulateParser()
+    for line in text.splitlines():
+        parser.feed(line)
+    return parser.trajectories
+
+
+def get_trajectory(trajectories, var, run=0):
+    """
+    Get a single simulation run of a variable from the parsed simulate output.
+
+    :param trajectories: The parsed output as returned by :func:`parse_simulate_output`.
+    :type trajectories: dict
+    :param var: The variable name.
+    :type var: str
+    :param run: The index of the simulation run.
+    :type run: int
+    :return: The pair ``(times, values)`` of the requested run.
+    :rtype: tuple
+    """
+    runs = trajectories.get(var, [])
+    if run >= len(runs):
+        raise RuntimeError(
+            f"Output of Stratego does not contain simulation run {run} of variable {var}. Please "
+            f"check the output manually for error messages.")
+    return runs[run]
+
+
+def interpolate_at_last_period(times, values, control_period):
+    """
+    Interpolate the value of a trajectory at the last control period boundary it passes.
+
+    :param times: The time points of the trajectory.
+    :type times: list or array.array
+    :param values: The values of the trajectory at the time points in *times*.
+    :type values: list or array.array
+    :param control_period: The interval duration after which the controller can change the control
+        setting, given in Uppaal Stratego time units.
+    :type control_period: int
+    :return: The (interpolated) value at the last control period boundary strictly before the last
+        time point.
+    :rtype: float
+    """
     x, y = 0.0, 0.0
     last_value = 0.0
     p = 1
-    for t in float_tuples:
-        while p * control_period < t[0]:
-            last_value = y + (p * control_period - x) * (t[1] - y) / (t[0] - x)
+    for t, v in zip(times, values):
+        while p * control_period < t:
+            last_value = y + (p * control_period - x) * (v - y) / (t - x)
             p += 1
-        x = t[0]
-        y = t[1]
+        x = t
+        y = v
     return last_value
 
 
+def resample(times, values, grid):
+    """
+    Resample a trajectory onto a time grid with linear interpolation, using NumPy.
+
+    At a discontinuity, where the trajectory has several points at the same time, the value of the
+    last of these points is used, like :func:`interpolate_at_last_period` does. For example, the
+    values at every control period of the horizon are obtained with the grid
+    ``numpy.arange(1, horizon + 1) * control_period``.
+
+    :param times: The time points of the trajectory in non-decreasing order.
+    :type times: list or array.array or numpy.ndarray
+    :param values: The values of the trajectory at the time points in *times*.
+    :type values: list or array.array or numpy.ndarray
+    :param grid: The time points to resample at.
+    :type grid: list or numpy.ndarray
+    :return: The values at the time points in *grid*, which are NaN outside the trajectory.
+    :rtype: numpy.ndarray
+    """
+    if np is None:
+        raise RuntimeError("Resampling trajectories requires NumPy, which is not installed.")
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if len(times) == 0:
+        return np.full(grid.shape, np.nan)
+    # The last point at or before each grid time, and the point after it.
+    after = np.searchsorted(times, grid, side="right")
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(times) - 1)
+    span = times[after] - times[before]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(span > 0, (grid - times[before]) / span, 0.0)
+    result = values[before] + fraction * (values[after] - values[before])
+    result[(grid < times[0]) | (grid > times[-1])] = np.nan
+    return result
+
+
+def resample_trajectories(trajectories, grid, variables=None, run=0):
+    """
+    Resample the simulate trajectories of several variables onto a time grid in one call, see
+    :func:`resample`.
+
+    :param trajectories: The parsed output as returned by :func:`parse_simulate_output`.
+    :type trajectories: dict
+    :param grid: The time points to resample at.
+    :type grid: list or numpy.ndarray
+    :param variables: The names of the variables to resample. Defaults to all variables.
+    :type variables: list
+    :param run: The index of the simulation run, or ``None`` for all runs.
+    :type run: int
+    :return: Dictionary containing pairs of variable name and its resampled values, which is a 2-D
+        array with one row per run if *run* is ``None``.
+    :rtype: dict
+    """
+    if variables is None:
+        variables = list(trajectories.keys())
+    resampled = {}
+    for var in variables:
+        if run is None:
+            runs = trajectories.get(var, [])
+            resampled[var] = np.array([resample(times, values, grid) for times, values in runs])
+        else:
+            resampled[var] = resample(*get_trajectory(trajectories, var, run), grid)
+    return resampled
+
+
+class Ensemble:
+    """
+    The runs of a ``simulate N`` query resampled onto a common time grid, with statistics over the
+    runs at each time point of the grid. Requires NumPy.
+
+    :param trajectories: The parsed output as returned by :func:`parse_simulate_output`.
+    :type trajectories: dict
+    :param grid: The time points to resample the runs at.
+    :type grid: list or numpy.ndarray
+    :param variables: The names of the variables to include. Defaults to all variables.
+    :type variables: list
+    :ivar grid: The time points of the grid.
+    :vartype grid: numpy.ndarray
+    :ivar runs: Dictionary containing pairs of variable name and a 2-D array with one row per run
+        and one column per time point of the grid. Values outside a run are NaN.
+    :vartype runs: dict
+    """
+
+    def __init__(self, trajectories, grid, variables=None):
+        if np is None:
+            raise RuntimeError("Ensembles of simulation runs require NumPy, which is not installed.")
+        self.grid = np.asarray(grid, dtype=float)
+        self.runs = resample_trajectories(trajectories, self.grid, variables, run=None)
+
+    @classmethod
+    def at_periods(cls, trajectories, control_period, horizon, variables=None):
+        """
+        Create the ensemble on the control period boundaries of the horizon.
+
+        :param trajectories: The parsed output as returned by :func:`parse_simulate_output`.
+        :type trajectories: dict
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The number of control periods.
+        :type horizon: int
+        :param variables: The names of the variables to include. Defaults to all variables.
+        :type variables: list
+        :return: The ensemble.
+        :rtype: :class:`~Ensemble`
+        """
+        return cls(trajectories, np.arange(1, horizon + 1) * control_period, variables)
+
+    def _runs(self, var):
+        if var not in self.runs or len(self.runs[var]) == 0:
+            raise RuntimeError(f"The ensemble does not contain any run of variable {var}.")
+        return self.runs[var]
+
+    def mean(self, var):
+        """
+        :return: The mean of *var* over the runs at each time point of the grid.
+        :rtype: numpy.ndarray
+        """
+        return np.nanmean(self._runs(var), axis=0)
+
+    def std(self, var):
+        """
+        :return: The standard deviation of *var* over the runs at each time point of the grid.
+        :rtype: numpy.ndarray
+        """
+        return np.nanstd(self._runs(var), axis=0)
+
+    def quantile(self, var, q):
+        """
+        :param q: The quantile, or a list of quantiles, between 0 and 1.
+        :type q: float or list
+        :return: The quantile of *var* over the runs at each time point of the grid, with one row
+            per quantile if *q* is a list.
+        :rtype: numpy.ndarray
+        """
+        return np.nanquantile(self._runs(var), q, axis=0)
+
+    def exceedance(self, var, threshold):
+        """
+        :param threshold: The threshold value.
+        :type threshold: float
+        :return: The fraction of runs in which *var* is above *threshold* at each time point of the
+            grid.
+        :rtype: numpy.ndarray
+        """
+        runs = self._runs(var)
+        present = np.count_nonzero(~np.isnan(runs), axis=0)
+        with np.errstate(invalid="ignore"):
+            return np.count_nonzero(runs > threshold, axis=0) / np.maximum(present, 1)
+
+    def statistic(self, var, statistic):
+        """
+        Compute a statistic of *var* over the runs at each time point of the grid.
+
+        :param statistic: The name of the statistic, which is ``"mean"``, ``"median"``, ``"min"`` or
+            ``"max"``, or a function that computes the statistic from a 2-D array with one row per
+            run along axis 0.
+        :type statistic: str or callable
+        :return: The statistic at each time point of the grid.
+        :rtype: numpy.ndarray
+        """
+        if callable(statistic):
+            return np.asarray(statistic(self._runs(var)))
+        functions = {"mean": np.nanmean, "median": np.nanmedian, "min": np.nanmin,
+                     "max": np.nanmax}
+        if statistic not in functions:
+            raise RuntimeError(f"Unknown ensemble statistic {statistic}.")
+        return functions[statistic](self._runs(var), axis=0)
+
+
+def value_at(times, values, time_point):
+    """
+    Get the value of a piecewise-constant trajectory, like that of a control action, at a time point.
+
+    If the trajectory has several points at *time_point*, the value of the last one is returned.
+
+    :param times: The time points of the trajectory in non-decreasing order.
+    :type times: list or array.array
+    :param values: The values of the trajectory at the time points in *times*.
+    :type values: list or array.array
+    :param time_point: The time point.
+    :type time_point: float
+    :return: The value at *time_point*, or ``None`` if *time_point* is outside the trajectory.
+    :rtype: float
+    """
+    index = bisect.bisect_right(times, time_point) - 1
+    if index < 0 or time_point > times[-1]:
+        return None
+    return values[index]
+
+
 def get_duration_action(tuples, max_time=None):
     """
     Get tuples (duration, action) from tuples (time, variable) resulted from simulate query.
@@ -117,6 +585,96 @@ def insert_to_modelfile(model_file, tag, inserted):
         f.truncate()
 
 
+class ModelTemplate:
+    """
+    Compiled in-memory version of a template model.
+
+    The template model is read once and split at the tags, such that a state can be inserted in a
+    single pass and the simulation file can be written with a single write.
+
+    :param model_template_file: The file name of the template model.
+    :type model_template_file: str
+    :param tag_rule: The rule for each tag in the template model, where ``{}`` is the placeholder
+        for the variable name.
+    :type tag_rule: str
+    :ivar tags: Dictionary containing pairs of variable name and the offset of its tag in the
+        template model.
+    :vartype tags: dict
+    """
+
+    def __init__(self, model_template_file, tag_rule="//TAG_{}"):
+        self.template_file = model_template_file
+        self.tag_rule = tag_rule
+        with open(model_template_file, "r") as f:
+            text = f.read()
+
+        prefix, suffix = tag_rule.split("{}")
+        pattern = re.compile(re.escape(prefix) + r"(\w+)" + re.escape(suffix))
+        self.tags = {}
+        self._segments = []
+        self._names = []
+        position = 0
+        for match in pattern.finditer(text):
+            name = match.group(1)
+            if name in self.tags:
+                raise RuntimeError(
+                    f"Tag {tag_rule.format(name)} occurs more than once in the template model "
+                    f"{model_template_file}.")
+            self.tags[name] = match.start()
+            self._segments.append(text[position:match.start()])
+            self._names.append(name)
+            position = match.end()
+        self._segments.append(text[position:])
+
+    def check_variables(self, names):
+        """
+        Verify that the template model contains a tag for each of the provided variable names.
+
+        :param names: The variable names.
+        :type names: iterable
+        """
+        missing = [name for name in names if name not in self.tags]
+        if missing:
+            tags = ", ".join(self.tag_rule.format(name) for name in missing)
+            raise RuntimeError(
+                f"The template model {self.template_file} does not contain the tags: {tags}")
+
+    def render(self, states):
+        """
+        Insert the state values at their tags in the template model.
+
+        Tags of variables that are not in *states* are left untouched, whereas a variable in
+        *states* without a tag raises a :class:`RuntimeError`.
+
+        :param states: Dictionary containing pairs of state variable name and its value.
+        :type states: dict
+        :return: The model text with the state values inserted.
+        :rtype: str
+        """
+        self.check_variables(states.keys())
+        parts = [self._segments[0]]
+        for name, segment in zip(self._names, self._segments[1:]):
+            if name in states:
+                parts.append(str(states[name]))
+            else:
+                parts.append(self.tag_rule.format(name))
+            parts.append(segment)
+        return "".join(parts)
+
+    def write(self, model_file, states):
+        """
+        Write the template model with the state values inserted to a file.
+
+        :param model_file: The file name of the model to write.
+        :type model_file: str
+        :param states: Dictionary containing pairs of state variable name and its value.
+        :type states: dict
+        """
+        text = self.render(states)
+        with open(model_file, "w") as f:
+            f.write(text)
+
+
 def array_to_stratego(arr):
     """
     Convert python array string to C style array used in UPPAAL Stratego.
@@ -166,149 +724,2794 @@ def check_tool_existence(name):
     return shutil.which(name) is not None
 
 
-def run_stratego(model_file, query_file="", learning_args=None, verifyta_command="verifyta"):
+@functools.lru_cache(maxsize=None)
+def resolve_executable(command):
     """
-    Run command line version of Uppaal Stratego.
+    Resolve a command name to the full path of the executable.
+
+    Environment variables and ``~`` in the command are expanded. Successful resolutions are cached,
+    such that the search on PATH is performed only once per command.
+
+    :param command: The command name or path, for example ``"verifyta"`` or ``"$HOME/verifyta"``.
+    :type command: str
+    :return: The full path of the executable.
+    :rtype: str
+    """
+    expanded = os.path.expanduser(os.path.expandvars(command))
+    path = shutil.which(expanded)
+    if path is None:
+        raise RuntimeError(f"Cannot find the supplied verifyta command: {command}")
+    return path
+
+
+def split_command(command):
+    """
+    Split a command into the executable and its arguments, like ``"verifyta --silence-progress"``.
+
+    A command that as a whole is an executable, for example a path with spaces, is not split.
+    Shell syntax like pipes and redirections is not supported, as no shell is used to run it.
+
+    :param command: The command.
+    :type command: str
+    :return: The argument list of the command.
+    :rtype: list
+    """
+    if shutil.which(os.path.expanduser(os.path.expandvars(command))) is not None:
+        return [command]
+    return shlex.split(command, posix=os.name == "posix") or [command]
+
+
+def verifyta_argv(model_file, query_file="", learning_args=None, verifyta_command="verifyta"):
+    """
+    Create the argument list for running the command line version of Uppaal Stratego.
 
     :param model_file: The file name of the model.
     :type model_file: str
     :param query_file: The file name of the query.
     :type query_file: str
-    :param learning_args: Dictionary containing the learning parameters and their values. The
-        learning parameter names should be those used in the command line interface of Uppaal
-        Stratego. You can also include non-learning command line parameters in this dictionary.
-        If a non-learning command line parameter does not take any value, include the empty
-        string ``""`` as value.
+    :param learning_args: Dictionary containing the learning parameters and their values. A
+        parameter with value ``None`` or ``""`` is passed without value.
     :type learning_args: dict
-    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine. It
+        may include arguments, see :func:`split_command`.
     :type verifyta_command: str
-    :return: The output as produced by Uppaal Stratego.
-    :rtype: str
+    :return: The argument list, starting with *verifyta_command*.
+    :rtype: list
     """
     learning_args = {} if learning_args is None else learning_args
-    args = {
-        "verifyta": verifyta_command,
-        "model": f'"{model_file}"',  # Robust against spaces in path name
-        "query": f'"{query_file}"',
-        "config": merge_verifyta_args(learning_args)
-    }
-    args_list = [v for v in args.values() if v != "" and v != "\"\""]
-    task = " ".join(args_list)
-
-    process = subprocess.Popen(task, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    result = process.communicate()
-    result = [r.decode("utf-8") for r in result]
-
-    # Throw error if stderr is nonempty.
-    if len(result) > 1 and len(result[1]) > 0:
-        raise RuntimeError("Uppaal finished with the following error message:\n\n" + result[1] +
-                           "\n" +
-                           "You can run the following command in a terminal to recreate the error:\n\n" + task)
-    return result
+    argv = split_command(verifyta_command) + [model_file]
+    if query_file != "":
+        argv.append(query_file)
+    for k, v in learning_args.items():
+        argv.append("--" + k)
+        if v is not None and v != "":
+            argv.append(str(v))
+    return argv
 
 
-def successful_result(text):
+def format_command(argv):
     """
-    Verify whether the stratego output is based on the successful synthesis of a strategy.
+    Format an argument list as a command that can be pasted in a terminal.
 
-    :param text: The output generated by Uppaal Stratego.
-    :type text: str
-    :return: Whether Uppaal Stratego has successfuly ran all queries.
-    :rtype: bool
+    :param argv: The argument list.
+    :type argv: list
+    :return: The command string.
+    :rtype: str
     """
-    result = re.search("Formula is satisfied", text)
-    return result is not None
+    if os.name == "nt":
+        return subprocess.list2cmdline(argv)
+    return " ".join(shlex.quote(arg) for arg in argv)
 
 
-def print_progress_bar(i, max, post_text):
+class DeadlineExceeded(RuntimeError):
+    """
+    Raised when Uppaal Stratego did not finish before the deadline of an MPC step.
     """
-    Print a progress bar to sys.stdout.
 
-    Subsequent calls will override the previous progress bar (given that nothing else has been
-    written to sys.stdout).
 
-    From `<https://stackoverflow.com/a/58602365>`_.
+class LaunchResult:
+    """
+    The result of running a process with a launcher.
 
-    :param i: The number of steps already completed.
-    :type i: int
-    :param max: The maximum number of steps for process to be completed.
-    :type max: int
-    :param post_text: The text to display after the progress bar.
-    :type post_text: str
+    :ivar argv: The argument list of the process.
+    :vartype argv: list
+    :ivar stdout: The decoded standard output.
+    :vartype stdout: str
+    :ivar stderr: The decoded standard error.
+    :vartype stderr: str
+    :ivar returncode: The exit code of the process.
+    :vartype returncode: int
+    :ivar spawn_time: The time in seconds it took to start the process.
+    :vartype spawn_time: float
+    :ivar wall_time: The time in seconds from starting the process until it exited.
+    :vartype wall_time: float
+    :ivar cpu_time: The user and system CPU time of the process in seconds, or ``None`` if not
+        available on this system.
+    :vartype cpu_time: float
+    :ivar peak_rss: The peak resident set size of the process in bytes, or ``None`` if not
+        available on this system.
+    :vartype peak_rss: int
     """
-    n_bar = 20  # Size of progress bar.
-    j = i / max
-    sys.stdout.write('\r')
-    sys.stdout.write(f"[{'=' * int(n_bar * j):{n_bar}s}] {int(100 * j)}%  {post_text}")
-    sys.stdout.flush()
 
+    def __init__(self, argv, stdout, stderr, returncode, spawn_time, wall_time, cpu_time=None,
+                 peak_rss=None):
+        self.argv = argv
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.spawn_time = spawn_time
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_rss = peak_rss
 
-class StrategoController:
+
+_LAUNCH_RECORDING = threading.local()
+
+
+def _record_launch(result):
     """
-    Controller class to interface with UPPAAL Stratego through python.
+    Add the result to the launches recorded by the current thread, see :meth:`Profiler.phase`.
+    """
+    recorded = getattr(_LAUNCH_RECORDING, "results", None)
+    if recorded is not None:
+        recorded.append(result)
 
-    :param model_template_file: The file name of the template model.
-    :type model_template_file: str
-    :param model_cfg_dict: Dictionary containing pairs of state variable name and its initial
-        value. The state variable name should match the tag name in the template model.
-    :type model_cfg_dict: dict
-    :param cleanup: Whether or not to clean up the temporarily simulation file after being used.
-    :type cleanup: bool
-    :ivar states: Dictionary containing the current state of the system, where a state is a pair of
-        variable name and value. It is initialized with the values from *model_cfg_dict*.
-    :vartype states: bool
-    :ivar tagRule: The rule for each tag in the template model. Currently, the rul is set to be
-        ``"//TAG_{}"``. Therefore, tags in the template model should be ``"//TAG_<variable name>"``,
-        where ``<variable name>`` is the global name of the variable.
-    :vartype tagRule: str
+
+class _Process(subprocess.Popen):
+    """
+    Process of which the reaping by :func:`_wait_with_rusage` and the sending of signals are
+    serialized, such that a signal can never reach another process that reuses the process ID.
     """
 
-    def __init__(self, model_template_file, model_cfg_dict, cleanup=True):
-        self.template_file = model_template_file
-        self.simulation_file = model_template_file.replace(".xml", "_sim.xml")
-        self.cleanup = cleanup  # TODO: this variable seems to be not used. Can it be safely removed?
-        self.states = model_cfg_dict.copy()
-        self.tagRule = "//TAG_{}"
+    def __init__(self, *args, **kwargs):
+        self._signal_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
 
-    def init_simfile(self):
+    def send_signal(self, sig):
+        with self._signal_lock:
+            if self.returncode is None:
+                super().send_signal(sig)
+
+
+def _wait_with_rusage(process):
+    """
+    Wait for the process to exit and get its resource usage with ``wait4`` where available.
+
+    The process is first awaited without reaping it, such that it can still be signalled safely,
+    and then reaped while no signal is sent to it.
+
+    :return: The CPU time in seconds and the peak resident set size in bytes, which are ``None``
+        if not available.
+    :rtype: tuple
+    """
+    if not (hasattr(os, "wait4") and hasattr(os, "waitid")) or not isinstance(process, _Process):
+        process.wait()
+        return None, None
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        with process._signal_lock:
+            _, status, rusage = os.wait4(process.pid, 0)
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+    except ChildProcessError:
+        # The process has already been reaped, for example by a concurrent poll().
+        process.wait()
+        return None, None
+    # The peak resident set size is given in kilobytes on Linux and in bytes on macOS.
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return rusage.ru_utime + rusage.ru_stime, peak_rss
+
+
+# Applies the resource settings of a ProcessLauncher in the otherwise idle child process and then
+# replaces it with the executable, which keeps the process ID.
+_RESOURCE_WRAPPER = """
+import json, os, sys
+affinity, nice, memory_limit = json.loads(sys.argv[1])
+if affinity is not None:
+    os.sched_setaffinity(0, affinity)
+if nice is not None:
+    os.nice(nice)
+if memory_limit is not None:
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+os.execv(sys.argv[2], sys.argv[2:])
+"""
+
+
+class ProcessLauncher:
+    """
+    Launcher that runs processes directly from an argument list, without an intermediate shell.
+
+    The resource settings are applied by a small Python wrapper that replaces itself with the
+    executable once the settings are in place. Unlike ``preexec_fn``, this is safe when other
+    threads are running. CPU pinning is only supported where :func:`os.sched_setaffinity` exists,
+    like Linux, and the nice level and memory limit on POSIX systems.
+
+    :param cpu_affinity: The CPU cores the process is allowed to run on.
+    :type cpu_affinity: iterable of int
+    :param nice: The niceness increment of the process.
+    :type nice: int
+    :param memory_limit: The maximum size of the virtual memory of the process in bytes
+        (``RLIMIT_AS``).
+    :type memory_limit: int
+    """
+
+    def __init__(self, cpu_affinity=None, nice=None, memory_limit=None):
+        self.cpu_affinity = None if cpu_affinity is None else sorted(cpu_affinity)
+        self.nice = nice
+        self.memory_limit = memory_limit
+        if cpu_affinity is not None and not hasattr(os, "sched_setaffinity"):
+            raise RuntimeError("CPU pinning is not supported on this system.")
+        if os.name != "posix" and (nice is not None or memory_limit is not None):
+            raise RuntimeError("Nice level and memory limits are only supported on POSIX systems.")
+
+    def available(self, command):
         """
-        Make a copy of a template file where data of specific variables is inserted.
+        Check whether the launcher can run the command.
+
+        :param command: The command, which may include arguments.
+        :type command: str
+        :return: Whether the command can be resolved to an executable.
+        :rtype: bool
         """
-        shutil.copyfile(self.template_file, self.simulation_file)
+        try:
+            resolve_executable(split_command(command)[0])
+        except RuntimeError:
+            return False
+        return True
 
-    def remove_simfile(self):
+    def _wrap(self, argv):
         """
-        Clean created temporary files after the simulation is finished.
+        Resolve the executable and prefix the argument list with the wrapper that applies the
+        resource settings, if any.
         """
-        os.remove(self.simulation_file)
+        argv = [resolve_executable(argv[0])] + list(argv[1:])
+        if self.cpu_affinity is None and self.nice is None and self.memory_limit is None:
+            return argv
+        settings = json.dumps([self.cpu_affinity, self.nice, self.memory_limit])
+        return [sys.executable, "-S", "-c", _RESOURCE_WRAPPER, settings] + argv
 
-    def debug_copy(self, debug_file):
+    def launch(self, argv):
         """
-        Copy UPPAAL simulationfile.xml file for manual debug in Stratego.
+        Start a process with piped standard output and error.
 
-        :param debug_file: The file name of the debug file.
-        :type debug_file: str
+        :param argv: The argument list, where the first element is resolved with
+            :func:`resolve_executable`.
+        :type argv: list
+        :return: The started process.
+        :rtype: :class:`subprocess.Popen`
         """
-        shutil.copyfile(self.simulation_file, debug_file)
+        return _Process(self._wrap(argv), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-    def update_state(self, new_values):
+    def run(self, argv):
         """
-        Update the state of the MPC controller.
+        Run a process until it exits and collect its output.
 
-        :param new_values: Dictionary containing new values for the state variables.
-        :type new_values: dict
+        :param argv: The argument list.
+        :type argv: list
+        :return: The output and timing of the run.
+        :rtype: :class:`~LaunchResult`
         """
-        for name, value in new_values.items():
-            self.states.update({name: value})
+        start = time.perf_counter()
+        process = self.launch(argv)
+        spawned = time.perf_counter()
+        # Read both pipes without reaping the process, such that wait4 can report its resource
+        # usage afterwards.
+        errors = []
+        stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()))
+        stderr_reader.daemon = True
+        stderr_reader.start()
+        stdout = process.stdout.read()
+        stderr_reader.join()
+        process.stdout.close()
+        process.stderr.close()
+        cpu_time, peak_rss = _wait_with_rusage(process)
+        end = time.perf_counter()
+        result = LaunchResult(list(argv), stdout.decode("utf-8"), b"".join(errors).decode("utf-8"),
+                              process.returncode, spawned - start, end - start, cpu_time, peak_rss)
+        _record_launch(result)
+        return result
 
-    def insert_state(self):
-        """
-        Insert the current state values of the variables at the appropriate position in the
-        simulation \*.xml file indicated by the :py:attr:`tagRule`.
+    async def arun(self, argv):
         """
-        for name, value in self.states.items():
-            tag = self.tagRule.format(name)
-            insert_to_modelfile(self.simulation_file, tag, str(value))
+        Run a process as an asyncio subprocess until it exits and collect its output.
+
+        The process is killed if the awaiting task is cancelled. The CPU time and peak resident set
+        size are not available for asynchronous runs.
+
+        :param argv: The argument list, where the first element is resolved with
+            :func:`resolve_executable`.
+        :type argv: list
+        :return: The output and timing of the run.
+        :rtype: :class:`~LaunchResult`
+        """
+        resolved = self._wrap(argv)
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *resolved, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        spawned = time.perf_counter()
+        try:
+            stdout, stderr = await process.communicate()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        end = time.perf_counter()
+        result = LaunchResult(list(argv), stdout.decode("utf-8"), stderr.decode("utf-8"),
+                              process.returncode, spawned - start, end - start)
+        _record_launch(result)
+        return result
+
+
+class _FakeProcess:
+    """
+    Minimal stand-in for :class:`subprocess.Popen` with precomputed output.
+    """
+
+    def __init__(self, stdout, stderr):
+        self.stdout = io.BytesIO(stdout.encode("utf-8"))
+        self.stderr = io.BytesIO(stderr.encode("utf-8"))
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def communicate(self, timeout=None):
+        return self.stdout.read(), self.stderr.read()
+
+    def kill(self):
+        pass
+
+
+class FakeLauncher(ProcessLauncher):
+    """
+    In-process launcher for tests that produces output without starting any process.
+
+    :param handler: Function called with the argument list of each run. It returns the standard
+        output as string, or a pair of standard output and standard error.
+    :type handler: callable
+    :ivar calls: The argument lists of all runs so far.
+    :vartype calls: list
+    """
+
+    def __init__(self, handler=None):
+        super().__init__()
+        self.handler = (lambda argv: "") if handler is None else handler
+        self.calls = []
+
+    def available(self, command):
+        """
+        Any command is available to the fake launcher.
+
+        :param command: The command name.
+        :type command: str
+        :return: Always ``True``.
+        :rtype: bool
+        """
+        return True
+
+    def launch(self, argv):
+        """
+        Produce the output of the handler as if it were a process.
+
+        :param argv: The argument list.
+        :type argv: list
+        :return: The fake process.
+        """
+        self.calls.append(list(argv))
+        output = self.handler(list(argv))
+        if isinstance(output, tuple):
+            return _FakeProcess(*output)
+        return _FakeProcess(output, "")
+
+    async def arun(self, argv):
+        """
+        Produce the output of the handler without blocking on any process.
+
+        :param argv: The argument list.
+        :type argv: list
+        :return: The output of the handler.
+        :rtype: :class:`~LaunchResult`
+        """
+        return self.run(argv)
+
+
+class _CancellableLauncher(ProcessLauncher):
+    """
+    Launcher that delegates to another launcher and can kill all processes it started.
+
+    If the other launcher has its own :meth:`~ProcessLauncher.run` or
+    :meth:`~ProcessLauncher.arun`, those are used as well. Such runs are refused once cancelled,
+    but cannot be killed while running.
+    """
+
+    def __init__(self, launcher):
+        super().__init__()
+        self.launcher = launcher
+        self.cancelled = False
+        self.killed = False
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def available(self, command):
+        return self.launcher.available(command)
+
+    def launch(self, argv):
+        with self._lock:
+            if self.cancelled:
+                raise RuntimeError("The run of Uppaal Stratego has been cancelled.")
+            process = self.launcher.launch(argv)
+            self._processes.append(process)
+            return process
+
+    def _check_cancelled(self):
+        with self._lock:
+            if self.cancelled:
+                raise RuntimeError("The run of Uppaal Stratego has been cancelled.")
+
+    def run(self, argv):
+        if type(self.launcher).run is ProcessLauncher.run:
+            # Run through launch, such that the process can be killed.
+            return super().run(argv)
+        self._check_cancelled()
+        return self.launcher.run(argv)
+
+    async def arun(self, argv):
+        self._check_cancelled()
+        return await self.launcher.arun(argv)
+
+    def cancel(self):
+        """
+        Kill all running processes and refuse to start new ones.
+        """
+        with self._lock:
+            self.cancelled = True
+            for process in self._processes:
+                if process.poll() is None:
+                    process.kill()
+                    self.killed = True
+
+
+_DEFAULT_LAUNCHER = ProcessLauncher()
+
+
+_MAX_MESSAGE_SIZE = 1 << 28
+
+
+def _send_message(sock, message):
+    """
+    Send a message as JSON prefixed by its length.
+    """
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(data)) + data)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("The connection was closed.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive_message(sock, max_size=_MAX_MESSAGE_SIZE):
+    """
+    Receive a message sent by :func:`_send_message`. A message longer than *max_size* bytes raises
+    a :class:`ValueError` before it is read, after which the connection cannot be used anymore.
+    """
+    size, = struct.unpack("!I", _receive_exactly(sock, 4))
+    if size > max_size:
+        raise ValueError(f"The message of {size} bytes exceeds the limit of {max_size} bytes.")
+    return json.loads(_receive_exactly(sock, size).decode("utf-8"))
+
+
+def _message_error(message):
+    """
+    Get the reason why *message* is not a valid request to a :class:`~VerifytaWorker`, or ``None``
+    if it is valid.
+    """
+    if not isinstance(message, dict) or message.get("type") not in ("ping", "cancel", "run"):
+        return "Expected a ping, cancel or run message."
+    if message["type"] != "ping" and not isinstance(message.get("id"), (int, str)):
+        return "The message has no valid id."
+    if message["type"] == "run":
+        argv = message.get("argv")
+        files = message.get("files")
+        if not isinstance(argv, list) or not argv or \
+                not all(isinstance(argument, str) for argument in argv):
+            return "The argument list must be a non-empty list of strings."
+        if not isinstance(files, dict) or not all(
+                isinstance(file, list) and len(file) == 2 and
+                all(isinstance(part, str) for part in file) for file in files.values()):
+            return "The files must map argument indices to a name and a content."
+    return None
+
+
+def _digest(secret, nonce):
+    """
+    Get the response to the challenge *nonce* of a :class:`~VerifytaWorker` with *secret*.
+    """
+    key = secret.encode("utf-8") if isinstance(secret, str) else secret
+    return hmac.new(key, nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _connect(address, timeout=None, secret=None):
+    """
+    Connect to a TCP address ``(host, port)`` or the path of a Unix socket, and authenticate with
+    *secret* if given.
+    """
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address if isinstance(address, str) else tuple(address))
+        if secret is not None:
+            _send_message(sock, {"type": "hello"})
+            challenge = _receive_message(sock)
+            _send_message(sock, {"type": "auth", "digest": _digest(secret, challenge["nonce"])})
+            _receive_message(sock)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        sock.close()
+        if isinstance(e, OSError):
+            raise
+        raise ConnectionError(f"Unexpected handshake from worker {address}.") from e
+    return sock
+
+
+class VerifytaWorker:
+    """
+    Server that runs Uppaal Stratego for a :class:`~Coordinator`, possibly on another host.
+
+    For each job, the shipped files are written to a fresh :class:`~Workspace`, their paths in the
+    argument list are replaced by the local ones, and Uppaal Stratego is run with the local
+    launcher. Jobs of different connections run concurrently. Malformed requests are answered with
+    an error message, and a message longer than 256 MiB closes the connection.
+
+    The command of a job is always replaced by *verifyta_command*, but its other arguments are
+    passed on as they are, and the messages are not encrypted. Therefore, the worker should only
+    listen on trusted interfaces, like a Unix socket or the loopback interface, unless a *secret*
+    is set that the clients must prove to know before they can submit jobs.
+
+    :param address: The TCP address ``(host, port)`` to listen on, or the path of a Unix socket.
+        Use port 0 to listen on a free port, see :attr:`address`.
+    :type address: tuple or str
+    :param verifyta_command: The command name for running Uppaal Stratego at the worker's machine,
+        which replaces the command of the jobs.
+    :type verifyta_command: str
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :param secret: The shared secret of the worker and its :class:`~Coordinator`. If given,
+        connections that do not authenticate with it are closed.
+    :type secret: str or bytes
+    :ivar address: The address the worker listens on.
+    :vartype address: tuple or str
+    """
+
+    def __init__(self, address, verifyta_command, launcher=None, secret=None):
+        self.verifyta_command = verifyta_command
+        self.launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+        self.secret = secret
+        self._processes = {}
+        self._lock = threading.Lock()
+        worker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                worker._handle(self.request)
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+        server_class.daemon_threads = True
+        server_class.allow_reuse_address = True
+        self._server = server_class(address, Handler)
+        self.address = self._server.server_address
+
+    def serve_forever(self):
+        """
+        Handle jobs until :meth:`shutdown` is called.
+        """
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """
+        Stop serving and close the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _authenticate(self, sock):
+        nonce = secrets.token_hex(16)
+        try:
+            if _receive_message(sock).get("type") != "hello":
+                return False
+            _send_message(sock, {"type": "challenge", "nonce": nonce})
+            message = _receive_message(sock)
+        except (ConnectionError, OSError, ValueError, AttributeError):
+            return False
+        if not isinstance(message, dict) or not hmac.compare_digest(
+                str(message.get("digest")), _digest(self.secret, nonce)):
+            return False
+        _send_message(sock, {"type": "welcome"})
+        return True
+
+    def _handle(self, sock):
+        if self.secret is not None and not self._authenticate(sock):
+            return
+        while True:
+            try:
+                message = _receive_message(sock)
+            except ValueError as e:
+                # The rest of a malformed or oversized message is not read, so the connection is
+                # closed after reporting the error.
+                with contextlib.suppress(OSError):
+                    _send_message(sock, {"type": "error", "error": str(e)})
+                return
+            except (ConnectionError, OSError):
+                return
+            error = _message_error(message)
+            if error is not None:
+                _send_message(sock, {"type": "error", "error": error})
+            elif message["type"] == "ping":
+                with self._lock:
+                    running = len(self._processes)
+                _send_message(sock, {"type": "pong", "running": running})
+            elif message["type"] == "cancel":
+                with self._lock:
+                    process = self._processes.get(message["id"])
+                    if process is not None and process.poll() is None:
+                        process.kill()
+                _send_message(sock, {"type": "cancelled"})
+            elif message["type"] == "run":
+                _send_message(sock, self._run(message))
+
+    def _run(self, message):
+        # Never run the command of the job, and shift the indices of the shipped files by the
+        # number of extra arguments of the local command.
+        command = split_command(self.verifyta_command)
+        argv = command + list(message["argv"][1:])
+        offset = len(command) - 1
+        start = time.perf_counter()
+
+        def failure(error):
+            return {"type": "result", "id": message["id"], "stdout": "", "stderr": error,
+                    "returncode": None, "wall_time": time.perf_counter() - start}
+
+        files = {}
+        for index, (name, content) in message["files"].items():
+            if not index.isdigit() or not 0 < int(index) < len(message["argv"]):
+                return failure(f"Cannot ship a file to argument {index}.")
+            files[int(index) + offset] = (os.path.basename(name), content)
+        with Workspace() as workspace:
+            for index, (name, content) in files.items():
+                # Each file gets its own directory, such that files with the same name do not
+                # overwrite each other.
+                directory = os.path.join(workspace.directory, str(index))
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, name)
+                with open(path, "w") as f:
+                    f.write(content)
+                argv[index] = path
+            try:
+                process = self.launcher.launch(argv)
+            except (OSError, RuntimeError) as e:
+                return failure(str(e))
+            with self._lock:
+                self._processes[message["id"]] = process
+            try:
+                stdout, stderr = process.communicate()
+            finally:
+                with self._lock:
+                    del self._processes[message["id"]]
+        return {"type": "result", "id": message["id"], "stdout": stdout.decode("utf-8"),
+                "stderr": stderr.decode("utf-8"), "returncode": process.returncode,
+                "wall_time": time.perf_counter() - start}
+
+
+class _Job:
+    def __init__(self, job_id, argv, files):
+        self.id = job_id
+        self.argv = argv
+        self.files = files
+        self.attempts = 0
+        self.worker = None
+        self.future = concurrent.futures.Future()
+
+
+class Coordinator:
+    """
+    Work queue that dispatches runs of Uppaal Stratego to a pool of :class:`~VerifytaWorker`.
+
+    Each worker gets one connection that handles one job at a time; to run several jobs on one
+    host at once, start several workers there. A job whose connection fails is put back in the
+    queue and retried on any worker up to *retries* times. Idle connections are checked every
+    *health_interval* seconds, and lost workers are reconnected at the same interval.
+
+    :param workers: The addresses of the workers, each a TCP address ``(host, port)`` or the path
+        of a Unix socket.
+    :type workers: list
+    :param retries: The number of times a job is retried after a connection failure.
+    :type retries: int
+    :param health_interval: The interval in seconds of the health checks.
+    :type health_interval: float
+    :param connect_timeout: The timeout in seconds for connecting to a worker and for health checks.
+    :type connect_timeout: float
+    :param secret: The shared secret of the workers, see :class:`~VerifytaWorker`.
+    :type secret: str or bytes
+    :ivar workers: The state of each worker, a dictionary with the ``address``, whether it is
+        ``healthy``, and the number of ``jobs`` and connection ``failures``.
+    :vartype workers: list
+    """
+
+    def __init__(self, workers, retries=2, health_interval=5.0, connect_timeout=5.0, secret=None):
+        self.retries = retries
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.secret = secret
+        self.workers = [{"address": address, "healthy": False, "jobs": 0, "failures": 0}
+                        for address in workers]
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._health = threading.Condition()
+        self._ids = itertools.count()
+        self._closed = threading.Event()
+        self._threads = [threading.Thread(target=self._dispatch, args=(worker,), daemon=True)
+                         for worker in self.workers]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, argv, files=None):
+        """
+        Queue a run of Uppaal Stratego.
+
+        :param argv: The argument list.
+        :type argv: list
+        :param files: Dictionary containing pairs of an index in *argv* and the path of a local
+            file that is shipped to the worker, whose path at the worker replaces the argument.
+        :type files: dict
+        :return: Future of the result, a dictionary with ``stdout``, ``stderr``, ``returncode``
+            and ``wall_time``.
+        :rtype: :class:`concurrent.futures.Future`
+        """
+        if self._closed.is_set():
+            raise RuntimeError("The coordinator has been closed.")
+        shipped = {}
+        for index, path in ({} if files is None else files).items():
+            with open(path, "r") as f:
+                shipped[str(index)] = (os.path.basename(path), f.read())
+        job = _Job(next(self._ids), list(argv), shipped)
+        job.future.job = job
+        self._queue.put(job)
+        return job.future
+
+    def wait_healthy(self, timeout=None):
+        """
+        Wait until any worker is healthy.
+
+        :param timeout: The maximum time to wait in seconds, or ``None`` to wait indefinitely.
+        :type timeout: float
+        :return: Whether a worker is healthy.
+        :rtype: bool
+        """
+        with self._health:
+            return self._health.wait_for(
+                lambda: any(worker["healthy"] for worker in self.workers), timeout)
+
+    def cancel(self, future):
+        """
+        Cancel a job. A job that is running is killed at its worker.
+
+        :param future: The future returned by :meth:`submit`.
+        :type future: :class:`concurrent.futures.Future`
+        """
+        with self._lock:
+            future.cancel()
+            worker = future.job.worker
+        if worker is None:
+            return
+        try:
+            sock = _connect(worker["address"], self.connect_timeout, self.secret)
+            try:
+                _send_message(sock, {"type": "cancel", "id": future.job.id})
+                _receive_message(sock)
+            finally:
+                sock.close()
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        """
+        Stop dispatching jobs. Jobs still in the queue are cancelled.
+        """
+        self._closed.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _dispatch(self, worker):
+        sock = None
+        while not self._closed.is_set():
+            if sock is None:
+                try:
+                    sock = _connect(worker["address"], self.connect_timeout, self.secret)
+                    with self._health:
+                        worker["healthy"] = True
+                        self._health.notify_all()
+                except OSError:
+                    worker["healthy"] = False
+                    self._closed.wait(self.health_interval)
+                    continue
+            try:
+                job = self._queue.get(timeout=self.health_interval)
+            except queue.Empty:
+                try:
+                    sock.settimeout(self.connect_timeout)
+                    _send_message(sock, {"type": "ping"})
+                    _receive_message(sock)
+                except (OSError, ValueError):
+                    sock.close()
+                    sock = None
+                    worker["healthy"] = False
+                continue
+            if job is None:
+                break
+            with self._lock:
+                if job.future.cancelled():
+                    continue
+                job.worker = worker
+            try:
+                sock.settimeout(None)
+                _send_message(sock, {"type": "run", "id": job.id, "argv": job.argv,
+                                     "files": job.files})
+                result = _receive_message(sock)
+                if result.get("type") != "result":
+                    raise ValueError(f"The worker rejected the job: {result.get('error')}")
+            except (OSError, ValueError) as e:
+                sock.close()
+                sock = None
+                worker["healthy"] = False
+                worker["failures"] += 1
+                job.attempts += 1
+                with self._lock:
+                    job.worker = None
+                    if job.future.cancelled():
+                        continue
+                    if job.attempts > self.retries:
+                        job.future.set_exception(RuntimeError(
+                            f"The job {job.argv} failed {job.attempts} times, last at worker "
+                            f"{worker['address']}: {e}"))
+                        continue
+                self._queue.put(job)
+                continue
+            worker["jobs"] += 1
+            with self._lock:
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+        if sock is not None:
+            sock.close()
+
+
+class _RemoteProcess:
+    """
+    Stand-in for :class:`subprocess.Popen` of a job dispatched by a :class:`~Coordinator`.
+    """
+
+    def __init__(self, coordinator, future):
+        self.coordinator = coordinator
+        self.future = future
+        self.returncode = None
+        self._stdout = None
+        self._stderr = None
+        self._done = threading.Event()
+        self._killed = False
+        future.add_done_callback(lambda f: self._done.set())
+
+    def _resolve(self):
+        self._done.wait()
+        if self._stdout is not None:
+            return
+        if self._killed or self.future.cancelled():
+            result = {"stdout": "", "stderr": "", "returncode": -9}
+        elif self.future.exception() is not None:
+            result = {"stdout": "", "stderr": str(self.future.exception()), "returncode": None}
+        else:
+            result = self.future.result()
+        self._stdout = io.BytesIO(result["stdout"].encode("utf-8"))
+        self._stderr = io.BytesIO(result["stderr"].encode("utf-8"))
+        self.returncode = result["returncode"]
+
+    @property
+    def stdout(self):
+        self._resolve()
+        return self._stdout
+
+    @property
+    def stderr(self):
+        self._resolve()
+        return self._stderr
+
+    def poll(self):
+        if not self._done.is_set():
+            return None
+        self._resolve()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._resolve()
+        return self.returncode
+
+    def communicate(self, timeout=None):
+        self._resolve()
+        return self._stdout.read(), self._stderr.read()
+
+    def kill(self):
+        self._killed = True
+        self._done.set()
+        self.coordinator.cancel(self.future)
+
+
+class RemoteLauncher(ProcessLauncher):
+    """
+    Launcher that runs Uppaal Stratego at the workers of a :class:`~Coordinator` instead of
+    locally, such that it can be used wherever a launcher is accepted, for example by
+    :class:`~MPCsetup`.
+
+    The model file and the query file in the argument list are shipped to the worker. Files that
+    the queries refer to, like saved strategies, are not.
+
+    :param coordinator: The coordinator of the workers.
+    :type coordinator: :class:`~Coordinator`
+    """
+
+    def __init__(self, coordinator):
+        super().__init__()
+        self.coordinator = coordinator
+
+    def available(self, command):
+        """
+        Check whether any worker can be reached. The command itself is resolved by the workers.
+
+        :param command: The command name.
+        :type command: str
+        :return: Whether a worker is healthy, waiting up to the connection timeout for the first
+            connections.
+        :rtype: bool
+        """
+        return self.coordinator.wait_healthy(self.coordinator.connect_timeout)
+
+    def launch(self, argv):
+        """
+        Dispatch the run to a worker without waiting for it to finish.
+
+        :param argv: The argument list, as created by :func:`verifyta_argv`.
+        :type argv: list
+        :return: The remote process.
+        """
+        files = {index: argv[index] for index in (1, 2)
+                 if index < len(argv) and os.path.isfile(argv[index])}
+        return _RemoteProcess(self.coordinator, self.coordinator.submit(argv, files))
+
+
+def check_stratego_error(error, argv):
+    """
+    Raise an error if Uppaal Stratego wrote anything to its standard error.
+
+    :param error: The standard error output of Uppaal Stratego.
+    :type error: str
+    :param argv: The argument list with which Uppaal Stratego was run.
+    :type argv: list
+    """
+    if len(error) > 0:
+        raise RuntimeError("Uppaal finished with the following error message:\n\n" + error +
+                           "\n" +
+                           "You can run the following command in a terminal to recreate the error:\n\n" +
+                           format_command(argv))
+
+
+def run_stratego(model_file, query_file="", learning_args=None, verifyta_command="verifyta",
+                 launcher=None):
+    """
+    Run command line version of Uppaal Stratego.
+
+    :param model_file: The file name of the model.
+    :type model_file: str
+    :param query_file: The file name of the query.
+    :type query_file: str
+    :param learning_args: Dictionary containing the learning parameters and their values. The
+        learning parameter names should be those used in the command line interface of Uppaal
+        Stratego. You can also include non-learning command line parameters in this dictionary.
+        If a non-learning command line parameter does not take any value, include the empty
+        string ``""`` as value.
+    :type learning_args: dict
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param launcher: The launcher that starts Uppaal Stratego. Defaults to a shared
+        :class:`~ProcessLauncher` without resource settings.
+    :type launcher: :class:`~ProcessLauncher`
+    :return: The output as produced by Uppaal Stratego.
+    :rtype: str
+    """
+    launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+    argv = verifyta_argv(model_file, query_file, learning_args, verifyta_command)
+    run = launcher.run(argv)
+    result = [run.stdout, run.stderr]
+    check_stratego_error(result[1], argv)
+    return result
+
+
+def stream_stratego(model_file, query_file="", learning_args=None, verifyta_command="verifyta",
+                    launcher=None, chunk_size=None):
+    """
+    Run command line version of Uppaal Stratego and yield its output line by line as it arrives,
+    or in chunks of at most *chunk_size* bytes if given.
+
+    Closing the generator before it is exhausted kills Uppaal Stratego.
+
+    :param model_file: The file name of the model.
+    :type model_file: str
+    :param query_file: The file name of the query.
+    :type query_file: str
+    :param learning_args: Dictionary containing the learning parameters and their values. The
+        learning parameter names should be those used in the command line interface of Uppaal
+        Stratego. You can also include non-learning command line parameters in this dictionary.
+        If a non-learning command line parameter does not take any value, include the empty
+        string ``""`` as value.
+    :type learning_args: dict
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :param chunk_size: The maximum number of bytes read at once. If given, the output is yielded
+        in chunks as it arrives instead of line by line, such that long lines are not read as a
+        whole.
+    :type chunk_size: int
+    :return: Generator of the lines or chunks written by Uppaal Stratego to its standard output.
+    :rtype: generator
+    """
+    launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+    argv = verifyta_argv(model_file, query_file, learning_args, verifyta_command)
+
+    start = time.perf_counter()
+    process = launcher.launch(argv)
+    spawned = time.perf_counter()
+    # Drain stderr in the background, such that a full stderr pipe cannot block Uppaal Stratego.
+    errors = []
+    stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()))
+    stderr_reader.daemon = True
+    stderr_reader.start()
+    try:
+        if chunk_size is None:
+            for line in iter(process.stdout.readline, b""):
+                yield line.decode("utf-8")
+        else:
+            # A chunk can end within a multi-byte character, which the decoder keeps for the next.
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            read = getattr(process.stdout, "read1", process.stdout.read)
+            for data in iter(functools.partial(read, chunk_size), b""):
+                yield decoder.decode(data)
+            yield decoder.decode(b"", final=True)
+        stderr_reader.join()
+        cpu_time, peak_rss = _wait_with_rusage(process)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    error = b"".join(errors).decode("utf-8")
+    _record_launch(LaunchResult(argv, None, error, process.returncode, spawned - start,
+                                          time.perf_counter() - start, cpu_time, peak_rss))
+    check_stratego_error(error, argv)
+
+
+def parse_stratego(model_file, query_file="", learning_args=None, verifyta_command="verifyta",
+                   memory_limit=None, spill_directory=None, chunk_size=1 << 16, launcher=None):
+    """
+    Run command line version of Uppaal Stratego and parse its simulate output in chunks as it
+    arrives, without keeping the output text. Use this for outputs too large to hold in memory.
+
+    :param model_file: The file name of the model.
+    :type model_file: str
+    :param query_file: The file name of the query.
+    :type query_file: str
+    :param learning_args: Dictionary containing the learning parameters and their values. The
+        learning parameter names should be those used in the command line interface of Uppaal
+        Stratego. You can also include non-learning command line parameters in this dictionary.
+        If a non-learning command line parameter does not take any value, include the empty
+        string ``""`` as value.
+    :type learning_args: dict
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param memory_limit: The maximum number of bytes of parsed runs kept in memory before they are
+        moved to a spill file, see :class:`~SimulateParser`.
+    :type memory_limit: int
+    :param spill_directory: The directory of the spill file.
+    :type spill_directory: str
+    :param chunk_size: The maximum number of bytes of output read at once.
+    :type chunk_size: int
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :return: The closed parser that has been fed with the output.
+    :rtype: :class:`~SimulateParser`
+    """
+    parser = SimulateParser(memory_limit, spill_directory)
+    for chunk in stream_stratego(model_file, query_file, learning_args, verifyta_command, launcher,
+                                 chunk_size):
+        parser.feed_chunk(chunk)
+    parser.close()
+    return parser
+
+
+def run_stratego_streaming(model_file, query_file="", learning_args=None,
+                           verifyta_command="verifyta", callback=None, abort_on_failure=False,
+                           launcher=None):
+    """
+    Run command line version of Uppaal Stratego while parsing its output incrementally.
+
+    :param model_file: The file name of the model.
+    :type model_file: str
+    :param query_file: The file name of the query.
+    :type query_file: str
+    :param learning_args: Dictionary containing the learning parameters and their values. The
+        learning parameter names should be those used in the command line interface of Uppaal
+        Stratego. You can also include non-learning command line parameters in this dictionary.
+        If a non-learning command line parameter does not take any value, include the empty
+        string ``""`` as value.
+    :type learning_args: dict
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param callback: Function called with each line and the :class:`~SimulateParser` after the line
+        has been parsed. If it returns ``True``, Uppaal Stratego is killed.
+    :type callback: callable
+    :param abort_on_failure: Whether to kill Uppaal Stratego as soon as it reports that a formula
+        is not satisfied.
+    :type abort_on_failure: bool
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :return: The output produced by Uppaal Stratego until it finished or was killed, and the parser
+        that has been fed with it.
+    :rtype: tuple(str, :class:`~SimulateParser`)
+    """
+    parser = SimulateParser()
+    lines = []
+    stream = stream_stratego(model_file, query_file, learning_args, verifyta_command, launcher)
+    try:
+        for line in stream:
+            lines.append(line)
+            parser.feed(line)
+            if callback is not None and callback(line, parser):
+                break
+            if abort_on_failure and parser.failed:
+                break
+    finally:
+        stream.close()
+    return "".join(lines), parser
+
+
+async def async_run_stratego(model_file, query_file="", learning_args=None,
+                             verifyta_command="verifyta", launcher=None, semaphore=None):
+    """
+    Run command line version of Uppaal Stratego as an asyncio subprocess.
+
+    This is the asynchronous counterpart of :func:`run_stratego`, such that a single event loop can
+    run many instances of Uppaal Stratego concurrently.
+
+    :param model_file: The file name of the model.
+    :type model_file: str
+    :param query_file: The file name of the query.
+    :type query_file: str
+    :param learning_args: Dictionary containing the learning parameters and their values. The
+        learning parameter names should be those used in the command line interface of Uppaal
+        Stratego. You can also include non-learning command line parameters in this dictionary.
+        If a non-learning command line parameter does not take any value, include the empty
+        string ``""`` as value.
+    :type learning_args: dict
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :param semaphore: Semaphore that limits how many instances of Uppaal Stratego run at the same
+        time.
+    :type semaphore: :class:`asyncio.Semaphore`
+    :return: The output as produced by Uppaal Stratego.
+    :rtype: list
+    """
+    launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+    argv = verifyta_argv(model_file, query_file, learning_args, verifyta_command)
+    if semaphore is None:
+        run = await launcher.arun(argv)
+    else:
+        async with semaphore:
+            run = await launcher.arun(argv)
+    result = [run.stdout, run.stderr]
+    check_stratego_error(result[1], argv)
+    return result
+
+
+async def _maybe_await(value):
+    """
+    Await the value if it is awaitable, such that overridden hooks can be either plain methods or
+    coroutine methods.
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class Portfolio:
+    """
+    Portfolio of Uppaal Stratego runs with different random seeds, and optionally different
+    learning methods, that run in parallel. The run with the best expected cost is selected.
+
+    The expected cost is read from the output with *cost_pattern*. By default, this is the result
+    of an expectation query like ``E[<=10;100] (max: c) under opt``, which should then be part of
+    the query file.
+
+    :param size: The number of runs in the portfolio.
+    :type size: int
+    :param seeds: The seeds of the runs. Defaults to ``1, ..., size``.
+    :type seeds: list
+    :param learning_methods: The learning methods of the runs, which are assigned to the runs in
+        turn. Defaults to the learning method in the learning arguments.
+    :type learning_methods: list
+    :param cores: The maximum number of runs, and therefore cores, used. Defaults to the number of
+        cores of the machine.
+    :type cores: int
+    :param time_budget: The wall-clock time in seconds after which unfinished runs are killed.
+    :type time_budget: float
+    :param cost_pattern: Regular expression with a single group that captures the expected cost.
+        Defaults to the result line ``E(max) = <value>`` of an expectation query.
+    :type cost_pattern: str
+    :param minimize: Whether a lower expected cost is better.
+    :type minimize: bool
+    """
+
+    def __init__(self, size, seeds=None, learning_methods=None, cores=None, time_budget=None,
+                 cost_pattern=None, minimize=True):
+        if cores is None:
+            cores = os.cpu_count() or 1
+        if seeds is not None:
+            size = min(size, len(seeds))
+        self.size = max(1, min(size, cores))
+        self.seeds = list(range(1, self.size + 1)) if seeds is None else list(seeds)[:self.size]
+        self.learning_methods = learning_methods
+        self.time_budget = time_budget
+        self.cost_pattern = re.compile(_EXPECTED_COST_PATTERN if cost_pattern is None
+                                       else cost_pattern)
+        self.minimize = minimize
+
+    def cost(self, output):
+        """
+        Extract the expected cost from the output of a run.
+
+        :param output: The output generated by Uppaal Stratego.
+        :type output: str
+        :return: The last expected cost in the output, or ``None`` if there is none.
+        :rtype: float
+        """
+        costs = self.cost_pattern.findall(output)
+        return float(costs[-1]) if costs else None
+
+    def member_args(self, learning_args, index):
+        """
+        Create the learning arguments of a single run in the portfolio.
+
+        :param learning_args: Dictionary containing the shared learning parameters.
+        :type learning_args: dict
+        :param index: The index of the run.
+        :type index: int
+        :return: The learning arguments including the seed and learning method of the run.
+        :rtype: dict
+        """
+        args = dict(learning_args)
+        args["seed"] = self.seeds[index]
+        if self.learning_methods:
+            args["learning-method"] = self.learning_methods[index % len(self.learning_methods)]
+        return args
+
+    def run(self, model_file, query_file="", learning_args=None, verifyta_command="verifyta",
+            launcher=None):
+        """
+        Run all members of the portfolio in parallel and select the best output.
+
+        :param model_file: The file name of the model.
+        :type model_file: str
+        :param query_file: The file name of the query.
+        :type query_file: str
+        :param learning_args: Dictionary containing the learning parameters and their values.
+        :type learning_args: dict
+        :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+        :type verifyta_command: str
+        :param launcher: The launcher that starts Uppaal Stratego.
+        :type launcher: :class:`~ProcessLauncher`
+        :return: The selected output, and a list with the outcome of each run, i.e., a dictionary
+            with its ``learning_args``, ``status`` (``"finished"``, ``"killed"`` or ``"error"``),
+            whether it is ``satisfied``, its ``cost``, its ``wall_time`` and whether it is
+            ``selected``.
+        :rtype: tuple(str, list)
+        """
+        learning_args = {} if learning_args is None else learning_args
+        launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+        members = [(self.member_args(learning_args, i), _CancellableLauncher(launcher))
+                   for i in range(self.size)]
+
+        def run_member(args, member_launcher):
+            start = time.perf_counter()
+            output = run_stratego(model_file, query_file, args, verifyta_command,
+                                  member_launcher)[0]
+            return output, time.perf_counter() - start
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.size)
+        try:
+            futures = [executor.submit(run_member, args, member_launcher)
+                       for args, member_launcher in members]
+            concurrent.futures.wait(futures, timeout=self.time_budget)
+            for _, member_launcher in members:
+                member_launcher.cancel()
+        finally:
+            executor.shutdown(wait=True)
+
+        outcomes = []
+        outputs = []
+        for (args, member_launcher), future in zip(members, futures):
+            outcome = {"learning_args": args, "status": "finished", "satisfied": False,
+                       "cost": None, "wall_time": None, "selected": False}
+            output = None
+            if member_launcher.killed:
+                outcome["status"] = "killed"
+            elif future.exception() is not None:
+                outcome["status"] = "error"
+            else:
+                output, outcome["wall_time"] = future.result()
+                outcome["satisfied"] = successful_result(output)
+                outcome["cost"] = self.cost(output)
+            outcomes.append(outcome)
+            outputs.append(output)
+
+        best = None
+        for i, outcome in enumerate(outcomes):
+            if outputs[i] is None:
+                continue
+            if best is None or self._better(outcome, outcomes[best]):
+                best = i
+        if best is None:
+            errors = [f.exception() for f in futures if not f.cancelled() and f.exception()]
+            if errors:
+                raise errors[0]
+            raise DeadlineExceeded("No run of the portfolio finished within the time budget.")
+        outcomes[best]["selected"] = True
+        return outputs[best], outcomes
+
+    def _better(self, outcome, other):
+        if outcome["satisfied"] != other["satisfied"]:
+            return outcome["satisfied"]
+        if outcome["cost"] is None:
+            return False
+        if other["cost"] is None:
+            return True
+        if self.minimize:
+            return outcome["cost"] < other["cost"]
+        return outcome["cost"] > other["cost"]
+
+
+class BudgetScheduler:
+    """
+    Base class of schedulers that choose the learning arguments and the horizon of each MPC step.
+
+    :meth:`MPCsetup.step_without_sim` calls :meth:`schedule` before a step and :meth:`record` with
+    the measured synthesis time after it. This base class keeps the settings of the setup.
+
+    :ivar history: The scheduled steps, each a dictionary with the ``step``, the scheduled
+        ``learning_args`` and ``horizon``, and the measured ``synthesis_time`` in seconds.
+    :vartype history: list
+    """
+
+    def __init__(self):
+        self.history = []
+
+    def schedule(self, step, state):
+        """
+        Choose the settings of a step.
+
+        :param step: The step.
+        :type step: int
+        :param state: The current state.
+        :type state: dict
+        :return: The learning arguments that are added to those of the setup, and the horizon,
+            either of which is ``None`` to keep the setting of the setup.
+        :rtype: tuple
+        """
+        return None, None
+
+    def record(self, step, learning_args, horizon, synthesis_time):
+        """
+        Record the synthesis time of a scheduled step.
+
+        :param step: The step.
+        :type step: int
+        :param learning_args: The learning arguments returned by :meth:`schedule`.
+        :type learning_args: dict
+        :param horizon: The horizon returned by :meth:`schedule`.
+        :type horizon: int
+        :param synthesis_time: The time in seconds it took to run Uppaal Stratego.
+        :type synthesis_time: float
+        """
+        self.history.append({"step": step, "learning_args": learning_args, "horizon": horizon,
+                             "synthesis_time": synthesis_time})
+
+
+class AdaptiveBudgetScheduler(BudgetScheduler):
+    """
+    Scheduler that spends more learning effort when the state is critical, as long as the
+    synthesis fits in the wall-clock budget of a control period.
+
+    The effort levels are ordered from cheapest to most expensive. The *criticality* of the state,
+    between 0 and 1, selects the desired level. The most expensive level up to the desired one is
+    chosen whose predicted synthesis time fits in *period_budget*. The prediction of a level is the
+    mean synthesis time of its last *window* steps. A level that has not been measured yet is
+    predicted to take *growth* times as long as the nearest cheaper level that has been measured.
+    If no level fits, the cheapest one is chosen.
+
+    :param levels: The learning arguments of each level, from cheapest to most expensive.
+    :type levels: list
+    :param period_budget: The wall-clock time in seconds available for the synthesis of a step.
+    :type period_budget: float
+    :param criticality: Function that maps the state to its criticality between 0 and 1. Defaults
+        to always 1, such that the most expensive level that fits is chosen.
+    :type criticality: callable
+    :param horizons: The horizon of each level. Defaults to the horizon of the setup.
+    :type horizons: list
+    :param window: The number of recent steps per level used to predict its synthesis time.
+    :type window: int
+    :param growth: The factor by which an unmeasured level is predicted to be slower than the
+        cheaper one.
+    :type growth: float
+    """
+
+    def __init__(self, levels, period_budget, criticality=None, horizons=None, window=5,
+                 growth=2.0):
+        super().__init__()
+        if horizons is not None and len(horizons) != len(levels):
+            raise RuntimeError("Provide one horizon per level of learning arguments.")
+        self.levels = levels
+        self.period_budget = period_budget
+        self.criticality = (lambda state: 1.0) if criticality is None else criticality
+        self.horizons = horizons
+        self.window = window
+        self.growth = growth
+        self._times = [[] for _ in levels]
+
+    def predict(self, level):
+        """
+        Predict the synthesis time of a level.
+
+        :param level: The index of the level.
+        :type level: int
+        :return: The predicted synthesis time in seconds, or ``None`` if no level up to *level*
+            has been measured.
+        :rtype: float
+        """
+        for lower in range(level, -1, -1):
+            times = self._times[lower]
+            if times:
+                return sum(times) / len(times) * self.growth ** (level - lower)
+        return None
+
+    def schedule(self, step, state):
+        criticality = min(max(self.criticality(state), 0.0), 1.0)
+        level = int(round(criticality * (len(self.levels) - 1)))
+        while level > 0:
+            predicted = self.predict(level)
+            if predicted is None or predicted <= self.period_budget:
+                break
+            level -= 1
+        horizon = None if self.horizons is None else self.horizons[level]
+        return self.levels[level], horizon
+
+    def record(self, step, learning_args, horizon, synthesis_time):
+        super().record(step, learning_args, horizon, synthesis_time)
+        times = self._times[self.levels.index(learning_args)]
+        times.append(synthesis_time)
+        del times[:-self.window]
+
+
+def successful_result(text):
+    """
+    Verify whether the stratego output is based on the successful synthesis of a strategy.
+
+    :param text: The output generated by Uppaal Stratego.
+    :type text: str
+    :return: Whether Uppaal Stratego has successfuly ran all queries.
+    :rtype: bool
+    """
+    result = re.search("Formula is satisfied", text)
+    return result is not None
+
+
+class Workspace:
+    """
+    Private directory for the temporary files of a single controller.
+
+    Every controller that writes its simulation, query and debug files to its own workspace can
+    run concurrently with other controllers, also when they share the same template model. The
+    directory and its content are removed by :meth:`cleanup`, when leaving the ``with`` block, or
+    when the workspace is garbage collected.
+
+    :param root: The directory in which the workspace is created. Defaults to the temporary
+        directory of the system.
+    :type root: str
+    :param tmpfs: Whether to create the workspace in the memory-backed ``/dev/shm`` directory. If
+        that directory is not available, *root* is used instead.
+    :type tmpfs: bool
+    :param keep: Whether to keep the directory after the workspace is no longer used, for example
+        for debugging.
+    :type keep: bool
+    :param directory: An existing directory to use as workspace instead of creating a new one, for
+        example to resume from a checkpoint written to it. It is created if needed and always kept.
+    :type directory: str
+    :ivar directory: The path of the workspace directory.
+    :vartype directory: str
+    """
+
+    def __init__(self, root=None, tmpfs=False, keep=False, directory=None):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+            keep = True
+        else:
+            if tmpfs and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+                root = "/dev/shm"
+            self.directory = tempfile.mkdtemp(prefix="strategoutil-", dir=root)
+        self.keep = keep
+        if keep:
+            self._finalizer = None
+        else:
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory,
+                                               ignore_errors=True)
+
+    def path(self, name):
+        """
+        Get the path of a file inside the workspace.
+
+        :param name: The file name. Any directory part is discarded.
+        :type name: str
+        :return: The path of the file inside the workspace directory.
+        :rtype: str
+        """
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def cleanup(self):
+        """
+        Remove the workspace directory and all its content, unless the workspace should be kept.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+_VERIFYTA_VERSIONS = {}
+
+
+def verifyta_version(verifyta_command="verifyta", launcher=None):
+    """
+    Get the version string of Uppaal Stratego. The version is requested once per command.
+
+    :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+    :type verifyta_command: str
+    :param launcher: The launcher that starts Uppaal Stratego.
+    :type launcher: :class:`~ProcessLauncher`
+    :return: The version as printed by ``verifyta --version``.
+    :rtype: str
+    """
+    if verifyta_command not in _VERIFYTA_VERSIONS:
+        launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+        run = launcher.run(split_command(verifyta_command) + ["--version"])
+        _VERIFYTA_VERSIONS[verifyta_command] = run.stdout.strip()
+    return _VERIFYTA_VERSIONS[verifyta_command]
+
+
+class _FileLock:
+    """
+    Exclusive lock on a file shared between processes. Locking is only performed on systems that
+    provide :mod:`fcntl`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+class SynthesisCache:
+    """
+    Content-addressed on-disk cache of Uppaal Stratego outputs.
+
+    Outputs are stored under a hash of the model, the query, the learning arguments and the version
+    of Uppaal Stratego. When the total size of the cache exceeds *max_size*, the least recently used
+    entries are removed. The cache directory can be shared by several processes.
+
+    :param directory: The directory where the cache entries are stored.
+    :type directory: str
+    :param max_size: The maximum total size of the cache entries in bytes. Unlimited if ``None``.
+    :type max_size: int
+    :param quantize: Function that maps a state dictionary to a quantized state dictionary. The key
+        of a run is then based on the model with the quantized state inserted, such that nearly
+        equal states share the same cache entry.
+    :type quantize: callable
+    :ivar hits: The number of lookups that found an entry.
+    :vartype hits: int
+    :ivar misses: The number of lookups that did not find an entry.
+    :vartype misses: int
+    """
+
+    def __init__(self, directory, max_size=None, quantize=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.quantize = quantize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = os.path.join(directory, ".lock")
+
+    @staticmethod
+    def key(model_text, query_text, learning_args, version):
+        """
+        Compute the cache key of a run.
+
+        :param model_text: The content of the model file.
+        :type model_text: str
+        :param query_text: The content of the query file.
+        :type query_text: str
+        :param learning_args: Dictionary containing the learning parameters and their values.
+        :type learning_args: dict
+        :param version: The version of Uppaal Stratego.
+        :type version: str
+        :return: The hexadecimal SHA-256 digest identifying the run.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        for part in (model_text, query_text, merge_verifyta_args(learning_args), version):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key + ".out")
+
+    def get(self, key):
+        """
+        Look up the output stored under the key.
+
+        :param key: The cache key.
+        :type key: str
+        :return: The stored output, or ``None`` if there is no entry.
+        :rtype: str
+        """
+        entry = self._entry(key)
+        with _FileLock(self._lock_file):
+            try:
+                with open(entry, "r") as f:
+                    output = f.read()
+                os.utime(entry)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        """
+        Store the output under the key and evict entries if the cache is too large.
+
+        :param key: The cache key.
+        :type key: str
+        :param output: The output generated by Uppaal Stratego.
+        :type output: str
+        """
+        entry = self._entry(key)
+        with _FileLock(self._lock_file):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(output)
+            os.replace(tmp, entry)
+            if self.max_size is not None:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".out"):
+                info = os.stat(os.path.join(self.directory, name))
+                entries.append((info.st_mtime, info.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def statistics(self):
+        """
+        Get the statistics of the cache.
+
+        :return: Dictionary with the number of hits, misses, entries and the total size in bytes.
+        :rtype: dict
+        """
+        sizes = [os.path.getsize(os.path.join(self.directory, name))
+                 for name in os.listdir(self.directory) if name.endswith(".out")]
+        return {"hits": self.hits, "misses": self.misses, "entries": len(sizes),
+                "size": sum(sizes)}
+
+
+class StrategyStore:
+    """
+    Small store of strategies saved by Uppaal Stratego, such that an MPC step can reuse the
+    strategy of an earlier step instead of learning a new one.
+
+    Each step that learns a strategy saves it with a ``saveStrategy`` query. A later step reuses the
+    stored strategy of the nearest state with a ``loadStrategy`` query instead of the learning
+    query, if all observed state variables are within *tolerance* of that state and the strategy
+    has been reused less than *max_reuses* times. The observed variables are those in *discrete* and
+    *continuous*, or all state variables if neither is given, such that for example the clock does
+    not prevent reuse. Non-numeric values, such as strings, must be equal. Otherwise, a new strategy is learned. The queries are
+    rewritten after :meth:`MPCsetup.create_query_file`, where the learning query is the line that
+    defines the strategy named *strategy_name*.
+
+    :param directory: The directory where the strategy files are stored.
+    :type directory: str
+    :param tolerance: The maximum absolute difference between the current and the stored state,
+        either a single value or a dictionary with a value per observed variable, where unlisted
+        variables must be equal.
+    :type tolerance: float or dict
+    :param max_reuses: The number of times a strategy can be reused before it is learned again.
+    :type max_reuses: int
+    :param max_strategies: The maximum number of stored strategies. The oldest one is removed when
+        a new one is stored.
+    :type max_strategies: int
+    :param strategy_name: The name of the strategy in the query file.
+    :type strategy_name: str
+    :param discrete: The discrete variables the strategy observes, as listed in the learning query.
+    :type discrete: list
+    :param continuous: The continuous variables the strategy observes, as listed in the learning
+        query.
+    :type continuous: list
+    :ivar fresh: The number of steps that learned a new strategy.
+    :vartype fresh: int
+    :ivar reused: The number of steps that reused a stored strategy.
+    :vartype reused: int
+    :ivar time_saved: The estimated learning time in seconds saved by reusing strategies, as the
+        difference between the time it took to learn the reused strategy and the time of the step
+        that reused it.
+    :vartype time_saved: float
+    """
+
+    def __init__(self, directory, tolerance=0.0, max_reuses=5, max_strategies=8,
+                 strategy_name="opt", discrete=None, continuous=None):
+        self.directory = os.path.abspath(directory)
+        self.tolerance = tolerance
+        self.max_reuses = max_reuses
+        self.max_strategies = max_strategies
+        self.strategy_name = strategy_name
+        self.discrete = [] if discrete is None else discrete
+        self.continuous = [] if continuous is None else continuous
+        self.entries = []
+        self.fresh = 0
+        self.reused = 0
+        self.time_saved = 0.0
+        self._counter = itertools.count()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def lookup(self, state):
+        """
+        Find the stored strategy that can be reused in the given state.
+
+        :param state: The current state.
+        :type state: dict
+        :return: The entry of the nearest stored state within tolerance, or ``None``.
+        :rtype: dict
+        """
+        observed = self.discrete + self.continuous
+        if observed:
+            state = {name: value for name, value in state.items() if name in observed}
+        best = None
+        best_distance = None
+        for entry in self.entries:
+            if entry["reuses"] >= self.max_reuses or \
+                    not _within_tolerance(entry["state"], state, self.tolerance):
+                continue
+            distance = max([abs(entry["state"][name] - value) for name, value in state.items()
+                            if _is_number(value)], default=0.0)
+            if best is None or distance < best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def prepare_query(self, query_file, state):
+        """
+        Rewrite the query file such that it either reuses a stored strategy or saves the newly
+        learned one.
+
+        :param query_file: The file name of the query file.
+        :type query_file: str
+        :param state: The current state.
+        :type state: dict
+        :return: The plan of the step, to be passed to :meth:`record`.
+        :rtype: dict
+        """
+        entry = self.lookup(state)
+        with open(query_file, "r") as f:
+            lines = f.read().splitlines()
+        index = None
+        for i, line in enumerate(lines):
+            if re.match(r"\s*strategy\s+" + re.escape(self.strategy_name) + r"\s*=", line):
+                index = i
+        if index is None:
+            raise RuntimeError(
+                f"The query file {query_file} does not define strategy {self.strategy_name}.")
+        if entry is None:
+            path = os.path.join(self.directory, f"strategy_{next(self._counter)}.json")
+            lines.insert(index + 1, f'saveStrategy("{path}", {self.strategy_name})')
+        else:
+            path = entry["path"]
+            lines[index] = (f"strategy {self.strategy_name} = loadStrategy "
+                            f"{{{', '.join(self.discrete)}}} -> {{{', '.join(self.continuous)}}} "
+                            f'("{path}")')
+        with open(query_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return {"entry": entry, "path": path, "state": dict(state)}
+
+    def record(self, plan, synthesis_time, success):
+        """
+        Record the outcome of a step prepared by :meth:`prepare_query`.
+
+        A newly learned strategy is stored if the step succeeded. A reused strategy that failed is
+        removed.
+
+        :param plan: The plan returned by :meth:`prepare_query`.
+        :type plan: dict
+        :param synthesis_time: The time in seconds the step took.
+        :type synthesis_time: float
+        :param success: Whether the step succeeded.
+        :type success: bool
+        """
+        entry = plan["entry"]
+        if entry is not None:
+            if success:
+                self.reused += 1
+                entry["reuses"] += 1
+                self.time_saved += entry["learning_time"] - synthesis_time
+            else:
+                self.discard(entry)
+            return
+        self.fresh += 1
+        if not success or not os.path.exists(plan["path"]):
+            return
+        self.entries.append({"state": plan["state"], "path": plan["path"],
+                             "learning_time": synthesis_time, "reuses": 0})
+        while len(self.entries) > self.max_strategies:
+            self.discard(self.entries[0])
+
+    def discard(self, entry):
+        """
+        Remove a stored strategy.
+
+        :param entry: The entry of the strategy.
+        :type entry: dict
+        """
+        self.entries.remove(entry)
+        if os.path.exists(entry["path"]):
+            os.remove(entry["path"])
+
+    def statistics(self):
+        """
+        Get the statistics of the store.
+
+        :return: Dictionary with the number of ``fresh`` and ``reused`` steps, the estimated
+            ``time_saved`` in seconds and the number of stored ``entries``.
+        :rtype: dict
+        """
+        return {"fresh": self.fresh, "reused": self.reused, "time_saved": self.time_saved,
+                "entries": len(self.entries)}
+
+
+_thread_time = getattr(time, "thread_time", time.process_time)
+
+
+class _NoPhase:
+    """
+    Context manager that does nothing, used for phases when no profiler is set.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class Profiler:
+    """
+    Records the wall-clock and CPU time of the phases of the MPC steps, such that one can see where
+    the time of a step goes.
+
+    Each record is a dictionary with the ``step``, the ``phase`` name, the ``start`` time in
+    seconds since the profiler was created, the ``wall_time`` and the ``cpu_time`` of the Python
+    thread in seconds, the ``thread`` identifier, and the ``verifyta_cpu_time`` in seconds and
+    ``peak_rss`` in bytes of the verifyta processes launched during the phase. The last two are
+    ``None`` if no process was launched, or if the system does not report resource usage.
+
+    The asynchronous methods of :class:`~MPCsetup` are not profiled apart from the ``render`` and
+    ``query`` phases, since their steps interleave in a single thread. Their processes do not
+    report resource usage either.
+
+    :param hooks: Functions that are called with each record when its phase has finished.
+    :type hooks: list
+    :ivar records: The records of all finished phases, in order of finishing.
+    :vartype records: list
+    """
+
+    def __init__(self, hooks=None):
+        self.records = []
+        self.hooks = [] if hooks is None else list(hooks)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Add a function that is called with each record when its phase has finished.
+
+        :param hook: The function, taking the record dictionary as its only argument.
+        :type hook: callable
+        """
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def phase(self, name, step=None):
+        """
+        Context manager that records the time spent in its body as a phase.
+
+        Processes started by a :class:`~ProcessLauncher` from the same thread within the body are
+        accounted to the phase.
+
+        :param name: The name of the phase.
+        :type name: str
+        :param step: The MPC step the phase belongs to.
+        :type step: int
+        """
+        outer = getattr(_LAUNCH_RECORDING, "results", None)
+        launches = []
+        _LAUNCH_RECORDING.results = launches
+        start = time.perf_counter()
+        cpu_start = _thread_time()
+        try:
+            yield
+        finally:
+            cpu_time = _thread_time() - cpu_start
+            wall_time = time.perf_counter() - start
+            _LAUNCH_RECORDING.results = outer
+            if outer is not None:
+                outer.extend(launches)
+            child_cpu_times = [r.cpu_time for r in launches if r.cpu_time is not None]
+            peak_rss = [r.peak_rss for r in launches if r.peak_rss is not None]
+            record = {"step": step, "phase": name, "start": start - self._origin,
+                      "wall_time": wall_time, "cpu_time": cpu_time,
+                      "verifyta_cpu_time": sum(child_cpu_times) if child_cpu_times else None,
+                      "peak_rss": max(peak_rss) if peak_rss else None,
+                      "thread": threading.get_ident()}
+            with self._lock:
+                self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def summary(self):
+        """
+        Summarize the records per phase.
+
+        :return: Dictionary with for each phase the number of records ``count``, and the
+            ``total`` and ``mean`` wall-clock time in seconds.
+        :rtype: dict
+        """
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(record["phase"], {"count": 0, "total": 0.0})
+            entry["count"] += 1
+            entry["total"] += record["wall_time"]
+        for entry in summary.values():
+            entry["mean"] = entry["total"] / entry["count"]
+        return summary
+
+    def to_csv(self, path):
+        """
+        Write the records to a CSV file with a header row.
+
+        :param path: The file name of the CSV file.
+        :type path: str
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=_PROFILE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def to_json(self, path):
+        """
+        Write the records to a JSON file as a list of objects.
+
+        :param path: The file name of the JSON file.
+        :type path: str
+        """
+        with open(path, "w") as f:
+            json.dump(self.records, f, indent=1)
+
+    def to_chrome_trace(self, path):
+        """
+        Write the records to a file in the Chrome trace event format, which can be opened in
+        ``chrome://tracing`` or Perfetto. Each phase is a complete event on the track of its thread.
+
+        :param path: The file name of the trace file.
+        :type path: str
+        """
+        events = []
+        for record in self.records:
+            args = {key: record[key] for key in ("step", "cpu_time", "verifyta_cpu_time",
+                                                 "peak_rss")}
+            events.append({"name": record["phase"], "cat": "mpc", "ph": "X",
+                           "ts": record["start"] * 1e6, "dur": record["wall_time"] * 1e6,
+                           "pid": os.getpid(), "tid": record["thread"], "args": args})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+_PROFILE_FIELDS = ["step", "phase", "start", "wall_time", "cpu_time", "verifyta_cpu_time",
+                   "peak_rss", "thread"]
+
+
+class ResultSink(abc.ABC):
+    """
+    Base class of the sinks that store the state of the MPC controller after each step.
+
+    The rows are buffered and written in batches. A batch is written when *flush_every* rows are
+    buffered, or when more than *flush_interval* seconds have passed since the last write,
+    whichever comes first. Subclasses implement :meth:`_open`, :meth:`_write_rows` and
+    :meth:`_close`, and for checkpoints also :meth:`_position` and :meth:`_truncate`.
+
+    :param flush_every: The number of buffered rows after which they are written. If ``None``,
+        rows are only written on :meth:`flush` and :meth:`close`.
+    :type flush_every: int
+    :param flush_interval: The maximum time in seconds rows are kept in the buffer. Only checked
+        when a row is added.
+    :type flush_interval: float
+    :ivar names: The names of the state variables, one per column.
+    :vartype names: list
+    """
+
+    def __init__(self, flush_every=None, flush_interval=None):
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.names = None
+        self._rows = []
+        self._is_open = False
+        self._last_flush = time.perf_counter()
+
+    def open(self, names):
+        """
+        Start a new result set with the given columns, replacing any previous results.
+
+        :param names: The names of the state variables.
+        :type names: list
+        """
+        if self._is_open:
+            self.close()
+        self.names = list(names)
+        self._rows = []
+        self._last_flush = time.perf_counter()
+        self._open(append=False)
+        self._is_open = True
+
+    def write(self, values):
+        """
+        Add a row with the values of the state variables, in the order of :attr:`names`.
+
+        Writing after :meth:`close` appends to the previous result set.
+
+        :param values: The values of the state variables.
+        :type values: list
+        """
+        if self.names is None:
+            raise RuntimeError("The result sink is written before it is opened.")
+        if len(values) != len(self.names):
+            raise RuntimeError(
+                f"Expected {len(self.names)} values, got {len(values)}: {list(values)}.")
+        self._rows.append(values)
+        full = self.flush_every is not None and len(self._rows) >= self.flush_every
+        stale = self.flush_interval is not None and \
+            time.perf_counter() - self._last_flush >= self.flush_interval
+        if full or stale:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows.
+        """
+        if self._rows:
+            if not self._is_open:
+                self._open(append=True)
+                self._is_open = True
+            self._write_rows(self._rows)
+            self._rows = []
+        self._last_flush = time.perf_counter()
+
+    def close(self):
+        """
+        Write the buffered rows and release the underlying files.
+        """
+        self.flush()
+        if self._is_open:
+            self._close()
+            self._is_open = False
+
+    def position(self):
+        """
+        Write the buffered rows and get the position in the result set, to continue from with
+        :meth:`resume`.
+
+        :return: The position.
+        :rtype: int
+        """
+        self.flush()
+        return self._position()
+
+    def resume(self, names, position):
+        """
+        Continue a result set at a position returned by :meth:`position`, removing everything
+        written after it.
+
+        :param names: The names of the state variables.
+        :type names: list
+        :param position: The position.
+        :type position: int
+        """
+        if self._is_open:
+            self._close()
+        self.names = list(names)
+        self._rows = []
+        self._truncate(position)
+        self._open(append=True)
+        self._is_open = True
+
+    @abc.abstractmethod
+    def _open(self, append):
+        """
+        Open the underlying files.
+
+        :param append: Whether to continue the previous result set instead of replacing it.
+        :type append: bool
+        """
+
+    def _position(self):
+        """
+        Get the position after the written rows.
+        """
+        raise RuntimeError(f"{type(self).__name__} does not support checkpoints.")
+
+    def _truncate(self, position):
+        """
+        Remove everything written after *position*.
+        """
+        raise RuntimeError(f"{type(self).__name__} does not support checkpoints.")
+
+    @abc.abstractmethod
+    def _write_rows(self, rows):
+        """
+        Write the rows to the open files.
+
+        :param rows: The rows, each a list of values in the order of :attr:`names`.
+        :type rows: list
+        """
+
+    @abc.abstractmethod
+    def _close(self):
+        """
+        Close the underlying files.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class CSVSink(ResultSink):
+    """
+    Result sink that writes the states as comma-separated lines with a header line, keeping the
+    file open between writes.
+
+    By default every row is written immediately, such that the file is complete after each step.
+    With a larger *flush_every*, the sink must be closed to write the remaining rows, which
+    :meth:`MPCsetup.close` does.
+
+    :param path: The file name of the CSV file.
+    :type path: str
+    :param flush_every: See :class:`~ResultSink`.
+    :type flush_every: int
+    :param flush_interval: See :class:`~ResultSink`.
+    :type flush_interval: float
+    """
+
+    def __init__(self, path, flush_every=1, flush_interval=None):
+        super().__init__(flush_every, flush_interval)
+        self.path = path
+        self._file = None
+
+    def _open(self, append):
+        self._file = open(self.path, "a" if append else "w")
+        if not append:
+            self._file.write(",".join(self.names) + "\n")
+            self._file.flush()
+
+    def _write_rows(self, rows):
+        self._file.writelines(",".join([str(value) for value in row]) + "\n" for row in rows)
+        self._file.flush()
+
+    def _position(self):
+        return os.path.getsize(self.path)
+
+    def _truncate(self, position):
+        os.truncate(self.path, position)
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+
+
+class ColumnarSink(ResultSink):
+    """
+    Result sink that stores each state variable as a column of 64-bit floats in its own binary
+    file, in the machine's byte order. The rows are appended in chunks of *flush_every* rows.
+
+    The directory contains the file ``columns.json`` with the column names, their files, the
+    ``dtype`` in NumPy notation and the number of ``rows`` written so far, which is updated after
+    each chunk. Use :func:`load_columns` to read the columns, or map a column directly into memory
+    with ``numpy.memmap(file, dtype=dtype, mode="r", shape=(rows,))``.
+
+    :param directory: The directory the files are written to. It is created if it does not exist.
+    :type directory: str
+    :param flush_every: See :class:`~ResultSink`.
+    :type flush_every: int
+    :param flush_interval: See :class:`~ResultSink`.
+    :type flush_interval: float
+    """
+
+    def __init__(self, directory, flush_every=1024, flush_interval=None):
+        super().__init__(flush_every, flush_interval)
+        self.directory = directory
+        self.rows = 0
+        self._files = []
+
+    def _open(self, append):
+        os.makedirs(self.directory, exist_ok=True)
+        if not append:
+            self.rows = 0
+            self._write_metadata()
+        mode = "ab" if append else "wb"
+        self._files = [open(os.path.join(self.directory, name + ".f8"), mode)
+                       for name in self.names]
+
+    def _write_rows(self, rows):
+        try:
+            columns = [array("d", column) for column in zip(*rows)]
+        except TypeError:
+            raise RuntimeError("The columnar result sink only stores numeric values.")
+        for column, f in zip(columns, self._files):
+            column.tofile(f)
+            f.flush()
+        self.rows += len(rows)
+        self._write_metadata()
+
+    def _write_metadata(self):
+        byte_order = "<" if sys.byteorder == "little" else ">"
+        metadata = {"dtype": byte_order + "f8", "rows": self.rows,
+                    "columns": [{"name": name, "file": name + ".f8"} for name in self.names]}
+        path = os.path.join(self.directory, "columns.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(path + ".tmp", path)
+
+    def _position(self):
+        return self.rows
+
+    def _truncate(self, position):
+        for name in self.names:
+            os.truncate(os.path.join(self.directory, name + ".f8"), position * 8)
+        self.rows = position
+        self._write_metadata()
+
+    def _close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+
+
+def load_columns(directory):
+    """
+    Load the columns written by a :class:`~ColumnarSink`.
+
+    :param directory: The directory of the columnar result set.
+    :type directory: str
+    :return: Dictionary with for each state variable its values.
+    :rtype: dict
+    """
+    with open(os.path.join(directory, "columns.json"), "r") as f:
+        metadata = json.load(f)
+    columns = {}
+    for column in metadata["columns"]:
+        values = array("d")
+        with open(os.path.join(directory, column["file"]), "rb") as f:
+            values.fromfile(f, metadata["rows"])
+        if metadata["dtype"][0] != ("<" if sys.byteorder == "little" else ">"):
+            values.byteswap()
+        columns[column["name"]] = values
+    return columns
+
+
+_ARCHIVE_ENCODINGS = {"float64": "d", "float32": "f", "delta32": "f"}
+
+
+class TrajectoryArchive:
+    """
+    Append-only archive of the simulate trajectories, the chosen action and the timing of each MPC
+    step, for analysis after the run.
+
+    The directory contains ``archive.json`` with the encoding, ``data.bin`` with the trajectories
+    as typed arrays, and ``index.jsonl`` with one line per step that holds the action, the timing
+    and the position of each run in ``data.bin``. Steps are buffered and written in chunks of
+    *flush_every* steps.
+
+    The *encoding* is ``"float64"`` (lossless), ``"float32"`` (half the size), or ``"delta32"``,
+    which stores the values as 32-bit floats and the time points as 32-bit differences to the
+    previous time point, starting from the first time point stored as a 64-bit float in the index.
+    Each difference is taken to the decoded previous time point, such that the rounding errors do
+    not add up, and small time steps stay accurate also late in long trajectories.
+
+    :param directory: The directory of the archive. It is created if it does not exist, and an
+        existing archive in it is appended to.
+    :type directory: str
+    :param encoding: The encoding of new archives.
+    :type encoding: str
+    :param flush_every: The number of steps after which the buffered steps are written.
+    :type flush_every: int
+    """
+
+    def __init__(self, directory, encoding="delta32", flush_every=16):
+        if encoding not in _ARCHIVE_ENCODINGS:
+            raise RuntimeError(f"Unknown archive encoding {encoding}.")
+        self.directory = directory
+        self.flush_every = flush_every
+        self._pending = []
+        os.makedirs(directory, exist_ok=True)
+        metadata_file = os.path.join(directory, "archive.json")
+        if os.path.exists(metadata_file):
+            with open(metadata_file, "r") as f:
+                metadata = json.load(f)
+        else:
+            metadata = {"encoding": encoding, "byteorder": sys.byteorder}
+            with open(metadata_file, "w") as f:
+                json.dump(metadata, f)
+        self.encoding = metadata["encoding"]
+        self._data_file = os.path.join(directory, "data.bin")
+        self._index_file = os.path.join(directory, "index.jsonl")
+        self._offset = os.path.getsize(self._data_file) if os.path.exists(self._data_file) else 0
+
+    def append(self, step, trajectories, action=None, timing=None):
+        """
+        Add a step to the archive.
+
+        :param step: The step.
+        :type step: int
+        :param trajectories: The parsed output as returned by :func:`parse_simulate_output`.
+        :type trajectories: dict
+        :param action: The control action chosen in the step.
+        :type action: float
+        :param timing: Dictionary with timing information of the step, like the synthesis time.
+        :type timing: dict
+        """
+        self._pending.append((step, trajectories, action, timing))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def _encode(self, times, values):
+        typecode = _ARCHIVE_ENCODINGS[self.encoding]
+        if self.encoding != "delta32":
+            return None, array(typecode, times), array(typecode, values)
+        base = times[0] if len(times) else 0.0
+        deltas = array(typecode)
+        decoded = base
+        for t in times:
+            deltas.append(t - decoded)
+            decoded += deltas[-1]
+        return base, deltas, array(typecode, values)
+
+    def flush(self):
+        """
+        Write the buffered steps.
+        """
+        if not self._pending:
+            return
+        lines = []
+        with open(self._data_file, "ab") as data:
+            for step, trajectories, action, timing in self._pending:
+                runs = {}
+                for var, var_runs in trajectories.items():
+                    runs[var] = []
+                    for times, values in var_runs:
+                        base, times, values = self._encode(times, values)
+                        times.tofile(data)
+                        values.tofile(data)
+                        run = [self._offset, len(times)]
+                        runs[var].append(run if base is None else run + [base])
+                        self._offset += 2 * len(times) * times.itemsize
+                lines.append(json.dumps({"step": step, "action": action, "timing": timing,
+                                         "runs": runs}) + "\n")
+        with open(self._index_file, "a") as index:
+            index.writelines(lines)
+        self._pending = []
+
+    def close(self):
+        """
+        Write the buffered steps.
+        """
+        self.flush()
+
+    def position(self):
+        """
+        Write the buffered steps and get the number of steps in the archive, to continue from with
+        :meth:`resume`.
+
+        :return: The number of steps.
+        :rtype: int
+        """
+        self.flush()
+        if not os.path.exists(self._index_file):
+            return 0
+        with open(self._index_file, "r") as f:
+            return sum(1 for _ in f)
+
+    def resume(self, position):
+        """
+        Remove all steps after the first *position* steps.
+
+        :param position: The number of steps to keep.
+        :type position: int
+        """
+        self._pending = []
+        if not os.path.exists(self._index_file):
+            return
+        with open(self._index_file, "r") as f:
+            lines = list(itertools.islice(f, position))
+        with open(self._index_file, "w") as f:
+            f.writelines(lines)
+        self._offset = 0
+        itemsize = array(_ARCHIVE_ENCODINGS[self.encoding]).itemsize
+        for line in lines:
+            for runs in json.loads(line)["runs"].values():
+                for offset, count, *_ in runs:
+                    self._offset = max(self._offset, offset + 2 * count * itemsize)
+        os.truncate(self._data_file, self._offset)
+
+
+class ArchiveReader:
+    """
+    Reader of a :class:`~TrajectoryArchive`. The index is read when the reader is created, and the
+    trajectories of a step are read from the data file into new arrays each time the step is
+    accessed, such that the arrays stay valid after the reader is closed. An archive to which no
+    steps have been written yet is empty.
+
+    The data file is closed by :meth:`close` or when leaving the ``with`` block of the reader.
+
+    :param directory: The directory of the archive.
+    :type directory: str
+    :ivar steps: The index entries of all steps, each a dictionary with the ``step``, the
+        ``action``, the ``timing`` and the positions of the ``runs``.
+    :vartype steps: list
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "archive.json"), "r") as f:
+            metadata = json.load(f)
+        self.encoding = metadata["encoding"]
+        self._swap = metadata["byteorder"] != sys.byteorder
+        self.steps = []
+        index_file = os.path.join(directory, "index.jsonl")
+        if os.path.exists(index_file):
+            with open(index_file, "r") as f:
+                self.steps = [json.loads(line) for line in f]
+        self._data = None
+        self._lock = threading.Lock()
+        data_file = os.path.join(directory, "data.bin")
+        if os.path.exists(data_file):
+            self._data = open(data_file, "rb")
+
+    def __len__(self):
+        return len(self.steps)
+
+    def close(self):
+        """
+        Close the data file. The steps can no longer be accessed afterwards.
+        """
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _decode(self, offset, count, base=0.0):
+        typecode = _ARCHIVE_ENCODINGS[self.encoding]
+        times, values = array(typecode), array(typecode)
+        with self._lock:
+            self._data.seek(offset)
+            times.fromfile(self._data, count)
+            values.fromfile(self._data, count)
+        if self._swap:
+            times.byteswap()
+            values.byteswap()
+        if self.encoding == "float64":
+            return times, values
+        if self.encoding == "delta32":
+            # Accumulate in 64 bits exactly like the encoder did.
+            decoded = array("d")
+            for delta in times:
+                base += delta
+                decoded.append(base)
+            return decoded, array("d", values)
+        return array("d", times), array("d", values)
+
+    def get(self, index):
+        """
+        Get a step of the archive.
+
+        :param index: The position of the step in the archive.
+        :type index: int
+        :return: The index entry of the step, where ``trajectories`` has been added with the
+            trajectories in the format of :func:`parse_simulate_output`.
+        :rtype: dict
+        """
+        entry = dict(self.steps[index])
+        entry["trajectories"] = {var: [self._decode(*run) for run in runs]
+                                 for var, runs in entry["runs"].items()}
+        return entry
+
+    def range(self, start=0, stop=None):
+        """
+        Iterate lazily over the steps with a step number from *start* up to *stop*.
+
+        :param start: The first step number.
+        :type start: int
+        :param stop: The step number after the last one. Defaults to all remaining steps.
+        :type stop: int
+        :return: Generator of the steps, see :meth:`get`.
+        :rtype: generator
+        """
+        for index, entry in enumerate(self.steps):
+            if entry["step"] >= start and (stop is None or entry["step"] < stop):
+                yield self.get(index)
+
+
+def print_progress_bar(i, max, post_text):
+    """
+    Print a progress bar to sys.stdout.
+
+    Subsequent calls will override the previous progress bar (given that nothing else has been
+    written to sys.stdout).
+
+    From `<https://stackoverflow.com/a/58602365>`_.
+
+    :param i: The number of steps already completed.
+    :type i: int
+    :param max: The maximum number of steps for process to be completed.
+    :type max: int
+    :param post_text: The text to display after the progress bar.
+    :type post_text: str
+    """
+    n_bar = 20  # Size of progress bar.
+    j = i / max
+    sys.stdout.write('\r')
+    sys.stdout.write(f"[{'=' * int(n_bar * j):{n_bar}s}] {int(100 * j)}%  {post_text}")
+    sys.stdout.flush()
+
+
+def _check_picklable(values, kind):
+    """
+    Raise an error naming the first entry of the dictionary *values* that cannot be pickled.
+    """
+    for key, value in values.items():
+        try:
+            pickle.dumps(value)
+        except Exception as e:
+            raise RuntimeError(f"Cannot write a checkpoint, because the {kind} {key} cannot be "
+                               f"pickled: {e}") from e
+
+
+def _is_number(value):
+    """
+    Check whether *value* is a number that can be compared within a tolerance.
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _within_tolerance(expected, actual, tolerance):
+    """
+    Check whether all values in *actual* are within *tolerance* of the values in *expected*.
+    Values that are not numbers must be equal.
+    """
+    for name, value in actual.items():
+        if name not in expected:
+            return False
+        if not (_is_number(value) and _is_number(expected[name])):
+            if expected[name] != value:
+                return False
+            continue
+        limit = tolerance.get(name, 0.0) if isinstance(tolerance, dict) else tolerance
+        if abs(expected[name] - value) > limit:
+            return False
+    return True
+
+
+class StrategoController:
+    """
+    Controller class to interface with UPPAAL Stratego through python.
+
+    :param model_template_file: The file name of the template model.
+    :type model_template_file: str
+    :param model_cfg_dict: Dictionary containing pairs of state variable name and its initial
+        value. The state variable name should match the tag name in the template model.
+    :type model_cfg_dict: dict
+    :param cleanup: Whether or not to clean up the temporarily simulation file after being used.
+    :type cleanup: bool
+    :param launcher: The launcher that starts Uppaal Stratego. Defaults to a shared
+        :class:`~ProcessLauncher` without resource settings.
+    :type launcher: :class:`~ProcessLauncher`
+    :param workspace: The workspace where the simulation file is written to. Defaults to the
+        directory of the template model.
+    :type workspace: :class:`~Workspace`
+    :param cache: The cache of Uppaal Stratego outputs used by :meth:`run`. No cache is used if
+        ``None``.
+    :type cache: :class:`~SynthesisCache`
+    :ivar states: Dictionary containing the current state of the system, where a state is a pair of
+        variable name and value. It is initialized with the values from *model_cfg_dict*.
+    :vartype states: bool
+    :ivar tagRule: The rule for each tag in the template model. Currently, the rul is set to be
+        ``"//TAG_{}"``. Therefore, tags in the template model should be ``"//TAG_<variable name>"``,
+        where ``<variable name>`` is the global name of the variable.
+    :vartype tagRule: str
+    """
+
+    def __init__(self, model_template_file, model_cfg_dict, cleanup=True, launcher=None,
+                 workspace=None, cache=None):
+        self.template_file = model_template_file
+        root, extension = os.path.splitext(model_template_file)
+        self.simulation_file = root + "_sim" + extension
+        if workspace is not None:
+            self.simulation_file = workspace.path(self.simulation_file)
+        self.cleanup = cleanup  # TODO: this variable seems to be not used. Can it be safely removed?
+        self.states = model_cfg_dict.copy()
+        self.tagRule = "//TAG_{}"
+        self.launcher = _DEFAULT_LAUNCHER if launcher is None else launcher
+        self.cache = cache
+        self._template = None
+        self._template_signature = None
+        self._inserted_states = None
+
+    @property
+    def template(self):
+        """
+        The compiled template model, which is read from the template file at first use and read
+        again whenever the modification time or size of the file changes, such that changes to the
+        template, for example in :meth:`MPCsetup.perform_at_start_iteration`, take effect.
+
+        :return: The compiled template model.
+        :rtype: :class:`~ModelTemplate`
+        """
+        stat = os.stat(self.template_file)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if self._template is None or self._template.tag_rule != self.tagRule or \
+                self._template_signature != signature:
+            self._template = ModelTemplate(self.template_file, self.tagRule)
+            self._template_signature = signature
+        return self._template
+
+    def init_simfile(self):
+        """
+        Make a copy of a template file where data of specific variables is inserted.
+        """
+        shutil.copyfile(self.template_file, self.simulation_file)
+
+    def remove_simfile(self):
+        """
+        Clean created temporary files after the simulation is finished.
+        """
+        os.remove(self.simulation_file)
+
+    def debug_copy(self, debug_file):
+        """
+        Copy UPPAAL simulationfile.xml file for manual debug in Stratego.
+
+        :param debug_file: The file name of the debug file.
+        :type debug_file: str
+        """
+        shutil.copyfile(self.simulation_file, debug_file)
+
+    def update_state(self, new_values):
+        """
+        Update the state of the MPC controller.
+
+        :param new_values: Dictionary containing new values for the state variables.
+        :type new_values: dict
+        """
+        for name, value in new_values.items():
+            self.states.update({name: value})
+
+    def insert_state(self):
+        """
+        Insert the current state values of the variables at the appropriate position in the
+        simulation \*.xml file indicated by the :py:attr:`tagRule`.
+
+        The simulation file is rendered from the compiled :attr:`template` and written at once, so
+        a prior call to :meth:`init_simfile` is not needed.
+        """
+        self.template.write(self.simulation_file, self.states)
+        self._inserted_states = dict(self.states)
 
     def get_var_names_as_string(self):
         """
@@ -351,11 +3554,45 @@ class StrategoController:
         """
         return self.states
 
-    def run(self, query_file="", learning_args=None, verifyta_command="verifyta"):
+    def _cached(self, query_file, learning_args, verifyta_command, compute):
+        """
+        Get the output of the run from the :attr:`cache`, or compute it with *compute* and store it
+        if it is successful, see :func:`successful_result`. *compute* may return ``None`` for an
+        output that must not be stored, like that of a cancelled run, in which case ``None`` is
+        returned.
+        """
+        if self.cache is None:
+            return compute()
+        key = self.cache_key(query_file, learning_args, verifyta_command)
+        output = self.cache.get(key)
+        if output is None:
+            output = compute()
+            if output is not None and successful_result(output):
+                self.cache.put(key, output)
+        return output
+
+    async def _acached(self, query_file, learning_args, verifyta_command, compute):
+        """
+        Asynchronous counterpart of :meth:`_cached`, where *compute* is a coroutine function.
+        """
+        if self.cache is None:
+            return await compute()
+        key = self.cache_key(query_file, learning_args, verifyta_command)
+        output = self.cache.get(key)
+        if output is None:
+            output = await compute()
+            if output is not None and successful_result(output):
+                self.cache.put(key, output)
+        return output
+
+    def run(self, query_file="", learning_args=None, verifyta_command="verifyta", launcher=None):
         """
         Runs verifyta with requested queries and parameters that are either part of the \*.xml model
         file or explicitly specified.
 
+        With a :attr:`cache`, the output is looked up first, and only successful outputs are
+        stored.
+
         :param query_file: The file name of the query file where the queries are written to.
         :type query_file: str
         :param learning_args: Dictionary containing the learning parameters and their values. The
@@ -366,12 +3603,126 @@ class StrategoController:
         :type learning_args: dict
         :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
         :type verifyta_command: str
+        :param launcher: The launcher for this run only. Defaults to :attr:`launcher`.
+        :type launcher: :class:`~ProcessLauncher`
+        :return: The output generated by Uppaal Stratego.
+        :rtype: str
+        """
+        learning_args = {} if learning_args is None else learning_args
+        launcher = self.launcher if launcher is None else launcher
+        return self._cached(query_file, learning_args, verifyta_command,
+                            lambda: run_stratego(self.simulation_file, query_file, learning_args,
+                                                 verifyta_command, launcher)[0])
+
+    def cache_key(self, query_file="", learning_args=None, verifyta_command="verifyta"):
+        """
+        Compute the key of the current run in the :attr:`cache`. With quantization, the key is
+        computed from the states last written to the simulation file by :meth:`insert_state`,
+        which may differ from the current :attr:`states`.
+
+        :param query_file: The file name of the query file where the queries are written to.
+        :type query_file: str
+        :param learning_args: Dictionary containing the learning parameters and their values.
+        :type learning_args: dict
+        :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+        :type verifyta_command: str
+        :return: The cache key.
+        :rtype: str
+        """
+        learning_args = {} if learning_args is None else learning_args
+        if self.cache.quantize is not None:
+            states = self.states if self._inserted_states is None else self._inserted_states
+            model_text = self.template.render(self.cache.quantize(dict(states)))
+        else:
+            with open(self.simulation_file, "r") as f:
+                model_text = f.read()
+        query_text = ""
+        if query_file:
+            with open(query_file, "r") as f:
+                query_text = f.read()
+        version = verifyta_version(verifyta_command, self.launcher)
+        return self.cache.key(model_text, query_text, learning_args, version)
+
+    def run_streaming(self, query_file="", learning_args=None, verifyta_command="verifyta",
+                      callback=None, abort_on_failure=False, launcher=None):
+        """
+        Runs verifyta like :meth:`run`, but parses the output while verifyta is still running. See
+        :func:`run_stratego_streaming` for the meaning of *callback* and *abort_on_failure*. An
+        output found in the :attr:`cache` is fed to the parser and *callback* line by line, and
+        only complete, successful outputs are stored.
+
+        :param query_file: The file name of the query file where the queries are written to.
+        :type query_file: str
+        :param learning_args: Dictionary containing the learning parameters and their values.
+        :type learning_args: dict
+        :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+        :type verifyta_command: str
+        :param callback: Function called with each line of output and the parser.
+        :type callback: callable
+        :param abort_on_failure: Whether to kill verifyta as soon as a formula is not satisfied.
+        :type abort_on_failure: bool
+        :param launcher: The launcher for this run only. Defaults to :attr:`launcher`.
+        :type launcher: :class:`~ProcessLauncher`
+        :return: The output generated by Uppaal Stratego and the parser that has been fed with it.
+        :rtype: tuple(str, :class:`~SimulateParser`)
+        """
+        learning_args = {} if learning_args is None else learning_args
+        launcher = self.launcher if launcher is None else launcher
+        if self.cache is None:
+            return run_stratego_streaming(self.simulation_file, query_file, learning_args,
+                                          verifyta_command, callback, abort_on_failure, launcher)
+
+        streamed = []
+        stopped = []
+
+        def compute():
+            def stop(line, parser):
+                if callback is not None and callback(line, parser):
+                    stopped.append(True)
+                    return True
+                return False
+
+            output, parser = run_stratego_streaming(self.simulation_file, query_file,
+                                                    learning_args, verifyta_command, stop,
+                                                    abort_on_failure, launcher)
+            streamed.append((output, parser))
+            return None if stopped or parser.failed else output
+
+        output = self._cached(query_file, learning_args, verifyta_command, compute)
+        if streamed:
+            return streamed[0]
+        parser = SimulateParser()
+        for line in output.splitlines(keepends=True):
+            parser.feed(line)
+            if callback is not None and callback(line, parser):
+                break
+        return output, parser
+
+    async def arun(self, query_file="", learning_args=None, verifyta_command="verifyta",
+                   semaphore=None):
+        """
+        Asynchronous counterpart of :meth:`run`, based on :func:`async_run_stratego`.
+
+        :param query_file: The file name of the query file where the queries are written to.
+        :type query_file: str
+        :param learning_args: Dictionary containing the learning parameters and their values.
+        :type learning_args: dict
+        :param verifyta_command: The command name for running Uppaal Stratego at the user's machine.
+        :type verifyta_command: str
+        :param semaphore: Semaphore that limits how many instances of Uppaal Stratego run at the
+            same time.
+        :type semaphore: :class:`asyncio.Semaphore`
         :return: The output generated by Uppaal Stratego.
         :rtype: str
         """
         learning_args = {} if learning_args is None else learning_args
-        output = run_stratego(self.simulation_file, query_file, learning_args, verifyta_command)
-        return output[0]
+
+        async def compute():
+            output = await async_run_stratego(self.simulation_file, query_file, learning_args,
+                                              verifyta_command, self.launcher, semaphore)
+            return output[0]
+
+        return await self._acached(query_file, learning_args, verifyta_command, compute)
 
 
 class MPCsetup:
@@ -383,6 +3734,7 @@ class MPCsetup:
     :param model_template_file: The file name of the template model.
     :type model_template_file: str
     :param output_file_path: The file name of the output file where the results are printed to.
+        Ignored if *result_sink* is given.
     :type output_file_path: str
     :param query_file: The file name of the query file where the queries are written to.
     :type query_file: str
@@ -407,16 +3759,117 @@ class MPCsetup:
     :type action_variable: str
     :param debug: Whether or not to run in debug mode.
     :type debug: bool
+    :param launcher: The launcher that starts Uppaal Stratego, for example to pin it to certain CPU
+        cores. Defaults to a shared :class:`~ProcessLauncher` without resource settings.
+    :type launcher: :class:`~ProcessLauncher`
+    :param workspace: The private workspace where the simulation, query and debug files are written
+        to, such that several instances can run concurrently. A *query_file* with a directory is
+        kept as it is, and the query file defaults to ``query.q``. If ``True``, the setup creates its own temporary workspace, which is
+        removed by :meth:`close`. If not provided, these files are written next to the template
+        model and to *query_file*. Note that a model that refers to other files by relative paths
+        needs them next to the simulation file, so in a workspace it should use absolute paths.
+    :type workspace: :class:`~Workspace` or bool
+    :param semaphore: Semaphore that limits how many instances of Uppaal Stratego run at the same
+        time in :meth:`arun` and :meth:`arun_single`. It can be shared by several instances.
+    :type semaphore: :class:`asyncio.Semaphore`
+    :param cache: The cache of Uppaal Stratego outputs, such that repeated runs with the same model,
+        query and learning arguments are not synthesized again.
+    :type cache: :class:`~SynthesisCache`
+    :param deadline: The wall-clock time in seconds each MPC step may take. When it runs out,
+        verifyta is killed and the controller falls back to the next action of the previous plan,
+        or to *safe_action*. Only applies to :meth:`run_single` and to :meth:`run` with an external
+        simulator.
+    :type deadline: float
+    :param safe_action: The control action applied when the deadline is missed and the previous
+        plan does not cover the current control period.
+    :type safe_action: int or float
+    :param portfolio: The portfolio of parallel runs with different seeds used by
+        :meth:`run_verifyta` instead of a single run.
+    :type portfolio: :class:`~Portfolio`
+    :param profiler: The profiler that records the time spent in each phase of each step: the
+        ``start_iteration`` preprocessing, rendering the model (``render``), writing the
+        ``query``, running ``verifyta``, parsing its output (``parse``) and running the external
+        ``simulator``. In :meth:`run_pipelined`, the background runs of verifyta are recorded as
+        ``speculative_verifyta``.
+    :type profiler: :class:`~Profiler`
+    :param result_sink: The sink the states are written to after each step. Defaults to a
+        :class:`~CSVSink` writing to *output_file_path* if it is provided. Without a sink, the
+        states are printed to the standard output.
+    :type result_sink: :class:`~ResultSink`
+    :param state_statistic: The statistic over the runs of the simulate query that gives the state
+        at the end of the control period, see :meth:`Ensemble.statistic`. Useful with a query
+        ``simulate N`` with N > 1. Defaults to the value of the first run.
+    :type state_statistic: str or callable
+    :param strategy_store: The store of saved strategies, such that steps reuse the strategy of an
+        earlier step from a nearby state instead of learning a new one. Only applies to the
+        synchronous methods.
+    :type strategy_store: :class:`~StrategyStore`
+    :param scheduler: The scheduler that chooses the learning arguments and horizon of each step,
+        for example an :class:`~AdaptiveBudgetScheduler`. Only applies to the synchronous methods.
+    :type scheduler: :class:`~BudgetScheduler`
+    :param checkpoint_every: The number of steps of :meth:`run` between checkpoints, from which an
+        interrupted run can be continued with :meth:`resume`. No checkpoints are written if
+        ``None``. The parameters of :meth:`run` are stored in the checkpoint, and must therefore
+        be picklable. :meth:`run_pipelined` and :meth:`arun` do not support checkpoints.
+    :type checkpoint_every: int
+    :param checkpoint_file: The file name of the checkpoint. Defaults to a file next to the
+        template model, such that it survives the removal of the workspace. It should be given
+        explicitly if several setups with checkpoints share the template model. The checkpoint is
+        removed when :meth:`run` or :meth:`resume` finishes.
+    :type checkpoint_file: str
+    :param archive: The archive that stores the trajectories of the simulate query, the chosen
+        action and the timing of each step of :meth:`run` and :meth:`run_single`. It is closed at
+        the end of :meth:`run`; after :meth:`run_single`, call its ``close`` method yourself.
+        :meth:`run_pipelined` and :meth:`arun` do not support archives.
+    :type archive: :class:`~TrajectoryArchive`
     :ivar controller: The controller object used for interacting with Uppaal Stratego.
     :vartype controller: :class:`~StrategoController`
+    :ivar speculation_stats: The statistics of the speculative synthesis of the last call to
+        :meth:`run_pipelined`.
+    :vartype speculation_stats: dict
+    :ivar step_metrics: The metrics of each step of the last call to :meth:`run`, or of all calls
+        to :meth:`run_single`. Each entry is a dictionary with the ``step``, the
+        ``synthesis_time`` in seconds, whether the ``deadline_missed``, and the ``fallback`` that
+        was used (``None``, ``"previous_plan"`` or ``"safe_action"``).
+    :vartype step_metrics: list
+    :ivar portfolio_outcomes: The outcomes of the portfolio runs, with one list of outcomes per
+        call to :meth:`run_verifyta`. See :meth:`Portfolio.run`.
+    :vartype portfolio_outcomes: list
+    :ivar show_progress: Whether :meth:`run` and :meth:`run_pipelined` print a progress bar when
+        the results are written to a sink. ``True`` by default.
+    :vartype show_progress: bool
     """
 
     def __init__(self, model_template_file, output_file_path=None, query_file="",
                  model_cfg_dict=None, learning_args=None, verifyta_command="verifyta",
-                 external_simulator=False, action_variable=None, debug=False):
+                 external_simulator=False, action_variable=None, debug=False, launcher=None,
+                 workspace=None, semaphore=None, cache=None, deadline=None, safe_action=None,
+                 portfolio=None, profiler=None, result_sink=None, state_statistic=None,
+                 strategy_store=None, scheduler=None, checkpoint_every=None,
+                 checkpoint_file=None, archive=None):
         self.model_template_file = model_template_file
         self.output_file_path = output_file_path
+        if result_sink is None and output_file_path is not None:
+            result_sink = CSVSink(output_file_path)
+        self.result_sink = result_sink
         self.query_file = query_file
+        root, extension = os.path.splitext(model_template_file)
+        self.debug_file = root + "_debug" + extension
+        self.checkpoint_file = root + "_checkpoint.pickle"
+        self._owns_workspace = workspace is True
+        if workspace is True:
+            workspace = Workspace()
+        if workspace is not None:
+            self.debug_file = workspace.path(self.debug_file)
+            # Only a bare file name is placed in the workspace; explicit paths are kept.
+            if not os.path.dirname(query_file):
+                self.query_file = workspace.path(query_file if query_file else "query.q")
+        elif not query_file:
+            self.query_file = "query.q"
+        self.workspace = workspace
+        if checkpoint_file is not None:
+            self.checkpoint_file = checkpoint_file
+        self.checkpoint_every = checkpoint_every
         self.model_cfg_dict = {} if model_cfg_dict is None else model_cfg_dict
         self.learning_args = {} if learning_args is None else learning_args
         self.verifyta_command = verifyta_command
@@ -427,7 +3880,26 @@ class MPCsetup:
                 f"in the model configuration.")
         self.action_variable = action_variable
         self.debug = debug
-        self.controller = StrategoController(self.model_template_file, self.model_cfg_dict)
+        self.semaphore = semaphore
+        self.deadline = deadline
+        self.safe_action = safe_action
+        self.portfolio = portfolio
+        self.portfolio_outcomes = []
+        self.show_progress = True
+        self.profiler = profiler
+        self.state_statistic = state_statistic
+        self.strategy_store = strategy_store
+        self.scheduler = scheduler
+        self.archive = archive
+        self._last_parse = None
+        self._step = None
+        self.speculation_stats = {}
+        self.step_metrics = []
+        self._plan = None
+        self._plan_age = 0
+        self.controller = StrategoController(self.model_template_file, self.model_cfg_dict,
+                                             launcher=launcher, workspace=workspace,
+                                             cache=cache)
 
     def step_without_sim(self, control_period, horizon, duration, step, **kwargs):
         """
@@ -450,28 +3922,258 @@ class MPCsetup:
         :return: The output generated by Uppaal Stratego.
         :rtype: str
         """
+        start = time.perf_counter()
+        self._step = step
+
         # Perform some customizable preprocessing at each step.
-        self.perform_at_start_iteration(control_period, horizon, duration, step, **kwargs)
+        with self._phase("start_iteration"):
+            self.perform_at_start_iteration(control_period, horizon, duration, step, **kwargs)
 
-        # At each MPC step we want a clean template copy to insert variables.
-        self.controller.init_simfile()
+        learning_args = self.learning_args
+        if self.scheduler is not None:
+            scheduled_args, scheduled_horizon = self.scheduler.schedule(
+                step, dict(self.controller.get_states()))
+            if scheduled_args is not None:
+                self.learning_args = dict(learning_args, **scheduled_args)
+            if scheduled_horizon is not None:
+                horizon = scheduled_horizon
 
-        # Insert current state into simulation template.
-        self.controller.insert_state()
+        synthesis_start = time.perf_counter()
+        try:
+            final = self.prepare_step(control_period, horizon)
 
-        # To debug errors from verifyta one can save intermediate simulation file.
-        if self.debug:
-            self.controller.debug_copy(self.model_template_file.replace(".xml", "_debug.xml"))
+            # Run a verifyta query to simulate optimal strategy.
+            with self._phase("verifyta"):
+                if self.strategy_store is None:
+                    result = self._synthesize(start, horizon, control_period, final)
+                else:
+                    result = self._synthesize_warm(start, horizon, control_period, final)
+        finally:
+            if self.scheduler is not None:
+                self.learning_args = learning_args
+                self.scheduler.record(step, scheduled_args, scheduled_horizon,
+                                      time.perf_counter() - synthesis_start)
 
-        # Create the new query file for the next step.
-        final = horizon * control_period + self.controller.get_state("t")
-        self.create_query_file(horizon, control_period, final)
+        return result
+
+    def _synthesize(self, start, horizon, control_period, final):
+        """
+        Run verifyta, within the deadline of the step started at *start* if there is one.
+        """
+        if self.deadline is None:
+            return self.run_verifyta(horizon, control_period, final)
+        return self.run_verifyta_before(start + self.deadline, horizon, control_period, final)
+
+    def _synthesize_warm(self, start, horizon, control_period, final):
+        """
+        Run verifyta with a stored strategy if possible, see :class:`~StrategyStore`. If a reused
+        strategy fails, the step is prepared again, until a new strategy is learned.
+        """
+        while True:
+            plan = self.strategy_store.prepare_query(self.query_file, self.controller.get_states())
+            synthesis_start = time.perf_counter()
+            try:
+                result = self._synthesize(start, horizon, control_period, final)
+            except DeadlineExceeded:
+                raise
+            except RuntimeError:
+                if plan["entry"] is None:
+                    raise
+                result = None
+            success = result is not None and "Formula is not satisfied" not in result
+            self.strategy_store.record(plan, time.perf_counter() - synthesis_start, success)
+            if success or plan["entry"] is None:
+                return result
+            final = self.prepare_step(control_period, horizon)
+
+    def _phase(self, name):
+        """
+        Get the context manager that records the phase of the current step in the profiler.
+        """
+        if self.profiler is None:
+            return _NO_PHASE
+        return self.profiler.phase(name, self._step)
+
+    def run_verifyta_before(self, deadline, horizon, control_period, final):
+        """
+        Run :meth:`run_verifyta`, but kill verifyta when the deadline is reached.
 
-        # Run a verifyta query to simulate optimal strategy.
-        result = self.run_verifyta(horizon, control_period, final)
+        :param deadline: The deadline as a :func:`time.perf_counter` value.
+        :type deadline: float
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of periods.
+        :type horizon: int
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param final: The time that should be reached by the synthesized strategy, given in Uppaal
+            Stratego time units.
+        :type final: int
+        :return: The output generated by Uppaal Stratego.
+        :rtype: str
+        """
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise DeadlineExceeded("The deadline passed before verifyta could be started.")
 
+        cancellable = _CancellableLauncher(self.controller.launcher)
+        timer = threading.Timer(remaining, cancellable.cancel)
+        timer.start()
+        try:
+            result = self.run_verifyta(horizon, control_period, final, launcher=cancellable)
+        except Exception as e:
+            if cancellable.cancelled:
+                raise DeadlineExceeded("Verifyta was killed at the deadline.") from e
+            raise
+        finally:
+            timer.cancel()
+        if cancellable.killed:
+            raise DeadlineExceeded("Verifyta was killed at the deadline.")
         return result
 
+    def _parse(self, result):
+        """
+        Parse the output of Uppaal Stratego with :func:`parse_simulate_output`, reusing the parse
+        of the previous call if the output is the same, such that the output of a step is parsed
+        only once for the action, the state and the archive.
+        """
+        last_parse = self._last_parse
+        if last_parse is None or last_parse[0] is not result:
+            last_parse = (result, parse_simulate_output(result))
+            self._last_parse = last_parse
+        return last_parse[1]
+
+    def archive_step(self, step, result, action, metrics):
+        """
+        Add a step to the archive, if any.
+
+        :param step: The step.
+        :type step: int
+        :param result: The output of Uppaal Stratego, or ``None`` if the deadline was missed.
+        :type result: str
+        :param action: The chosen control action. If ``None``, it is taken from the trajectory of
+            the action variable, if any.
+        :type action: float
+        :param metrics: The metrics of the step, see :attr:`step_metrics`.
+        :type metrics: dict
+        """
+        if self.archive is None:
+            return
+        trajectories = {} if result is None else self._parse(result)
+        if action is None and self.action_variable in trajectories:
+            action = value_at(*get_trajectory(trajectories, self.action_variable), 0)
+        timing = {key: value for key, value in metrics.items() if key != "step"}
+        self.archive.append(step, trajectories, action, timing)
+
+    def choose_action(self, control_period, horizon, duration, step, **kwargs):
+        """
+        Perform a step and get the chosen control action, falling back to the previous plan or the
+        safe action when the deadline is missed. The outcome is appended to
+        :attr:`step_metrics`.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param duration: The number of times (steps) the MPC scheme should be performed, given as
+            the number of control periods.
+        :type duration: int
+        :param step: The current iteration step in the basic MPC loop.
+        :type step: int
+        :param kwargs: Any additional parameters are forwarded to
+            :meth:`~MPCsetup.perform_at_start_iteration`.
+        :return: The control action for the current control period.
+        :rtype: float
+        """
+        start = time.perf_counter()
+        metrics = {"step": step, "synthesis_time": 0.0, "deadline_missed": False,
+                   "fallback": None}
+        try:
+            result = self.step_without_sim(control_period, horizon, duration, step, **kwargs)
+        except DeadlineExceeded:
+            metrics["deadline_missed"] = True
+            self._plan_age += 1
+            chosen_action = None
+            if self._plan is not None:
+                chosen_action = value_at(self._plan[0], self._plan[1],
+                                         self._plan_age * control_period)
+                metrics["fallback"] = "previous_plan"
+            if chosen_action is None:
+                if self.safe_action is None:
+                    raise
+                chosen_action = self.safe_action
+                metrics["fallback"] = "safe_action"
+        else:
+            with self._phase("parse"):
+                chosen_action = self.extract_control_action_from_stratego(result)
+                if self.deadline is not None:
+                    self._plan = get_trajectory(self._parse(result), self.action_variable)
+                    self._plan_age = 0
+        metrics["synthesis_time"] = time.perf_counter() - start
+        self.step_metrics.append(metrics)
+        self.archive_step(step, None if metrics["deadline_missed"] else result, chosen_action,
+                          metrics)
+        return chosen_action
+
+    async def astep_without_sim(self, control_period, horizon, duration, step, **kwargs):
+        """
+        Asynchronous counterpart of :meth:`step_without_sim`.
+
+        :meth:`~MPCsetup.perform_at_start_iteration` may be overridden by a coroutine method.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param duration: The number of times (steps) the MPC scheme should be performed, given as
+            the number of control periods.
+        :type duration: int
+        :param step: The current iteration step in the basic MPC loop.
+        :type step: int
+        :param kwargs: Any additional parameters are forwarded to
+            :meth:`~MPCsetup.perform_at_start_iteration`.
+        :return: The output generated by Uppaal Stratego.
+        :rtype: str
+        """
+        self._step = step
+        await _maybe_await(
+            self.perform_at_start_iteration(control_period, horizon, duration, step, **kwargs))
+
+        final = self.prepare_step(control_period, horizon)
+
+        return await self.arun_verifyta(horizon, control_period, final)
+
+    def prepare_step(self, control_period, horizon):
+        """
+        Write the simulation file with the current state and the query file for the next step.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :return: The time that should be reached by the synthesized strategy.
+        :rtype: int or float
+        """
+        # Render the current state into a fresh simulation file from the compiled template.
+        with self._phase("render"):
+            self.controller.insert_state()
+
+            # To debug errors from verifyta one can save intermediate simulation file.
+            if self.debug:
+                self.controller.debug_copy(self.debug_file)
+
+        # Create the new query file for the next step.
+        with self._phase("query"):
+            final = horizon * control_period + self.controller.get_state("t")
+            self.create_query_file(horizon, control_period, final)
+        return final
+
     def run_single(self, control_period, horizon, **kwargs):
         """
         Run the basic MPC scheme a single step where a single controller strategy is calculated,
@@ -491,14 +4193,32 @@ class MPCsetup:
             :meth:`~MPCsetup.perform_at_start_iteration`.
         :return: The control action chosen for the first control period.
         """
-        if not check_tool_existence(self.verifyta_command):
+        if not self.controller.launcher.available(self.verifyta_command):
             raise RuntimeError(
                 f"Cannot find the supplied verifyta command: {self.verifyta_command}")
 
-        result = self.step_without_sim(control_period, horizon, 1, 0, **kwargs)
-        chosen_action = self.extract_control_action_from_stratego(result)
+        return self.choose_action(control_period, horizon, 1, len(self.step_metrics), **kwargs)
 
-        return chosen_action
+    async def arun_single(self, control_period, horizon, **kwargs):
+        """
+        Asynchronous counterpart of :meth:`run_single`.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param `**kwargs`: Any additional parameters are forwarded to
+            :meth:`~MPCsetup.perform_at_start_iteration`.
+        :return: The control action chosen for the first control period.
+        """
+        if not self.controller.launcher.available(self.verifyta_command):
+            raise RuntimeError(
+                f"Cannot find the supplied verifyta command: {self.verifyta_command}")
+
+        result = await self.astep_without_sim(control_period, horizon, 1, 0, **kwargs)
+        return self.extract_control_action_from_stratego(result)
 
     def run(self, control_period, horizon, duration, **kwargs):
         """
@@ -521,37 +4241,333 @@ class MPCsetup:
         :param `**kwargs`: Any additional parameters are forwarded to
             :meth:`~MPCsetup.perform_at_start_iteration`.
         """
-        # Print the variable names and their initial values.
+        # Print the variable names and their initial values.
+        self.print_state_vars()
+        self.print_state()
+
+        if not self.controller.launcher.available(self.verifyta_command):
+            raise RuntimeError(
+                f"Cannot find the supplied verifyta command: {self.verifyta_command}")
+        if self.deadline is not None and not self.external_simulator:
+            raise RuntimeError("A deadline can only be used together with an external simulator.")
+
+        self.step_metrics = []
+        self._run_steps(control_period, horizon, duration, 0, kwargs)
+
+    def resume(self, control_period, horizon, duration, **kwargs):
+        """
+        Continue :meth:`run` from the last checkpoint, see *checkpoint_every*. The result sink is
+        reset to its position at the checkpoint, such that the results are the same as those of an
+        uninterrupted run. If there is no checkpoint, a new run is started.
+
+        The setup should be created with the same arguments as the interrupted one.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param duration: The number of times (steps) the MPC scheme should be performed, given as
+            the number of control periods.
+        :type duration: int
+        :param `**kwargs`: Parameters that replace those stored in the checkpoint, which are
+            forwarded to :meth:`~MPCsetup.perform_at_start_iteration`.
+        """
+        if not os.path.exists(self.checkpoint_file):
+            self.run(control_period, horizon, duration, **kwargs)
+            return
+
+        with open(self.checkpoint_file, "rb") as f:
+            checkpoint = pickle.load(f)
+        self.controller.update_state(checkpoint["states"])
+        self.step_metrics = checkpoint["step_metrics"]
+        self._plan = checkpoint["plan"]
+        self._plan_age = checkpoint["plan_age"]
+        self.restore_checkpoint_state(checkpoint["user"])
+        run_kwargs = checkpoint["kwargs"]
+        run_kwargs.update(kwargs)
+        if self.result_sink is not None and checkpoint["sink_position"] is not None:
+            self.result_sink.resume(self.controller.get_states().keys(),
+                                    checkpoint["sink_position"])
+        if self.archive is not None and checkpoint.get("archive_position") is not None:
+            self.archive.resume(checkpoint["archive_position"])
+
+        if not self.controller.launcher.available(self.verifyta_command):
+            raise RuntimeError(
+                f"Cannot find the supplied verifyta command: {self.verifyta_command}")
+        self._run_steps(control_period, horizon, duration, checkpoint["step"], run_kwargs)
+
+    def write_checkpoint(self, step, kwargs):
+        """
+        Write a checkpoint atomically, from which :meth:`resume` continues at *step*.
+
+        :param step: The next step to perform.
+        :type step: int
+        :param kwargs: The parameters of the run.
+        :type kwargs: dict
+        """
+        position = None if self.result_sink is None else self.result_sink.position()
+        archive_position = None if self.archive is None else self.archive.position()
+        checkpoint = {"step": step, "states": dict(self.controller.get_states()),
+                      "step_metrics": self.step_metrics, "plan": self._plan,
+                      "plan_age": self._plan_age, "kwargs": kwargs, "sink_position": position,
+                      "archive_position": archive_position, "user": self.checkpoint_state()}
+        try:
+            data = pickle.dumps(checkpoint)
+        except Exception:
+            # Report which parameter or entry cannot be pickled.
+            _check_picklable(kwargs, "parameter")
+            _check_picklable(checkpoint, "checkpoint entry")
+            raise
+        temporary = self.checkpoint_file + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_file)
+
+    def checkpoint_state(self):
+        """
+        Get additional state to store in a checkpoint. This method can be overwritten to store the
+        state of specific models, for example of an external simulator. It must be picklable.
+
+        :return: The additional state, which is ``None`` by default.
+        """
+        return None
+
+    def restore_checkpoint_state(self, state):
+        """
+        Restore the additional state returned by :meth:`checkpoint_state` when resuming.
+
+        :param state: The additional state.
+        """
+        pass
+
+    def _run_steps(self, control_period, horizon, duration, first_step, kwargs):
+        """
+        Perform the steps of :meth:`run` from *first_step* onwards.
+        """
+        if self.checkpoint_every is not None:
+            # Fail before the first step rather than at the first checkpoint.
+            _check_picklable(kwargs, "parameter")
+        try:
+            for step in range(first_step, duration):
+                # Only print progress to stdout if results are written to a sink.
+                if self.show_progress and self.result_sink is not None:
+                    print_progress_bar(step, duration, "progress")
+
+                if self.external_simulator:
+                    # An external simulator is used to generate the new 'true' state.
+                    chosen_action = self.choose_action(control_period, horizon, duration, step,
+                                                       **kwargs)
+                    with self._phase("simulator"):
+                        new_state = self.run_external_simulator(chosen_action, control_period,
+                                                                step, **kwargs)
+                    self.controller.update_state(new_state)
+
+                else:
+                    # Extract the state from Uppaal results. This requires that the query file
+                    # also includes a simulate query (see default query generator).
+                    start = time.perf_counter()
+                    result = self.step_without_sim(control_period, horizon, duration, step,
+                                                   **kwargs)
+                    self.step_metrics.append({"step": step,
+                                              "synthesis_time": time.perf_counter() - start,
+                                              "deadline_missed": False, "fallback": None})
+                    self.archive_step(step, result, None, self.step_metrics[-1])
+                    with self._phase("parse"):
+                        self.extract_states_from_stratego(result, control_period)
+
+                # Print output.
+                self.print_state()
+
+                if self.checkpoint_every is not None and (step + 1) % self.checkpoint_every == 0:
+                    self.write_checkpoint(step + 1, kwargs)
+        finally:
+            self.close_results()
+        if self.checkpoint_every is not None and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        if self.show_progress and self.result_sink is not None:
+            print_progress_bar(duration, duration, "finished")
+
+    def run_pipelined(self, control_period, horizon, duration, tolerance=0.0, **kwargs):
+        """
+        Run the MPC scheme with an external simulator, where the synthesis for the next step runs in
+        the background while the external simulator simulates the current step.
+
+        The next step is synthesized speculatively from the state predicted by the simulate query
+        of the current step. Its result is used only if the state returned by the external
+        simulator is within *tolerance* of the predicted state. Otherwise, the speculative run is
+        killed, and :meth:`~MPCsetup.perform_at_start_iteration` and the synthesis are performed
+        again for the true state. Apart from the speculative calls of
+        :meth:`~MPCsetup.perform_at_start_iteration`, which are made before the simulator of the
+        previous step finishes, the results are the same as those of :meth:`run`. A *deadline*,
+        *scheduler* or *strategy_store* of the setup is not supported.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param duration: The number of times (steps) the MPC scheme should be performed, given as
+            the number of control periods.
+        :type duration: int
+        :param tolerance: The maximum absolute difference between the predicted and the true value
+            of the state variables, either a single value or a dictionary with a value per state
+            variable.
+        :type tolerance: float or dict
+        :param `**kwargs`: Any additional parameters are forwarded to
+            :meth:`~MPCsetup.perform_at_start_iteration` and
+            :meth:`~MPCsetup.run_external_simulator`.
+        :return: Dictionary with the number of speculative ``hits`` and ``misses`` and the
+            ``hit_rate``. It is also stored in :attr:`speculation_stats`.
+        :rtype: dict
+        """
+        if not self.external_simulator:
+            raise RuntimeError("Pipelined synthesis requires an external simulator.")
+        if self.checkpoint_every is not None:
+            raise RuntimeError("Pipelined synthesis does not support checkpoints.")
+        if self.archive is not None:
+            raise RuntimeError("Pipelined synthesis does not support archives.")
+        if self.deadline is not None or self.scheduler is not None or \
+                self.strategy_store is not None:
+            raise RuntimeError("Pipelined synthesis does not support deadlines, schedulers or "
+                               "strategy stores.")
+
+        self.print_state_vars()
+        self.print_state()
+
+        if not self.controller.launcher.available(self.verifyta_command):
+            raise RuntimeError(
+                f"Cannot find the supplied verifyta command: {self.verifyta_command}")
+
+        self.speculation_stats = {"hits": 0, "misses": 0, "hit_rate": 0.0}
+        simulated_vars = list(self.controller.get_states().keys())
+        result = self.step_without_sim(control_period, horizon, duration, 0, **kwargs)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            for step in range(duration):
+                if self.show_progress and self.result_sink is not None:
+                    print_progress_bar(step, duration, "progress")
+
+                self._step = step
+                with self._phase("parse"):
+                    chosen_action = self.extract_control_action_from_stratego(result)
+
+                # Start the synthesis of the next step from the predicted state. Only the running
+                # of verifyta happens in the background; the files are prepared here.
+                speculation = None
+                if step + 1 < duration:
+                    current = dict(self.controller.get_states())
+                    predicted = self.predict_state(result, control_period)
+                    speculative_state = dict(current)
+                    speculative_state.update(
+                        {var: predicted[var] for var in simulated_vars if var in predicted})
+                    self.controller.update_state(speculative_state)
+                    self._step = step + 1
+                    with self._phase("start_iteration"):
+                        self.perform_at_start_iteration(control_period, horizon, duration,
+                                                        step + 1, **kwargs)
+                    final = self.prepare_step(control_period, horizon)
+                    self.controller.update_state(current)
+                    launcher = _CancellableLauncher(self.controller.launcher)
+                    speculation = executor.submit(self._speculate, step + 1, horizon,
+                                                  control_period, final, launcher)
+
+                self._step = step
+                with self._phase("simulator"):
+                    new_state = self.run_external_simulator(chosen_action, control_period, step,
+                                                            **kwargs)
+                simulated_vars = list(new_state.keys())
+                self.controller.update_state(new_state)
+                self.print_state()
+
+                if speculation is None:
+                    continue
+                if _within_tolerance(speculative_state, self.controller.get_states(), tolerance):
+                    result = speculation.result()
+                    self.speculation_stats["hits"] += 1
+                else:
+                    launcher.cancel()
+                    try:
+                        speculation.result()
+                    except Exception:
+                        pass
+                    self.speculation_stats["misses"] += 1
+                    result = self.step_without_sim(control_period, horizon, duration, step + 1,
+                                                   **kwargs)
+        finally:
+            executor.shutdown(wait=True)
+            self.close_results()
+
+        speculations = self.speculation_stats["hits"] + self.speculation_stats["misses"]
+        if speculations > 0:
+            self.speculation_stats["hit_rate"] = self.speculation_stats["hits"] / speculations
+        if self.show_progress and self.result_sink is not None:
+            print_progress_bar(duration, duration, "finished")
+        return self.speculation_stats
+
+    def _speculate(self, step, horizon, control_period, final, launcher):
+        """
+        Run :meth:`run_verifyta` for the speculative synthesis of the given step in the background.
+        """
+        if self.profiler is None:
+            return self.run_verifyta(horizon, control_period, final, launcher=launcher)
+        with self.profiler.phase("speculative_verifyta", step):
+            return self.run_verifyta(horizon, control_period, final, launcher=launcher)
+
+    async def arun(self, control_period, horizon, duration, **kwargs):
+        """
+        Asynchronous counterpart of :meth:`run`, such that a single event loop can run many MPC
+        loops concurrently. No progress bar is printed.
+
+        Both :meth:`~MPCsetup.perform_at_start_iteration` and
+        :meth:`~MPCsetup.run_external_simulator` may be overridden by coroutine methods.
+
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of control periods.
+        :type horizon: int
+        :param duration: The number of times (steps) the MPC scheme should be performed, given as
+            the number of control periods.
+        :type duration: int
+        :param `**kwargs`: Any additional parameters are forwarded to
+            :meth:`~MPCsetup.perform_at_start_iteration`.
+        """
+        if self.checkpoint_every is not None:
+            raise RuntimeError("The asynchronous MPC scheme does not support checkpoints.")
+        if self.archive is not None:
+            raise RuntimeError("The asynchronous MPC scheme does not support archives.")
+        if self.portfolio is not None:
+            raise RuntimeError("The asynchronous MPC scheme does not support portfolios.")
+
         self.print_state_vars()
         self.print_state()
 
-        if not check_tool_existence(self.verifyta_command):
+        if not self.controller.launcher.available(self.verifyta_command):
             raise RuntimeError(
                 f"Cannot find the supplied verifyta command: {self.verifyta_command}")
 
-        for step in range(duration):
-            # Only print progress to stdout if results are printed to a file.
-            if self.output_file_path:
-                print_progress_bar(step, duration, "progress")
-
-            result = self.step_without_sim(control_period, horizon, duration, step, **kwargs)
-
-            if self.external_simulator:
-                # An external simulator is used to generate the new 'true' state.
-                chosen_action = self.extract_control_action_from_stratego(result)
-                new_state = self.run_external_simulator(chosen_action, control_period, step,
-                                                        **kwargs)
-                self.controller.update_state(new_state)
+        try:
+            for step in range(duration):
+                result = await self.astep_without_sim(control_period, horizon, duration, step,
+                                                      **kwargs)
 
-            else:
-                # Extract the state from Uppaal results. This requires that the query file also
-                # includes a simulate query (see default query generator).
-                self.extract_states_from_stratego(result, control_period)
+                if self.external_simulator:
+                    chosen_action = self.extract_control_action_from_stratego(result)
+                    new_state = await _maybe_await(
+                        self.run_external_simulator(chosen_action, control_period, step, **kwargs))
+                    self.controller.update_state(new_state)
+                else:
+                    self.extract_states_from_stratego(result, control_period)
 
-            # Print output.
-            self.print_state()
-        if self.output_file_path:
-            print_progress_bar(duration, duration, "finished")
+                self.print_state()
+        finally:
+            self.close_results()
 
     def perform_at_start_iteration(self, *args, **kwargs):
         """
@@ -584,10 +4600,13 @@ class MPCsetup:
             line2 = "simulate 1 [<={}+1] {{ {} }} under opt\n"
             f.write(line2.format(period, self.controller.get_var_names_as_string()))
 
-    def run_verifyta(self, *args, **kwargs):
+    def run_verifyta(self, *args, launcher=None, **kwargs):
         """
         Run verifyta with the current data stored in this class.
 
+        :param launcher: The launcher for this run only, for example to cancel it. Defaults to the
+            launcher of the controller.
+        :type launcher: :class:`~ProcessLauncher`
         :param `*args`: Is not used in this method; it is used in the overriding method
             :meth:`~SafeMPCSetup.run_verifyta` in :class:`~SafeMPCSetup`.
         :param `**kwargs`: Is not used in this method; it is used in the overriding method
@@ -595,8 +4614,54 @@ class MPCsetup:
         :return: The output generated by Uppaal Stratego.
         :rtype: str
         """
-        result = self.controller.run(query_file=self.query_file, learning_args=self.learning_args,
-                                     verifyta_command=self.verifyta_command)
+        if self.portfolio is None:
+            result = self.controller.run(query_file=self.query_file,
+                                         learning_args=self.learning_args,
+                                         verifyta_command=self.verifyta_command,
+                                         launcher=launcher)
+        else:
+            result = self.run_portfolio(launcher)
+
+        if self.controller.cleanup:
+            self.controller.remove_simfile()
+        return result
+
+    def run_portfolio(self, launcher=None):
+        """
+        Run the :attr:`portfolio` on the current query file and record its outcomes in
+        :attr:`portfolio_outcomes`.
+
+        :param launcher: The launcher for this run only. Defaults to the launcher of the
+            controller.
+        :type launcher: :class:`~ProcessLauncher`
+        :return: The output of the selected run.
+        :rtype: str
+        """
+        def compute():
+            result, outcomes = self.portfolio.run(
+                self.controller.simulation_file, self.query_file, self.learning_args,
+                self.verifyta_command, self.controller.launcher if launcher is None else launcher)
+            self.portfolio_outcomes.append(outcomes)
+            return result
+
+        return self.controller._cached(self.query_file, self.learning_args, self.verifyta_command,
+                                       compute)
+
+    async def arun_verifyta(self, *args, **kwargs):
+        """
+        Asynchronous counterpart of :meth:`run_verifyta`.
+
+        :param `*args`: Is not used in this method; it is used in the overriding method
+            :meth:`~SafeMPCSetup.arun_verifyta` in :class:`~SafeMPCSetup`.
+        :param `**kwargs`: Is not used in this method; it is used in the overriding method
+            :meth:`~SafeMPCSetup.arun_verifyta` in :class:`~SafeMPCSetup`.
+        :return: The output generated by Uppaal Stratego.
+        :rtype: str
+        """
+        result = await self.controller.arun(query_file=self.query_file,
+                                            learning_args=self.learning_args,
+                                            verifyta_command=self.verifyta_command,
+                                            semaphore=self.semaphore)
 
         if self.controller.cleanup:
             self.controller.remove_simfile()
@@ -614,13 +4679,39 @@ class MPCsetup:
             control setting, given in Uppaal Stratego time units.
         :type control_period: int
         """
+        self.controller.update_state(self.predict_state(result, control_period))
+
+    def predict_state(self, result, control_period):
+        """
+        Get the state at the end of the first control period as predicted by the simulation output
+        of Stratego, without updating the :attr:`~MPCsetup.controller`.
+
+        The prediction is taken from the first simulation run, or computed over all runs with
+        :attr:`state_statistic` if it is set.
+
+        :param result: The output as generated by Uppaal Stratego.
+        :type result: str
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :return: Dictionary containing pairs of state variable name and its predicted value.
+        :rtype: dict
+        """
+        trajectories = self._parse(result)
+        states = self.controller.get_states()
+        if self.state_statistic is not None:
+            ensemble = Ensemble(trajectories, [control_period], list(states.keys()))
         new_state = {}
-        for var, value in self.controller.get_states().items():
-            new_value = extract_state(result, var, control_period)
+        for var, value in states.items():
+            if self.state_statistic is None:
+                times, values = get_trajectory(trajectories, var)
+                new_value = interpolate_at_last_period(times, values, control_period)
+            else:
+                new_value = float(ensemble.statistic(var, self.state_statistic)[0])
             if isinstance(value, int):
                 new_value = int(new_value)
             new_state[var] = new_value
-        self.controller.update_state(new_state)
+        return new_state
 
     def extract_control_action_from_stratego(self, stratego_output):
         """
@@ -632,20 +4723,14 @@ class MPCsetup:
         :return: The control action chosen for the first control period.
         :rtype: float
         """
-        float_re = r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?"
-        pattern = self.action_variable + r":\n\[0\]:( \(" + float_re + "," + float_re + r"\))*"
-        result = re.search(pattern, stratego_output)
-        if result is None:
-            raise RuntimeError(
-                "Output of Stratego has not the expected format. Please check the output manually "
-                "for error messages: \n" + stratego_output)
-        float_tuples = get_float_tuples(result.group())
+        trajectories = self._parse(stratego_output)
+        times, values = get_trajectory(trajectories, self.action_variable)
         last_value = 0.0
 
         # The last tuple at time 0 represents the chosen control action.
-        for t in float_tuples:
-            if t[0] == 0:
-                last_value = t[1]
+        for t, v in zip(times, values):
+            if t == 0:
+                last_value = v
             else:
                 break
         return last_value
@@ -670,27 +4755,49 @@ class MPCsetup:
 
     def print_state_vars(self):
         """
-        Print the names of the state variables to output file if provided. Otherwise, it will be
-        printed to the standard output.
+        Print the names of the state variables to the result sink if provided, which starts a new
+        result set. Otherwise, it will be printed to the standard output.
         """
-        content = self.controller.get_var_names_as_string() + "\n"
-        if self.output_file_path is None:
-            sys.stdout.write(content)
+        if self.result_sink is None:
+            sys.stdout.write(self.controller.get_var_names_as_string() + "\n")
         else:
-            with open(self.output_file_path, "w") as f:
-                f.write(content)
+            self.result_sink.open(self.controller.get_states().keys())
 
     def print_state(self):
         """
-        Print the current state to output file if provided. Otherwise, it will be printed to the
+        Print the current state to the result sink if provided. Otherwise, it will be printed to the
         standard output.
         """
-        content = self.controller.get_state_as_string() + "\n"
-        if self.output_file_path is None:
-            sys.stdout.write(content)
+        if self.result_sink is None:
+            sys.stdout.write(self.controller.get_state_as_string() + "\n")
         else:
-            with open(self.output_file_path, "a") as f:
-                f.write(content)
+            self.result_sink.write(list(self.controller.get_states().values()))
+
+    def close_results(self):
+        """
+        Write the buffered states to the result sink and the buffered steps to the archive, and
+        close their files. Called at the end of :meth:`run`, :meth:`run_pipelined` and
+        :meth:`arun`.
+        """
+        if self.result_sink is not None:
+            self.result_sink.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def close(self):
+        """
+        Close the results, see :meth:`close_results`, and remove the workspace the setup created
+        itself. Also called when leaving a ``with`` block of the setup.
+        """
+        self.close_results()
+        if self._owns_workspace:
+            self.workspace.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 class SafeMPCSetup(MPCsetup):
@@ -700,17 +4807,185 @@ class SafeMPCSetup(MPCsetup):
     The class monitors and detects whether Uppaal Stratego has sucessfully synthesized a strategy.
     If not, it will run Uppaal Stratego with an alternative query, which has to be specified by
     the user, as it depends on the model what a safe query would be.
+
+    With a *portfolio*, the primary query is run by the portfolio and the alternative query by a
+    single run.
+
+    Besides the parameters of :class:`~MPCsetup`, it accepts the following parameter.
+
+    :param race_queries: Whether to run the primary and the alternative query at the same time, such
+        that a failing primary query does not double the synthesis time. The alternative query is
+        written to :attr:`alternative_query_file`. Cannot be combined with a *portfolio*.
+    :type race_queries: bool
+    :ivar alternative_query_file: The file name of the alternative query file when racing the
+        queries.
+    :vartype alternative_query_file: str
     """
 
-    def run_verifyta(self, horizon, control_period, final, *args, **kwargs):
+    def __init__(self, *args, race_queries=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if race_queries and self.portfolio is not None:
+            raise RuntimeError("Racing the queries cannot be combined with a portfolio.")
+        self.race_queries = race_queries
+        root, ext = os.path.splitext(self.query_file if self.query_file else "query.q")
+        self.alternative_query_file = root + "_alternative" + ext
+
+    def run_verifyta(self, horizon, control_period, final, *args, launcher=None, **kwargs):
         """
         Run verifyta with the current data stored in this class.
 
         It verifies whether Stratego has successfully synthesized a strategy. If not, it will create
-        an alternative query file and run Stratego again.
+        an alternative query file and run Stratego again. The output of the first run is parsed
+        while Stratego is running, such that it is killed as soon as it reports that a formula is
+        not satisfied.
 
         Overrides :meth:`~MPCsetup.run_verifyta()` in :class:`~MPCsetup`.
 
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of periods.
+        :type horizon: int
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param final: The time that should be reached by the synthesized strategy, given in Uppaal
+            Stratego time units. Most likely this will be current time + *horizon* x *period*.
+        :type final: int
+        :param launcher: The launcher for this run only. Defaults to the launcher of the
+            controller.
+        :type launcher: :class:`~ProcessLauncher`
+        :param `*args`: Is not used in this method; it is included here to safely override the
+            original method.
+        :param `**kwargs`: Is not used in this method; it is included here to safely override the
+            original method.
+        """
+        if self.race_queries and self.create_alternative_query_file_for_race(horizon,
+                                                                             control_period, final):
+            result = self.race_verifyta(launcher)
+        else:
+            if self.portfolio is None:
+                result, parser = self.controller.run_streaming(
+                    query_file=self.query_file, learning_args=self.learning_args,
+                    verifyta_command=self.verifyta_command, abort_on_failure=True,
+                    launcher=launcher)
+                failed = parser.failed
+            else:
+                result = self.run_portfolio(launcher)
+                failed = False
+
+            if failed or not successful_result(result):
+                self.create_alternative_query_file(horizon, control_period, final)
+                result = self.controller.run(query_file=self.query_file,
+                                             learning_args=self.learning_args,
+                                             verifyta_command=self.verifyta_command,
+                                             launcher=launcher)
+
+        if self.controller.cleanup:
+            self.controller.remove_simfile()
+        return result
+
+    def create_alternative_query_file_for_race(self, horizon, period, final):
+        """
+        Write the alternative query to :attr:`alternative_query_file` by calling
+        :meth:`create_alternative_query_file` with :attr:`~MPCsetup.query_file` temporarily
+        pointing to it.
+
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+            each MPC step. Is given in the number of periods.
+        :type horizon: int
+        :param period: The interval duration after which the controller can change the control
+            setting, given in Uppaal Stratego time units.
+        :type period: int
+        :param final: The time that should be reached by the synthesized strategy, given in Uppaal
+            Stratego time units. Most likely this will be current time + *horizon* x *period*.
+        :type final: int
+        :return: Whether an alternative query file has been written.
+        :rtype: bool
+        """
+        if os.path.exists(self.alternative_query_file):
+            os.remove(self.alternative_query_file)
+        query_file = self.query_file
+        self.query_file = self.alternative_query_file
+        try:
+            self.create_alternative_query_file(horizon, period, final)
+        finally:
+            self.query_file = query_file
+        return os.path.exists(self.alternative_query_file)
+
+    def race_verifyta(self, launcher=None):
+        """
+        Run verifyta with the primary and the alternative query at the same time.
+
+        The primary run is parsed while it is running. As soon as it is known whether it succeeds,
+        the alternative run is killed if the primary run succeeded, or awaited otherwise.
+
+        :param launcher: The launcher for these runs only. Defaults to the launcher of the
+            controller.
+        :type launcher: :class:`~ProcessLauncher`
+        :return: The output of the primary run if it succeeded, otherwise the output of the
+            alternative run.
+        :rtype: str
+        """
+        primary_launcher = self.controller.launcher if launcher is None else launcher
+        alternative_launcher = _CancellableLauncher(primary_launcher)
+
+        def run_alternative():
+            # The output of a killed run is incomplete and must not be cached.
+            output = run_stratego(self.controller.simulation_file, self.alternative_query_file,
+                                  self.learning_args, self.verifyta_command,
+                                  alternative_launcher)[0]
+            return None if alternative_launcher.killed else output
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        alternative = executor.submit(self.controller._cached, self.alternative_query_file,
+                                      self.learning_args, self.verifyta_command, run_alternative)
+        try:
+            result, parser = self.controller.run_streaming(
+                query_file=self.query_file, learning_args=self.learning_args,
+                verifyta_command=self.verifyta_command, abort_on_failure=True,
+                launcher=primary_launcher)
+            if parser.failed or not successful_result(result):
+                return alternative.result()
+            alternative_launcher.cancel()
+            return result
+        finally:
+            alternative_launcher.cancel()
+            executor.shutdown(wait=True)
+
+    async def arace_verifyta(self):
+        """
+        Asynchronous counterpart of :meth:`race_verifyta`. The alternative run is cancelled, which
+        kills it, as soon as the primary run succeeded.
+
+        :return: The output of the primary run if it succeeded, otherwise the output of the
+            alternative run.
+        :rtype: str
+        """
+        alternative = asyncio.ensure_future(
+            self.controller.arun(query_file=self.alternative_query_file,
+                                 learning_args=self.learning_args,
+                                 verifyta_command=self.verifyta_command, semaphore=self.semaphore))
+        try:
+            result = await self.controller.arun(query_file=self.query_file,
+                                                learning_args=self.learning_args,
+                                                verifyta_command=self.verifyta_command,
+                                                semaphore=self.semaphore)
+            if successful_result(result):
+                return result
+            return await alternative
+        finally:
+            if not alternative.done():
+                alternative.cancel()
+                try:
+                    await alternative
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    async def arun_verifyta(self, horizon, control_period, final, *args, **kwargs):
+        """
+        Asynchronous counterpart of :meth:`run_verifyta`.
+
+        Overrides :meth:`~MPCsetup.arun_verifyta()` in :class:`~MPCsetup`.
+
         :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
             each MPC step. Is given in the number of periods.
         :type horizon: int
@@ -725,13 +5000,21 @@ class SafeMPCSetup(MPCsetup):
         :param `**kwargs`: Is not used in this method; it is included here to safely override the
             original method.
         """
-        result = self.controller.run(query_file=self.query_file, learning_args=self.learning_args,
-                                     verifyta_command=self.verifyta_command)
+        if self.race_queries and self.create_alternative_query_file_for_race(horizon,
+                                                                             control_period, final):
+            result = await self.arace_verifyta()
+        else:
+            result = await self.controller.arun(query_file=self.query_file,
+                                                learning_args=self.learning_args,
+                                                verifyta_command=self.verifyta_command,
+                                                semaphore=self.semaphore)
 
-        if not successful_result(result):
-            self.create_alternative_query_file(horizon, control_period, final)
-            result = self.controller.run(query_file=self.query_file, learning_args=self.learning_args,
-                                         verifyta_command=self.verifyta_command)
+            if not successful_result(result):
+                self.create_alternative_query_file(horizon, control_period, final)
+                result = await self.controller.arun(query_file=self.query_file,
+                                                    learning_args=self.learning_args,
+                                                    verifyta_command=self.verifyta_command,
+                                                    semaphore=self.semaphore)
 
         if self.controller.cleanup:
             self.controller.remove_simfile()
@@ -753,3 +5036,825 @@ class SafeMPCSetup(MPCsetup):
         :type final: int
         """
         pass
+
+
+class LearningTuner:
+    """
+    Tool that searches for learning parameters that trade synthesis time against control quality.
+
+    Each setting of the learning parameters is evaluated by a closed-loop :meth:`MPCsetup.run`,
+    recording the wall time of each step and the resulting cost. Settings are evaluated in
+    parallel, so *setup_factory* has to create setups that do not share files, for example by
+    giving each setup its own workspace with ``workspace=True``. The progress bars of the setups are turned off;
+    instead, the progress over the settings is shown.
+
+    :param setup_factory: Function that creates a fresh :class:`~MPCsetup` given the learning
+        arguments to evaluate. The setup is closed after its evaluation, see
+        :meth:`MPCsetup.close`.
+    :type setup_factory: callable
+    :param control_period: The interval duration after which the controller can change the
+        control setting, given in Uppaal Stratego time units.
+    :type control_period: int
+    :param horizon: The interval duration for which Uppaal stratego synthesizes a control strategy
+        each MPC step. Is given in the number of control periods.
+    :type horizon: int
+    :param duration: The number of steps of a full evaluation.
+    :type duration: int
+    :param cost: The closed-loop cost of a setup after its run: either the name of the state
+        variable that holds the cost, whose final value is used, or a function of the setup.
+    :type cost: str or callable
+    :param base_args: The learning arguments shared by all settings.
+    :type base_args: dict
+    :param workers: The number of settings evaluated in parallel. Defaults to the number of cores.
+    :type workers: int
+    :param `**run_kwargs`: Any additional parameters are forwarded to :meth:`MPCsetup.run`.
+    :ivar results: The results of all evaluations so far. See :meth:`evaluate`.
+    :vartype results: list
+    """
+
+    def __init__(self, setup_factory, control_period, horizon, duration, cost, base_args=None,
+                 workers=None, **run_kwargs):
+        self.setup_factory = setup_factory
+        self.control_period = control_period
+        self.horizon = horizon
+        self.duration = duration
+        self.base_args = {} if base_args is None else base_args
+        if isinstance(cost, str):
+            self.cost = lambda setup: setup.controller.get_state(cost)
+        else:
+            self.cost = cost
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.run_kwargs = run_kwargs
+        self.results = []
+
+    def evaluate(self, learning_args, duration=None):
+        """
+        Evaluate a single setting of the learning parameters with a closed-loop run.
+
+        :param learning_args: The learning arguments of the setting, on top of the base arguments.
+        :type learning_args: dict
+        :param duration: The number of steps of the run. Defaults to the full duration.
+        :type duration: int
+        :return: Dictionary with the ``learning_args``, the ``duration``, the ``step_times``, the
+            ``mean_step_time``, the ``max_step_time``, the ``cost`` and the ``error``, if any.
+        :rtype: dict
+        """
+        duration = self.duration if duration is None else duration
+        args = dict(self.base_args)
+        args.update(learning_args)
+        result = {"learning_args": args, "duration": duration, "step_times": [],
+                  "mean_step_time": None, "max_step_time": None, "cost": None, "error": None}
+        setup = None
+        try:
+            setup = self.setup_factory(args)
+            setup.show_progress = False
+            setup.run(self.control_period, self.horizon, duration, **self.run_kwargs)
+            result["cost"] = self.cost(setup)
+            step_times = [metrics["synthesis_time"] for metrics in setup.step_metrics]
+        except Exception as e:
+            result["error"] = str(e)
+            return result
+        finally:
+            if setup is not None:
+                setup.close()
+
+        result["step_times"] = step_times
+        if step_times:
+            result["mean_step_time"] = sum(step_times) / len(step_times)
+            result["max_step_time"] = max(step_times)
+        return result
+
+    def _evaluate_all(self, settings, duration):
+        # Only this thread reports progress, the evaluations run silently in the workers.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.evaluate, args, duration) for args in settings]
+            print_progress_bar(0, len(futures), f"tuning ({duration} steps)")
+            for done, _ in enumerate(concurrent.futures.as_completed(futures), 1):
+                print_progress_bar(done, len(futures), f"tuning ({duration} steps)")
+            sys.stdout.write("\n")
+        results = [future.result() for future in futures]
+        self.results.extend(results)
+        return results
+
+    @staticmethod
+    def grid(space):
+        """
+        Create all combinations of the parameter values.
+
+        :param space: Dictionary containing pairs of learning parameter name and the list of values
+            to try.
+        :type space: dict
+        :return: List of learning argument dictionaries.
+        :rtype: list
+        """
+        names = list(space.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+    def sweep(self, space):
+        """
+        Evaluate every combination of the parameter values for the full duration.
+
+        :param space: Dictionary containing pairs of learning parameter name and the list of values
+            to try.
+        :type space: dict
+        :return: The results of the evaluations.
+        :rtype: list
+        """
+        return self._evaluate_all(self.grid(space), self.duration)
+
+    def successive_halving(self, space, eta=3, min_duration=1):
+        """
+        Search the parameter space with successive halving.
+
+        All combinations are first evaluated with a short duration. Each round, only the best
+        ``1 / eta`` of the settings is kept, and the duration is multiplied by *eta*, until the full
+        duration is reached.
+
+        :param space: Dictionary containing pairs of learning parameter name and the list of values
+            to try.
+        :type space: dict
+        :param eta: The reduction factor per round.
+        :type eta: int
+        :param min_duration: The duration of the first round.
+        :type min_duration: int
+        :return: The results of the last round, which used the full duration.
+        :rtype: list
+        """
+        settings = self.grid(space)
+        duration = max(1, min(min_duration, self.duration))
+        while True:
+            results = self._evaluate_all(settings, duration)
+            if duration >= self.duration:
+                return results
+            ranked = sorted((r for r in results if r["error"] is None),
+                            key=lambda r: (r["cost"], r["mean_step_time"]))
+            keep = max(1, len(ranked) // eta)
+            settings = [self._own_args(r["learning_args"]) for r in ranked[:keep]]
+            duration = min(duration * eta, self.duration)
+
+    def _own_args(self, args):
+        return {k: v for k, v in args.items()
+                if k not in self.base_args or self.base_args[k] != v}
+
+    def _full_results(self):
+        return [r for r in self.results if r["error"] is None and r["duration"] == self.duration
+                and r["max_step_time"] is not None]
+
+    def pareto_front(self):
+        """
+        Get the settings evaluated for the full duration for which no other setting is both faster
+        per step and has a lower cost.
+
+        :return: The Pareto-optimal results, sorted by mean step time.
+        :rtype: list
+        """
+        results = sorted(self._full_results(), key=lambda r: (r["mean_step_time"], r["cost"]))
+        front = []
+        for result in results:
+            if not front or result["cost"] < front[-1]["cost"]:
+                front.append(result)
+        return front
+
+    def recommend(self, time_budget):
+        """
+        Recommend the setting with the lowest cost whose slowest step fits the time budget.
+
+        :param time_budget: The wall-clock time in seconds available per step.
+        :type time_budget: float
+        :return: The learning arguments of the recommended setting, or ``None`` if no setting fits
+            the budget.
+        :rtype: dict
+        """
+        feasible = [r for r in self._full_results() if r["max_step_time"] <= time_budget]
+        if not feasible:
+            return None
+        return min(feasible, key=lambda r: (r["cost"], r["mean_step_time"]))["learning_args"]
+
+
+class _KDTree:
+    """
+    Static k-d tree over points given as a flat array of coordinates, for nearest-neighbour
+    queries.
+    """
+
+    def __init__(self, points, dims):
+        self.points = points
+        self.dims = dims
+        self.index = array("l")
+        self.left = array("l")
+        self.right = array("l")
+        self.root = self._build(list(range(len(points) // dims)), 0)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return -1
+        axis = depth % self.dims
+        indices.sort(key=lambda i: self.points[i * self.dims + axis])
+        middle = len(indices) // 2
+        node = len(self.index)
+        self.index.append(indices[middle])
+        self.left.append(-1)
+        self.right.append(-1)
+        self.left[node] = self._build(indices[:middle], depth + 1)
+        self.right[node] = self._build(indices[middle + 1:], depth + 1)
+        return node
+
+    def nearest(self, query):
+        """
+        :return: The index of the nearest point and its squared distance to *query*.
+        :rtype: tuple
+        """
+        points, dims, index, left, right = self.points, self.dims, self.index, self.left, self.right
+        best_index, best_distance = -1, float("inf")
+        # Each entry holds a lower bound on the squared distance of the points below the node.
+        stack = [(self.root, 0, 0.0)]
+        while stack:
+            node, axis, bound = stack.pop()
+            if node < 0 or bound >= best_distance:
+                continue
+            i = index[node]
+            offset = i * dims
+            distance = 0.0
+            for d in range(dims):
+                distance += (points[offset + d] - query[d]) ** 2
+            if distance < best_distance:
+                best_index, best_distance = i, distance
+            difference = query[axis] - points[offset + axis]
+            next_axis = (axis + 1) % dims
+            if difference < 0:
+                stack.append((right[node], next_axis, difference * difference))
+                stack.append((left[node], next_axis, 0.0))
+            else:
+                stack.append((left[node], next_axis, difference * difference))
+                stack.append((right[node], next_axis, 0.0))
+        return best_index, best_distance
+
+
+class ExplicitController:
+    """
+    Table of precomputed control actions for a set of states, that answers online queries without
+    running Uppaal Stratego.
+
+    If the states of the table form a full grid, the action of a state is that of the nearest grid
+    point, or the multilinear interpolation of the surrounding grid points if *interpolate* is set.
+    Otherwise, the action of the nearest state in the table is used, found with a k-d tree.
+    Distances are measured after scaling each variable by its range in the table.
+
+    A state is covered by the table if it lies within the range of the table in every variable and,
+    for tables that are not a grid, within *max_distance* of the nearest state. Uncovered states are
+    passed to *fallback*, for example to synthesize the action online with
+    :meth:`MPCsetup.run_single`.
+
+    :param variables: The names of the state variables of the table.
+    :type variables: list
+    :param points: The states of the table, each a list of values in the order of *variables*.
+    :type points: list
+    :param actions: The action of each state.
+    :type actions: list
+    :param interpolate: Whether to interpolate the actions on a grid.
+    :type interpolate: bool
+    :param max_distance: The maximum scaled distance to the nearest state of a table that is not a
+        grid for a state to be covered. Unlimited if ``None``.
+    :type max_distance: float
+    :param fallback: Function that gives the action of an uncovered state.
+    :type fallback: callable
+    :ivar hits: The number of queries answered from the table.
+    :vartype hits: int
+    :ivar misses: The number of queries for uncovered states.
+    :vartype misses: int
+    """
+
+    def __init__(self, variables, points, actions, interpolate=False, max_distance=None,
+                 fallback=None):
+        if len(points) != len(actions) or not points:
+            raise RuntimeError("Provide one action for each of at least one state.")
+        self.variables = list(variables)
+        self.points = array("d", itertools.chain.from_iterable(points))
+        self.actions = array("d", actions)
+        self.interpolate = interpolate
+        self.max_distance = max_distance
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        dims = len(self.variables)
+        columns = [self.points[d::dims] for d in range(dims)]
+        self.lower = [min(column) for column in columns]
+        self.upper = [max(column) for column in columns]
+        self._scale = [(u - l) if u > l else 1.0 for l, u in zip(self.lower, self.upper)]
+        self._grid = self._build_grid(columns)
+        self._tree = None
+        if self._grid is None:
+            scaled = array("d", [(self.points[i] - self.lower[i % dims]) / self._scale[i % dims]
+                                 for i in range(len(self.points))])
+            self._tree = _KDTree(scaled, dims)
+
+    def _build_grid(self, columns):
+        """
+        Get the axes and the actions in row-major order if the points form a full grid.
+        """
+        axes = [sorted(set(column)) for column in columns]
+        size = functools.reduce(lambda a, b: a * b, [len(axis) for axis in axes], 1)
+        if size != len(self.actions):
+            return None
+        positions = [{value: i for i, value in enumerate(axis)} for axis in axes]
+        table = array("d", [float("nan")]) * size
+        for row, action in enumerate(self.actions):
+            flat = 0
+            for d, axis in enumerate(axes):
+                flat = flat * len(axis) + positions[d][columns[d][row]]
+            table[flat] = action
+        if any(value != value for value in table):
+            return None
+        return axes, table
+
+    @classmethod
+    def build(cls, setup_factory, states, control_period, horizon, workers=None, **kwargs):
+        """
+        Compute the table by running :meth:`MPCsetup.run_single` for each state, in parallel.
+
+        :param setup_factory: Function without arguments that creates a fresh :class:`~MPCsetup`.
+            Setups run in parallel, so they should not share files, for example by giving each its
+            own :class:`~Workspace`, which is cleaned up after the run.
+        :type setup_factory: callable
+        :param states: The states of the table, each a dictionary with the same variables. Other
+            state variables keep their values of the setup.
+        :type states: list
+        :param control_period: The interval duration after which the controller can change the
+            control setting, given in Uppaal Stratego time units.
+        :type control_period: int
+        :param horizon: The interval duration for which Uppaal stratego synthesizes a control
+            strategy. Is given in the number of control periods.
+        :type horizon: int
+        :param workers: The number of states computed in parallel. Defaults to the number of cores.
+        :type workers: int
+        :param `**kwargs`: Any additional parameters are forwarded to :meth:`MPCsetup.run_single`
+            and to the constructor.
+        :return: The table.
+        :rtype: :class:`~ExplicitController`
+        """
+        options = {name: kwargs.pop(name) for name in ("interpolate", "max_distance", "fallback")
+                   if name in kwargs}
+        variables = list(states[0].keys())
+
+        def solve(state):
+            setup = None
+            try:
+                setup = setup_factory()
+                setup.controller.update_state(state)
+                return setup.run_single(control_period, horizon, **kwargs)
+            finally:
+                if setup is not None and setup.workspace is not None:
+                    setup.workspace.cleanup()
+
+        workers = (os.cpu_count() or 1) if workers is None else workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            actions = list(executor.map(solve, states))
+        return cls(variables, [[state[var] for var in variables] for state in states], actions,
+                   **options)
+
+    @staticmethod
+    def grid(axes):
+        """
+        Create the states of a full grid.
+
+        :param axes: Dictionary containing pairs of state variable name and its values on the grid.
+        :type axes: dict
+        :return: List of state dictionaries.
+        :rtype: list
+        """
+        names = list(axes.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+    def covers(self, state):
+        """
+        Check whether the table covers a state.
+
+        :param state: The state, which should contain all variables of the table.
+        :type state: dict
+        :return: Whether the action of the state can be taken from the table.
+        :rtype: bool
+        """
+        return self._lookup([state[var] for var in self.variables]) is not None
+
+    def coverage(self, states):
+        """
+        :param states: The states to check.
+        :type states: list
+        :return: The fraction of *states* that is covered by the table.
+        :rtype: float
+        """
+        return sum(1 for state in states if self.covers(state)) / max(len(states), 1)
+
+    def action(self, state):
+        """
+        Get the action of a state, from the table if it is covered and from *fallback* otherwise.
+
+        :param state: The state, which should contain all variables of the table.
+        :type state: dict
+        :return: The action.
+        :rtype: float
+        """
+        action = self._lookup([state[var] for var in self.variables])
+        if action is not None:
+            self.hits += 1
+            return action
+        self.misses += 1
+        if self.fallback is None:
+            raise RuntimeError(f"The state {state} is not covered by the explicit controller.")
+        return self.fallback(state)
+
+    def _lookup(self, query):
+        for value, lower, upper in zip(query, self.lower, self.upper):
+            if not lower <= value <= upper:
+                return None
+        if self._grid is None:
+            scaled = [(value - lower) / scale
+                      for value, lower, scale in zip(query, self.lower, self._scale)]
+            index, distance = self._tree.nearest(scaled)
+            if self.max_distance is not None and distance > self.max_distance ** 2:
+                return None
+            return self.actions[index]
+
+        axes, table = self._grid
+        # The lower corner and the fraction towards the upper corner of the cell in each axis.
+        corners = []
+        for value, axis in zip(query, axes):
+            i = min(max(bisect.bisect_right(axis, value) - 1, 0), max(len(axis) - 2, 0))
+            fraction = 0.0 if len(axis) == 1 else (value - axis[i]) / (axis[i + 1] - axis[i])
+            if not self.interpolate:
+                i, fraction = (i + 1, 0.0) if fraction > 0.5 else (i, 0.0)
+            corners.append((i, fraction))
+        action = 0.0
+        for offsets in itertools.product((0, 1), repeat=len(axes)):
+            weight = 1.0
+            flat = 0
+            for (i, fraction), offset, axis in zip(corners, offsets, axes):
+                weight *= fraction if offset else 1.0 - fraction
+                flat = flat * len(axis) + min(i + offset, len(axis) - 1)
+            if weight:
+                action += weight * table[flat]
+        return action
+
+    def save(self, path):
+        """
+        Save the table to a binary file, with a JSON header line followed by the states and the
+        actions as doubles.
+
+        :param path: The file name.
+        :type path: str
+        """
+        header = {"variables": self.variables, "rows": len(self.actions),
+                  "byteorder": sys.byteorder, "interpolate": self.interpolate,
+                  "max_distance": self.max_distance}
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            self.points.tofile(f)
+            self.actions.tofile(f)
+
+    @classmethod
+    def load(cls, path, fallback=None):
+        """
+        Load a table saved with :meth:`save`.
+
+        :param path: The file name.
+        :type path: str
+        :param fallback: Function that gives the action of an uncovered state.
+        :type fallback: callable
+        :return: The table.
+        :rtype: :class:`~ExplicitController`
+        """
+        with open(path, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            dims = len(header["variables"])
+            points = array("d")
+            points.fromfile(f, header["rows"] * dims)
+            actions = array("d")
+            actions.fromfile(f, header["rows"])
+        if header["byteorder"] != sys.byteorder:
+            points.byteswap()
+            actions.byteswap()
+        rows = [points[i * dims:(i + 1) * dims] for i in range(header["rows"])]
+        return cls(header["variables"], rows, actions, header["interpolate"],
+                   header["max_distance"], fallback)
+
+
+def load_config(path):
+    """
+    Load a configuration file, like the model and verifyta configuration files or a manifest of
+    experiments. YAML files require the ``pyyaml`` package; files ending with ``.json`` are read
+    without it.
+
+    :param path: The file name.
+    :type path: str
+    :return: The content of the file.
+    :rtype: dict
+    """
+    with open(path, "r") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        if yaml is None:
+            raise RuntimeError(f"Reading {path} requires pyyaml. Install it with "
+                               f"'pip install strategoutil[yaml]'.")
+        return yaml.safe_load(f)
+
+
+def _parse_size(size):
+    """
+    Convert a memory size like ``512M`` or ``2G`` to bytes.
+    """
+    if size is None or isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip("B")
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def expand_manifest(manifest, base_directory="."):
+    """
+    Expand the experiments of a manifest into one experiment per combination of the values in its
+    parameter matrix.
+
+    Each experiment of the manifest has a ``name``, a ``template`` model, a ``model_config`` and a
+    ``verifyta_config`` file, and the ``period``, ``horizon`` and ``duration`` of
+    :meth:`MPCsetup.run`. The optional ``matrix`` maps ``period``, ``horizon`` or ``duration``,
+    and the variables of the model configuration or learning parameters in the sub-dictionaries
+    ``model`` and ``learning``, to the list of values to try. Further optional keys are
+    ``setup`` (``module:Class`` of the :class:`~MPCsetup` subclass), ``options`` (additional
+    keyword arguments of that class), ``checkpoint_every`` (no checkpoints by default),
+    ``cores`` and ``memory`` (per run of the experiment, like ``2G``). The manifest may give a
+    ``verifyta_command`` for all experiments.
+
+    :param manifest: The manifest.
+    :type manifest: dict
+    :param base_directory: The directory relative to which the file names are resolved.
+    :type base_directory: str
+    :return: The expanded experiments. Each has an ``id`` that is unique for its name and
+        configuration, which is used to recognize completed experiments. Experiments with the same
+        name and configuration, for example from repeated values in a matrix, are an error.
+    :rtype: list
+    """
+    experiments = []
+    ids = set()
+    for spec in manifest.get("experiments", []):
+        missing = {"name", "template", "model_config", "verifyta_config", "period", "horizon",
+                   "duration"} - spec.keys()
+        if missing:
+            raise RuntimeError(
+                f"Experiment {spec.get('name')} misses {', '.join(sorted(missing))}.")
+        model_cfg = load_config(os.path.join(base_directory, spec["model_config"]))
+        learning_args = load_config(os.path.join(base_directory, spec["verifyta_config"])) or {}
+        matrix = []
+        for key, values in spec.get("matrix", {}).items():
+            if key in ("model", "learning"):
+                matrix.extend(((key, name), name_values) for name, name_values in values.items())
+            elif key in ("period", "horizon", "duration"):
+                matrix.append(((key, None), values))
+            else:
+                raise RuntimeError(f"Unknown matrix parameter {key} in experiment "
+                                   f"{spec['name']}.")
+
+        for combination in itertools.product(*[values for _, values in matrix]):
+            experiment = {
+                "name": spec["name"],
+                "template": os.path.abspath(os.path.join(base_directory, spec["template"])),
+                "model_cfg": dict(model_cfg),
+                "learning_args": dict(learning_args),
+                "period": spec["period"],
+                "horizon": spec["horizon"],
+                "duration": spec["duration"],
+                "setup": spec.get("setup"),
+                "options": spec.get("options", {}),
+                "checkpoint_every": spec.get("checkpoint_every"),
+                "cores": spec.get("cores", 1),
+                "memory": _parse_size(spec.get("memory")),
+                "verifyta_command": spec.get("verifyta_command",
+                                             manifest.get("verifyta_command", "verifyta")),
+                "base_directory": os.path.abspath(base_directory),
+                "parameters": {},
+            }
+            for ((kind, name), _), value in zip(matrix, combination):
+                if kind == "model":
+                    experiment["model_cfg"][name] = value
+                elif kind == "learning":
+                    experiment["learning_args"][name] = value
+                else:
+                    experiment[kind] = value
+                experiment["parameters"][kind if name is None else f"{kind}.{name}"] = value
+            fingerprint = json.dumps({key: experiment[key] for key in
+                                      ("template", "model_cfg", "learning_args", "period",
+                                       "horizon", "duration", "setup", "options")},
+                                     sort_keys=True, default=str)
+            experiment["id"] = "{}-{}".format(
+                spec["name"], hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:10])
+            if experiment["id"] in ids:
+                raise RuntimeError(f"Experiment {spec['name']} with parameters "
+                                   f"{experiment['parameters']} occurs more than once.")
+            ids.add(experiment["id"])
+            experiments.append(experiment)
+    return experiments
+
+
+def run_experiment(experiment, directory, cpu_affinity=None):
+    """
+    Run a single experiment of :func:`expand_manifest` with :meth:`MPCsetup.resume`, such that an
+    interrupted experiment continues from its last checkpoint. The results, checkpoint and
+    temporary files are written to *directory*, where ``completed.json`` marks a completed
+    experiment.
+
+    :param experiment: The experiment.
+    :type experiment: dict
+    :param directory: The directory of the experiment.
+    :type directory: str
+    :param cpu_affinity: The CPU cores verifyta may run on.
+    :type cpu_affinity: iterable of int
+    :return: The summary of the run, as written to ``completed.json``.
+    :rtype: dict
+    """
+    setup_class = MPCsetup
+    if experiment["setup"] is not None:
+        module_name, class_name = experiment["setup"].split(":")
+        if experiment["base_directory"] not in sys.path:
+            sys.path.insert(0, experiment["base_directory"])
+        setup_class = getattr(__import__(module_name), class_name)
+
+    start = time.perf_counter()
+    workspace = Workspace(directory=directory)
+    launcher = ProcessLauncher(cpu_affinity=cpu_affinity, memory_limit=experiment["memory"])
+    setup = setup_class(experiment["template"], query_file="query.q",
+                        model_cfg_dict=dict(experiment["model_cfg"]),
+                        learning_args=dict(experiment["learning_args"]),
+                        verifyta_command=experiment["verifyta_command"], launcher=launcher,
+                        workspace=workspace,
+                        result_sink=CSVSink(workspace.path("results.csv")),
+                        checkpoint_every=experiment["checkpoint_every"],
+                        checkpoint_file=workspace.path("checkpoint.pickle"),
+                        **experiment["options"])
+    with open(workspace.path("stdout.log"), "a") as log, contextlib.redirect_stdout(log):
+        setup.resume(experiment["period"], experiment["horizon"], experiment["duration"])
+
+    summary = {"id": experiment["id"], "name": experiment["name"],
+               "parameters": experiment["parameters"], "results": workspace.path("results.csv"),
+               "wall_time": time.perf_counter() - start,
+               "synthesis_time": sum(metrics["synthesis_time"]
+                                     for metrics in setup.step_metrics)}
+    temporary = workspace.path("completed.json.tmp")
+    with open(temporary, "w") as f:
+        json.dump(summary, f)
+    os.replace(temporary, workspace.path("completed.json"))
+    return summary
+
+
+_INDEX_FIELDS = ["id", "name", "status", "wall_time", "synthesis_time", "results", "parameters",
+                 "error"]
+
+
+def run_experiments(experiments, output_directory, jobs=None, cores=None, memory_limit=None,
+                    force=False, log=print):
+    """
+    Run experiments in a bounded pool of processes and write their outcomes to ``index.csv`` in
+    *output_directory*.
+
+    An experiment starts when a worker process is free, enough of the *cores* are free for its
+    ``cores``, and its ``memory`` fits in what is left of *memory_limit*. Each experiment's
+    verifyta is pinned to its cores where supported, and limited to its memory. Experiments that
+    have completed before are skipped, and failed experiments are retried on the next call.
+
+    :param experiments: The experiments, see :func:`expand_manifest`.
+    :type experiments: list
+    :param output_directory: The directory with one subdirectory per experiment.
+    :type output_directory: str
+    :param jobs: The maximum number of experiments that run at the same time. Defaults to the
+        number of cores.
+    :type jobs: int
+    :param cores: The number of cores to use. Defaults to all cores available to this process.
+    :type cores: int
+    :param memory_limit: The memory in bytes available to all running experiments. Experiments
+        without ``memory`` are not limited.
+    :type memory_limit: int
+    :param force: Whether to run completed experiments again.
+    :type force: bool
+    :param log: Function called with a line of progress information.
+    :type log: callable
+    :return: The entries of the index, one per experiment, with the fields ``id``, ``name``,
+        ``status`` (``"completed"``, ``"skipped"`` or ``"failed"``), ``wall_time``,
+        ``synthesis_time``, ``results``, ``parameters`` and ``error``.
+    :rtype: list
+    """
+    if hasattr(os, "sched_getaffinity"):
+        available_cores = sorted(os.sched_getaffinity(0))
+    else:
+        available_cores = list(range(os.cpu_count() or 1))
+    if cores is not None:
+        available_cores = available_cores[:cores]
+    pin = hasattr(os, "sched_setaffinity")
+    jobs = len(available_cores) if jobs is None else jobs
+
+    entries = {}
+    pending = []
+    for experiment in experiments:
+        directory = os.path.join(output_directory, experiment["id"])
+        marker = os.path.join(directory, "completed.json")
+        if experiment["cores"] > len(available_cores) or (
+                memory_limit is not None and (experiment["memory"] or 0) > memory_limit):
+            entries[experiment["id"]] = {"status": "failed",
+                                         "error": "needs more cores or memory than available"}
+        elif os.path.exists(marker) and not force:
+            with open(marker, "r") as f:
+                entries[experiment["id"]] = dict(json.load(f), status="skipped")
+        else:
+            if os.path.exists(marker):
+                os.remove(marker)
+            pending.append((experiment, directory))
+    log(f"{len(experiments)} experiments, {len(pending)} to run")
+
+    free_cores = list(available_cores)
+    free_memory = memory_limit
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while pending or running:
+            for item in list(pending):
+                experiment, directory = item
+                memory = experiment["memory"] or 0
+                if len(running) >= jobs or experiment["cores"] > len(free_cores) or (
+                        free_memory is not None and memory > free_memory):
+                    continue
+                assigned = free_cores[:experiment["cores"]]
+                del free_cores[:experiment["cores"]]
+                if free_memory is not None:
+                    free_memory -= memory
+                pending.remove(item)
+                future = executor.submit(run_experiment, experiment, directory,
+                                         assigned if pin else None)
+                running[future] = (experiment, assigned)
+
+            done, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                experiment, assigned = running.pop(future)
+                free_cores.extend(assigned)
+                if free_memory is not None:
+                    free_memory += experiment["memory"] or 0
+                try:
+                    entries[experiment["id"]] = dict(future.result(), status="completed")
+                except Exception as error:
+                    entries[experiment["id"]] = {"status": "failed", "error": str(error)}
+                log(f"{experiment['id']}: {entries[experiment['id']]['status']}")
+
+    index = []
+    for experiment in experiments:
+        entry = {"id": experiment["id"], "name": experiment["name"], "wall_time": None,
+                 "synthesis_time": None, "results": None, "error": None}
+        entry.update(entries[experiment["id"]])
+        entry["parameters"] = experiment["parameters"]
+        index.append(entry)
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, "index.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, _INDEX_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for entry in index:
+            writer.writerow(dict(entry, parameters=json.dumps(entry["parameters"])))
+    return index
+
+
+def main(argv=None):
+    """
+    Entry point of the ``stompc`` command, which runs the experiments of a manifest with
+    :func:`run_experiments`.
+
+    :param argv: The command line arguments. Defaults to those of the process.
+    :type argv: list
+    :return: The exit status, which is 1 if an experiment failed.
+    :rtype: int
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="stompc", description="Run a manifest of MPC experiments with Uppaal Stratego.")
+    parser.add_argument("manifest", help="YAML or JSON file with the experiments")
+    parser.add_argument("-o", "--output", default=None,
+                        help="directory of the results (default: output_directory of the "
+                             "manifest, or 'results' next to it)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="maximum number of experiments running at the same time")
+    parser.add_argument("--cores", type=int, default=None, help="number of cores to use")
+    parser.add_argument("--memory-limit", default=None,
+                        help="memory available to all running experiments, like 16G")
+    parser.add_argument("--force", action="store_true",
+                        help="run experiments again that have completed before")
+    args = parser.parse_args(argv)
+
+    manifest = load_config(args.manifest)
+    base_directory = os.path.dirname(os.path.abspath(args.manifest))
+    output_directory = args.output
+    if output_directory is None:
+        output_directory = os.path.join(base_directory,
+                                        manifest.get("output_directory", "results"))
+    experiments = expand_manifest(manifest, base_directory)
+    index = run_experiments(experiments, output_directory, args.jobs, args.cores,
+                            _parse_size(args.memory_limit), args.force)
+    return int(any(entry["status"] == "failed" for entry in index))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
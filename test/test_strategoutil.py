@@ -1,12 +1,23 @@
 import unittest
-from unittest import mock
+import asyncio
+import contextlib
+import csv
+import gc
+import io
+import json
 import os
+import re
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from array import array
 import strategoutil as sutil
 
 
 class TestUtil(unittest.TestCase):
-    POPEN_KWARGS = {"shell": True, "stdout": -1, "stderr": -1}
-
     def test_get_int_tuples_given_single_variable_simulate(self):
         verifyta_output = """
         -- Formula is satisfied.
@@ -52,12 +63,97 @@ x:
         expected = 11.1
         self.assertEqual(result, expected)
 
+    def test_parse_simulate_output_given_multiple_variables(self):
+        verifyta_output = """
+Options for the verification:
+  Generating no trace
+-- Formula is satisfied.
+x:
+[0]: (0,0.0) (4,0.0) (4,1.5) (25,1)
+[1]: (0,0.0) (25,2e-1)
+t:
+[0]: (0,0) (25,25)
+"""
+        result = sutil.parse_simulate_output(verifyta_output)
+        self.assertListEqual(sorted(result.keys()), ["t", "x"])
+        self.assertEqual(len(result["x"]), 2)
+        times, values = result["x"][1]
+        self.assertListEqual(list(times), [0.0, 25.0])
+        self.assertListEqual(list(values), [0.0, 0.2])
+
+    def test_parse_simulate_output_given_no_simulation(self):
+        verifyta_output = """
+-- Formula is not satisfied.
+"""
+        result = sutil.parse_simulate_output(verifyta_output)
+        self.assertDictEqual(result, {})
+        with self.assertRaises(RuntimeError):
+            sutil.get_trajectory(result, "x")
+
+    def test_extract_states_from_stratego_given_multiple_variables(self):
+        verifyta_output = """
+-- Formula is satisfied.
+x:
+[0]: (0,0.0) (4,0.0) (4,1.5) (17.456,1) (17.456,4.123456) (25,0.000) (25,1) (36,12.11)
+a:
+[0]: (0,0) (0,3) (36,3)
+"""
+        setup = sutil.MPCsetup("model.xml", model_cfg_dict={"x": 0.0, "a": 0},
+                               external_simulator=True, action_variable="a")
+        setup.extract_states_from_stratego(verifyta_output, 35)
+        self.assertEqual(setup.controller.get_state("x"), 11.1)
+        self.assertEqual(setup.controller.get_state("a"), 3)
+        self.assertEqual(setup.extract_control_action_from_stratego(verifyta_output), 3.0)
+
     def test_get_duration_action_given_empty_input(self):
         input_case = []
         result = sutil.get_duration_action(input_case)
         expected = []
         self.assertListEqual(result, expected)
 
+    @unittest.skipIf(sutil.np is None, "NumPy is not installed")
+    def test_resample_matches_interpolation_at_discontinuities(self):
+        times = [0, 3, 5, 5, 10, 12]
+        values = [0, 3, 1, 7, 2, 4]
+        for control_period in [1, 2, 3, 5]:
+            grid = [p * control_period for p in range(1, 12) if p * control_period < 12]
+            resampled = sutil.resample(times, values, grid)
+            self.assertAlmostEqual(resampled[-1],
+                                   sutil.interpolate_at_last_period(times, values, control_period))
+        resampled = sutil.resample(times, values, [-1, 5, 11, 13])
+        self.assertListEqual(list(resampled[1:3]), [7.0, 3.0])
+        self.assertTrue(sutil.np.isnan(resampled[0]) and sutil.np.isnan(resampled[3]))
+
+    @unittest.skipIf(sutil.np is None, "NumPy is not installed")
+    def test_resample_trajectories_all_runs(self):
+        trajectories = sutil.parse_simulate_output(
+            "x:\n[0]: (0,0) (10,10)\n[1]: (0,0) (10,20)\ny:\n[0]: (0,1) (10,1)\n")
+        resampled = sutil.resample_trajectories(trajectories, [5, 10], run=None)
+        self.assertListEqual(resampled["x"].tolist(), [[5.0, 10.0], [10.0, 20.0]])
+        self.assertListEqual(resampled["y"].tolist(), [[1.0, 1.0]])
+
+    @unittest.skipIf(sutil.np is None, "NumPy is not installed")
+    def test_ensemble_statistics_at_periods(self):
+        trajectories = sutil.parse_simulate_output(
+            "x:\n[0]: (0,0) (20,20)\n[1]: (0,0) (20,40)\n[2]: (0,0) (20,60)\n")
+        ensemble = sutil.Ensemble.at_periods(trajectories, 10, 2)
+        self.assertEqual(ensemble.runs["x"].shape, (3, 2))
+        self.assertListEqual(ensemble.mean("x").tolist(), [20.0, 40.0])
+        self.assertListEqual(ensemble.quantile("x", 0.5).tolist(), [20.0, 40.0])
+        self.assertListEqual(ensemble.exceedance("x", 25).tolist(), [1 / 3, 2 / 3])
+        with self.assertRaises(RuntimeError):
+            ensemble.statistic("x", "mode")
+
+    @unittest.skipIf(sutil.np is None, "NumPy is not installed")
+    def test_predict_state_given_ensemble_statistic(self):
+        output = "t:\n[0]: (0,0) (11,11)\n[1]: (0,0) (11,11)\n" \
+                 "x:\n[0]: (0,0) (11,11)\n[1]: (0,0) (11,33)\n"
+        setup = sutil.MPCsetup("model.xml", model_cfg_dict={"t": 0, "x": 0.0},
+                               state_statistic="max")
+        self.assertDictEqual(setup.predict_state(output, 10), {"t": 10, "x": 30.0})
+        setup.state_statistic = "mean"
+        self.assertDictEqual(setup.predict_state(output, 10), {"t": 10, "x": 20.0})
+
     def test_get_duration_action_given_arbitrary_input(self):
         input_case = [(0,0), (4,0), (4,1), (17,1), (17,0), (25,0), (25,1), (36,1)]
         result = sutil.get_duration_action(input_case)
@@ -90,46 +186,93 @@ x:
             self.assertEqual(result, expected)
 
     def test_run_stratego_model_only(self):
-        with mock.patch("strategoutil.subprocess.Popen") as mock_Popen:
-            sutil.run_stratego("model.xml", verifyta_command="$HOME/verifyta")
-            # Below is the expected result with Popen default shell.
-            expected = "$HOME/verifyta \"model.xml\""
-
-            mock_Popen.assert_called_with(expected, **self.POPEN_KWARGS)
+        launcher = sutil.FakeLauncher()
+        sutil.run_stratego("model.xml", verifyta_command="$HOME/verifyta", launcher=launcher)
+        expected = ["$HOME/verifyta", "model.xml"]
+        self.assertListEqual(launcher.calls[-1], expected)
 
     def test_run_stratego_model_and_query(self):
-        with mock.patch("strategoutil.subprocess.Popen") as mock_Popen:
-            sutil.run_stratego("model.xml", "query.q")
-            # Below is the expected result with Popen default shell.
-            expected = "verifyta \"model.xml\" \"query.q\""
-            mock_Popen.assert_called_with(expected, **self.POPEN_KWARGS)
+        launcher = sutil.FakeLauncher()
+        sutil.run_stratego("model.xml", "query.q", launcher=launcher)
+        expected = ["verifyta", "model.xml", "query.q"]
+        self.assertListEqual(launcher.calls[-1], expected)
 
     def test_run_stratego_all_variables(self):
-        with mock.patch("strategoutil.subprocess.Popen") as mock_Popen:
-            learning_args = {
-                "learning-method": "4",
-                "good-runs": "100",
-                "total-runs": "100",
-                "runs-pr-state": "100",
-                "eval-runs": "100",
-                "max-iterations": "30",
-                "filter": "0"
-            }
-            sutil.run_stratego("model.xml", "query.q", learning_args, "verifyta")
-            # Below is the expected result with Popen default shell.
-            expected = ("verifyta \"model.xml\" \"query.q\" --learning-method 4 "
-                        "--good-runs 100 --total-runs 100 --runs-pr-state 100 "
-                        "--eval-runs 100 --max-iterations 30 --filter 0")
-            mock_Popen.assert_called_with(expected, **self.POPEN_KWARGS)
+        launcher = sutil.FakeLauncher()
+        learning_args = {
+            "learning-method": "4",
+            "good-runs": "100",
+            "total-runs": "100",
+            "runs-pr-state": "100",
+            "eval-runs": "100",
+            "max-iterations": "30",
+            "filter": "0",
+            "nosummary": None,
+            "silence-progress": ""
+        }
+        sutil.run_stratego("model.xml", "query.q", learning_args, "verifyta", launcher=launcher)
+        expected = ["verifyta", "model.xml", "query.q", "--learning-method", "4",
+                    "--good-runs", "100", "--total-runs", "100", "--runs-pr-state", "100",
+                    "--eval-runs", "100", "--max-iterations", "30", "--filter", "0",
+                    "--nosummary", "--silence-progress"]
+        self.assertListEqual(launcher.calls[-1], expected)
 
     def test_run_stratego_with_space_in_path(self):
-        with mock.patch("strategoutil.subprocess.Popen") as mock_Popen:
-            sutil.run_stratego("folder with spaces/model.xml", verifyta_command="$HOME/verifyta")
-            # Below is the expected result with Popen default shell.
-            expected = "$HOME/verifyta \"folder with spaces/model.xml\""
+        launcher = sutil.FakeLauncher()
+        sutil.run_stratego("folder with spaces/model.xml", verifyta_command="$HOME/verifyta",
+                           launcher=launcher)
+        expected = ["$HOME/verifyta", "folder with spaces/model.xml"]
+        self.assertListEqual(launcher.calls[-1], expected)
+
+    def test_run_stratego_given_error(self):
+        launcher = sutil.FakeLauncher(lambda argv: ("", "syntax error"))
+        with self.assertRaises(RuntimeError):
+            sutil.run_stratego("model.xml", launcher=launcher)
+
+    def test_process_launcher_reports_timing(self):
+        launcher = sutil.ProcessLauncher()
+        result = launcher.run([sys.executable, "-c", "print('done')"])
+        self.assertEqual(result.stdout.strip(), "done")
+        self.assertEqual(result.returncode, 0)
+        self.assertLessEqual(result.spawn_time, result.wall_time)
+        if hasattr(os, "wait4"):
+            self.assertGreater(result.peak_rss, 0)
+            self.assertGreaterEqual(result.cpu_time, 0.0)
+
+    def test_process_launcher_does_not_signal_reaped_process(self):
+        process = sutil.ProcessLauncher().launch([sys.executable, "-c", "pass"])
+        sutil._wait_with_rusage(process)
+        self.assertEqual(process.returncode, 0)
+        process.kill()
+        self.assertEqual(process.returncode, 0)
+
+    @unittest.skipUnless(hasattr(os, "sched_setaffinity"), "CPU pinning is not supported")
+    def test_process_launcher_applies_resource_settings(self):
+        core = min(os.sched_getaffinity(0))
+        launcher = sutil.ProcessLauncher(cpu_affinity=[core], memory_limit=1 << 34)
+        result = launcher.run([sys.executable, "-c", "import os, resource; "
+                               "print(sorted(os.sched_getaffinity(0)), "
+                               "resource.getrlimit(resource.RLIMIT_AS)[0])"])
+        self.assertEqual(result.stdout.strip(), f"[{core}] {1 << 34}")
+
+    def test_run_stratego_given_command_with_arguments(self):
+        launcher = sutil.FakeLauncher()
+        sutil.run_stratego("model.xml", verifyta_command="verifyta --silence-progress",
+                           launcher=launcher)
+        self.assertListEqual(launcher.calls[-1], ["verifyta", "--silence-progress", "model.xml"])
+
+    def test_cancellable_launcher_delegates_runs(self):
+        launcher = sutil._CancellableLauncher(sutil.FakeLauncher(lambda argv: "fake"))
+        self.assertEqual(launcher.run(["verifyta"]).stdout, "fake")
+        self.assertEqual(asyncio.run(launcher.arun(["verifyta"])).stdout, "fake")
+        launcher.cancel()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(launcher.arun(["verifyta"]))
+
+    def test_resolve_executable_given_unknown_command(self):
+        with self.assertRaises(RuntimeError):
+            sutil.resolve_executable("surely-not-an-existing-verifyta")
 
-            mock_Popen.assert_called_with(expected, **self.POPEN_KWARGS)
-            
     def test_successful_result_true(self):
         verifyta_output = """
         -- Formula is satisfied.
@@ -148,6 +291,32 @@ x:
         result = sutil.successful_result(verifyta_output)
         self.assertFalse(result)
 
+    def test_portfolio_selects_lowest_cost(self):
+        def handler(argv):
+            seed = int(argv[argv.index("--seed") + 1])
+            return f"-- Formula is satisfied.\n(100 runs) E(max) = {10 - seed} \u00b1 0.1 (95% CI)\n"
+
+        portfolio = sutil.Portfolio(3, cores=2, learning_methods=[4, 5])
+        output, outcomes = portfolio.run("model.xml", "query.q", {"good-runs": 10},
+                                         launcher=sutil.FakeLauncher(handler))
+        self.assertEqual(len(outcomes), 2)
+        self.assertEqual(portfolio.cost(output), 8.0)
+        self.assertTrue(outcomes[1]["selected"])
+        self.assertDictEqual(outcomes[1]["learning_args"],
+                             {"good-runs": 10, "seed": 2, "learning-method": 5})
+
+    def test_portfolio_prefers_satisfied_runs(self):
+        def handler(argv):
+            if argv[argv.index("--seed") + 1] == "1":
+                return "-- Formula is not satisfied.\n"
+            return "-- Formula is satisfied.\n"
+
+        portfolio = sutil.Portfolio(2, cores=2)
+        output, outcomes = portfolio.run("model.xml", launcher=sutil.FakeLauncher(handler))
+        self.assertTrue(sutil.successful_result(output))
+        self.assertListEqual([outcome["selected"] for outcome in outcomes], [False, True])
+
+
 class TestFileInteraction(unittest.TestCase):
     def setUp(self):
         """
@@ -162,11 +331,36 @@ class TestFileInteraction(unittest.TestCase):
             some more important definitions
             """)
 
+        self.workspace = sutil.Workspace()
+
     def tearDown(self):
         """
         Remove model file.
         """
         os.remove(self.modelfile)
+        self.workspace.cleanup()
+
+    def make_setup(self, output="t:\n[0]: (0,0) (11,11)\nX:\n[0]: (0,42) (11,53)\n",
+                   setup_class=sutil.MPCsetup, **kwargs):
+        """
+        Create a setup of the model with an additional clock t, whose files are written to the
+        workspace of the test. Verifyta is faked by *output*, which is either its output or a
+        function that gives the output for the argument list. The setup does not print anything
+        but its results.
+        """
+        with open(self.modelfile, "r+") as fin:
+            if "//TAG_t" not in fin.read():
+                fin.write("clock t = //TAG_t;")
+        handler = output if callable(output) else lambda argv: output
+        kwargs.setdefault("launcher", sutil.FakeLauncher(handler))
+        kwargs.setdefault("query_file", "query.q")
+        kwargs.setdefault("model_cfg_dict", {"t": 0, "X": 42.0})
+        kwargs.setdefault("workspace", self.workspace)
+        setup = setup_class(self.modelfile, **kwargs)
+        setup.show_progress = False
+        if setup.result_sink is None:
+            setup.print_state_vars = setup.print_state = lambda: None
+        return setup
 
     def test_insert_to_modelfile(self):
         tag = "//TAG_X"
@@ -176,3 +370,980 @@ class TestFileInteraction(unittest.TestCase):
         with open(self.modelfile, "r") as fin:
             correct_substitution = "int important_variable_X = 42;" in fin.read()
             self.assertTrue(correct_substitution)
+
+    def test_model_template_render(self):
+        template = sutil.ModelTemplate(self.modelfile)
+        result = template.render({"X": 42})
+        self.assertIn("int important_variable_X = 42;", result)
+        self.assertEqual(template.tags["X"], result.index("42"))
+
+    def test_model_template_missing_tag(self):
+        template = sutil.ModelTemplate(self.modelfile)
+        with self.assertRaises(RuntimeError):
+            template.render({"X": 42, "Y": 1})
+
+    def test_model_template_duplicate_tag(self):
+        with open(self.modelfile, "a") as fin:
+            fin.write("int other_variable_X = //TAG_X;")
+        with self.assertRaises(RuntimeError):
+            sutil.ModelTemplate(self.modelfile)
+
+    def test_controller_insert_state(self):
+        controller = sutil.StrategoController(self.modelfile, {"X": 42})
+        controller.insert_state()
+        with open(controller.simulation_file, "r") as fin:
+            correct_substitution = "int important_variable_X = 42;" in fin.read()
+        controller.remove_simfile()
+        self.assertTrue(correct_substitution)
+
+    def test_controller_reloads_changed_template(self):
+        controller = sutil.StrategoController(self.modelfile, {"X": 42},
+                                              workspace=self.workspace)
+        controller.insert_state()
+        with open(self.modelfile, "a") as fin:
+            fin.write("int Y = 1;")
+        controller.insert_state()
+        with open(controller.simulation_file, "r") as fin:
+            self.assertIn("int Y = 1;", fin.read())
+
+    def test_mpcsetup_run_with_fake_launcher(self):
+        output = """
+-- Formula is satisfied.
+t:
+[0]: (0,0) (11,11)
+X:
+[0]: (0,42) (11,53)
+"""
+        setup = self.make_setup(output, output_file_path=self.workspace.path("output.txt"))
+        setup.run(10, 2, 2)
+        setup.close()
+        with open(self.workspace.path("output.txt"), "r") as fin:
+            lines = fin.read().splitlines()
+        self.assertListEqual(lines, ["t,X", "0,42.0", "10,52.0", "10,52.0"])
+        self.assertEqual(len(setup.controller.launcher.calls), 2)
+
+    def test_mpcsetup_run_with_profiler(self):
+        profiler = sutil.Profiler()
+        seen = []
+        profiler.add_hook(seen.append)
+        setup = self.make_setup(profiler=profiler)
+        setup.run(10, 2, 2)
+        setup.close()
+        phases = ["start_iteration", "render", "query", "verifyta", "parse"]
+        self.assertListEqual([record["phase"] for record in profiler.records], phases * 2)
+        self.assertListEqual([record["step"] for record in profiler.records], [0] * 5 + [1] * 5)
+        self.assertListEqual(seen, profiler.records)
+        self.assertEqual(profiler.summary()["verifyta"]["count"], 2)
+
+        profiler.to_chrome_trace(self.workspace.path("trace.json"))
+        with open(self.workspace.path("trace.json"), "r") as fin:
+            events = json.load(fin)["traceEvents"]
+        self.assertEqual(len(events), 10)
+        self.assertEqual(events[3]["ph"], "X")
+        profiler.to_csv(self.workspace.path("profile.csv"))
+        with open(self.workspace.path("profile.csv"), "r") as fin:
+            self.assertEqual(len(fin.read().splitlines()), 11)
+
+    def test_csv_sink_batches_rows(self):
+        path = self.workspace.path("output.csv")
+        sink = sutil.CSVSink(path, flush_every=2, flush_interval=None)
+        sink.open(["t", "X"])
+        sink.write([0, 1.5])
+        with open(path, "r") as fin:
+            self.assertListEqual(fin.read().splitlines(), ["t,X"])
+        sink.write([10, 2.5])
+        sink.write([20, 3.5])
+        sink.close()
+        with open(path, "r") as fin:
+            lines = fin.read().splitlines()
+        self.assertListEqual(lines, ["t,X", "0,1.5", "10,2.5", "20,3.5"])
+
+    def test_csv_sink_writes_each_row_by_default(self):
+        path = self.workspace.path("output.csv")
+        sink = sutil.CSVSink(path)
+        sink.open(["t", "X"])
+        sink.write([0, 1.5])
+        with open(path, "r") as fin:
+            lines = fin.read().splitlines()
+        sink.close()
+        self.assertListEqual(lines, ["t,X", "0,1.5"])
+
+    def test_result_sink_requires_implementation(self):
+        class IncompleteSink(sutil.ResultSink):
+            def _open(self, append):
+                pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+
+        class ListSink(IncompleteSink):
+            def _write_rows(self, rows):
+                self.rows = list(rows)
+
+            def _close(self):
+                pass
+
+        with ListSink() as sink:
+            sink.open(["t"])
+            sink.write([0])
+        self.assertListEqual(sink.rows, [[0]])
+        with self.assertRaisesRegex(RuntimeError, "checkpoints"):
+            sink.position()
+
+    def test_mpcsetup_run_with_columnar_sink(self):
+        sink = sutil.ColumnarSink(self.workspace.path("results"), flush_every=2)
+        setup = self.make_setup(result_sink=sink)
+        setup.run(10, 2, 4)
+        setup.close()
+        columns = sutil.load_columns(self.workspace.path("results"))
+        self.assertListEqual(list(columns["t"]), [0.0] + [10.0] * 4)
+        self.assertListEqual(list(columns["X"]), [42.0] + [52.0] * 4)
+
+    def test_mpcsetup_run_with_trajectory_archive(self):
+        output = "t:\n[0]: (0,0) (11,11)\nX:\n[0]: (0,42) (0.1,42.5) (11,53)\n" \
+                 "[1]: (0,42) (11,54)\n"
+        archive = sutil.TrajectoryArchive(self.workspace.path("archive"), flush_every=3)
+        setup = self.make_setup(output, archive=archive)
+        setup.run(10, 2, 4)
+        setup.close()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(setup.arun(10, 2, 4))
+        reader = sutil.ArchiveReader(self.workspace.path("archive"))
+        self.assertEqual(len(reader), 4)
+        steps = list(reader.range(1, 3))
+        self.assertListEqual([entry["step"] for entry in steps], [1, 2])
+        times, values = steps[0]["trajectories"]["X"][0]
+        self.assertListEqual(list(values), [42.0, 42.5, 53.0])
+        self.assertAlmostEqual(times[1], 0.1, places=6)
+        self.assertEqual(len(steps[0]["trajectories"]["X"]), 2)
+        self.assertIn("synthesis_time", steps[0]["timing"])
+
+        reader.close()
+
+        archive.resume(2)
+        self.assertEqual(archive.position(), 2)
+        with sutil.ArchiveReader(self.workspace.path("archive")) as reader:
+            self.assertEqual(len(reader), 2)
+
+    def test_archive_reader_decodes_arrays(self):
+        for encoding in ["float64", "float32", "delta32"]:
+            directory = self.workspace.path(encoding)
+            archive = sutil.TrajectoryArchive(directory, encoding=encoding, flush_every=2)
+            with sutil.ArchiveReader(directory) as reader:
+                self.assertEqual(len(reader), 0)
+            archive.append(0, {"X": [(array("d", [0.0, 0.5]), array("d", [1.0, 2.0]))]})
+            archive.close()
+            with sutil.ArchiveReader(directory) as reader:
+                times, values = reader.get(0)["trajectories"]["X"][0]
+            self.assertIsInstance(times, array)
+            self.assertEqual(times.typecode, "d")
+            self.assertListEqual(list(times), [0.0, 0.5])
+            self.assertListEqual(list(values), [1.0, 2.0])
+
+    def test_archive_delta32_does_not_drift(self):
+        times = array("d", [1e6 + 0.1 * i for i in range(100000)])
+        archive = sutil.TrajectoryArchive(self.workspace.path("archive"))
+        archive.append(0, {"X": [(times, array("d", [0.0] * len(times)))]})
+        archive.close()
+        with sutil.ArchiveReader(self.workspace.path("archive")) as reader:
+            decoded = reader.get(0)["trajectories"]["X"][0][0]
+        self.assertLess(max(abs(a - b) for a, b in zip(times, decoded)), 1e-6)
+
+    def test_mpcsetup_reuses_stored_strategies(self):
+        queries = []
+
+        def fake_verifyta(argv):
+            with open(argv[2], "r") as fin:
+                query = fin.read()
+            queries.append(query)
+            for path in re.findall(r'saveStrategy\("([^"]+)"', query):
+                with open(path, "w") as fout:
+                    fout.write("{}")
+            return "-- Formula is satisfied.\nt:\n[0]: (0,0) (11,11)\nX:\n[0]: (0,42) (11,43)\n"
+
+        store = sutil.StrategyStore(self.workspace.path("strategies"),
+                                    tolerance={"t": 100, "X": 1.5}, max_reuses=1,
+                                    discrete=["X"], continuous=["t"])
+        setup = self.make_setup(fake_verifyta, strategy_store=store)
+        setup.run(10, 2, 4)
+        setup.close()
+        self.assertIn("saveStrategy", queries[0])
+        self.assertIn("loadStrategy {X} -> {t}", queries[1])
+        self.assertNotIn("minE", queries[1])
+        # Each strategy may be reused only once before it is learned again.
+        self.assertIn("saveStrategy", queries[2])
+        self.assertIn("strategy_1.json", queries[3])
+        statistics = store.statistics()
+        self.assertEqual((statistics["fresh"], statistics["reused"]), (2, 2))
+
+    def test_strategy_store_lookup_ignores_unobserved_variables(self):
+        store = sutil.StrategyStore(self.workspace.path("strategies"), discrete=["mode"],
+                                    continuous=["X"])
+        entry = {"state": {"t": 0, "X": 42.0, "mode": "heat", "on": True},
+                 "path": self.workspace.path("strategies/strategy_0.json"),
+                 "learning_time": 1.0, "reuses": 0}
+        store.entries.append(entry)
+        self.assertIs(store.lookup({"t": 10, "X": 42.0, "mode": "heat", "on": False}), entry)
+        self.assertIsNone(store.lookup({"t": 10, "X": 42.0, "mode": "cool", "on": True}))
+        self.assertIsNone(store.lookup({"t": 10, "X": 42.5, "mode": "heat", "on": True}))
+        store = sutil.StrategyStore(self.workspace.path("strategies"), tolerance=1.0)
+        store.entries.append(entry)
+        self.assertIs(store.lookup({"t": 1, "X": 42.5, "mode": "heat", "on": True}), entry)
+        self.assertIsNone(store.lookup({"t": 1, "X": 42.5, "mode": "cool", "on": True}))
+
+    def test_adaptive_budget_scheduler(self):
+        levels = [{"good-runs": "10"}, {"good-runs": "100"}, {"good-runs": "1000"}]
+        scheduler = sutil.AdaptiveBudgetScheduler(levels, 1.0, lambda state: state["danger"],
+                                                  horizons=[2, 4, 8], growth=4.0)
+        self.assertEqual(scheduler.schedule(0, {"danger": 0.0}), (levels[0], 2))
+        self.assertEqual(scheduler.schedule(0, {"danger": 1.0}), (levels[2], 8))
+        scheduler.record(0, levels[0], 2, 0.1)
+        # Level 1 is predicted to take 0.4 s and level 2 1.6 s, which exceeds the budget.
+        self.assertEqual(scheduler.schedule(1, {"danger": 1.0}), (levels[1], 4))
+        scheduler.record(1, levels[1], 4, 2.0)
+        self.assertEqual(scheduler.schedule(2, {"danger": 0.6}), (levels[0], 2))
+
+    def test_mpcsetup_run_with_scheduler(self):
+        scheduler = sutil.AdaptiveBudgetScheduler([{"good-runs": "10"}], 1.0, horizons=[3])
+        setup = self.make_setup(learning_args={"seed": "1"}, scheduler=scheduler)
+        setup.run(10, 2, 2)
+        with open(setup.query_file, "r") as fin:
+            self.assertIn("[<=3*10]", fin.read())
+        setup.close()
+        calls = setup.controller.launcher.calls
+        self.assertIn("--good-runs", calls[0])
+        self.assertIn("--seed", calls[0])
+        self.assertDictEqual(setup.learning_args, {"seed": "1"})
+        self.assertEqual(len(scheduler.history), 2)
+
+    def test_workspace_cleanup(self):
+        with sutil.Workspace() as workspace:
+            directory = workspace.directory
+            self.assertTrue(os.path.isdir(directory))
+            self.assertEqual(os.path.dirname(workspace.path("a/query.q")), directory)
+        self.assertFalse(os.path.exists(directory))
+
+    def test_mpcsetup_concurrent_with_private_workspaces(self):
+        def handler(argv):
+            # Echo the inserted value of X, such that a mixed up simulation file is detected.
+            with open(argv[1], "r") as fin:
+                x = fin.read().split("important_variable_X = ")[1].split(";")[0]
+            return f"t:\n[0]: (0,0) (11,11)\nX:\n[0]: (0,{x}) (11,{x})\n"
+
+        setups = [self.make_setup(handler, model_cfg_dict={"t": 0, "X": float(i)}, workspace=True)
+                  for i in range(4)]
+        threads = [threading.Thread(target=setup.run, args=(10, 2, 20)) for setup in setups]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i, setup in enumerate(setups):
+            self.assertEqual(setup.controller.get_state("X"), float(i))
+            self.assertEqual(os.path.dirname(setup.query_file), setup.workspace.directory)
+            setup.close()
+            self.assertFalse(os.path.exists(setup.workspace.directory))
+
+    def test_mpcsetup_file_layout(self):
+        setup = sutil.MPCsetup(self.modelfile, query_file="query.q")
+        self.assertIsNone(setup.workspace)
+        self.assertEqual(setup.controller.simulation_file, "modelfile_sim.xml")
+        self.assertEqual(setup.query_file, "query.q")
+        query_file = os.path.abspath("queries.q")
+        setup = sutil.MPCsetup(self.modelfile, query_file=query_file, workspace=self.workspace)
+        self.assertEqual(setup.query_file, query_file)
+        self.assertEqual(setup.debug_file, self.workspace.path("modelfile_debug.xml"))
+        self.assertEqual(setup.controller.simulation_file,
+                         self.workspace.path("modelfile_sim.xml"))
+
+    def test_mpcsetup_arun_with_async_hooks(self):
+        output = "t:\n[0]: (0,0) (11,11)\nX:\n[0]: (0,0) (0,1) (11,1)\n"
+
+        class AsyncSetup(sutil.MPCsetup):
+            async def perform_at_start_iteration(self, *args, **kwargs):
+                await asyncio.sleep(0)
+
+            async def run_external_simulator(self, chosen_action, control_period, step,
+                                             **kwargs):
+                await asyncio.sleep(0)
+                return {"t": (step + 1) * control_period, "X": chosen_action}
+
+        async def main():
+            semaphore = asyncio.Semaphore(2)
+            setups = [self.make_setup(output, AsyncSetup, model_cfg_dict={"t": 0, "X": 0.0},
+                                      external_simulator=True, action_variable="X",
+                                      workspace=True, semaphore=semaphore)
+                      for _ in range(5)]
+            await asyncio.gather(*(setup.arun(10, 2, 3) for setup in setups))
+            return setups
+
+        setups = asyncio.run(main())
+        for setup in setups:
+            self.assertDictEqual(setup.controller.get_states(), {"t": 30, "X": 1.0})
+            setup.close()
+
+    def test_controller_run_with_cache(self):
+        with sutil.Workspace() as workspace:
+            launcher = sutil.FakeLauncher(lambda argv: "-- Formula is satisfied.\n")
+            cache = sutil.SynthesisCache(workspace.directory,
+                                         quantize=lambda states: {"X": round(states["X"])})
+            controller = sutil.StrategoController(self.modelfile, {"X": 42.1}, launcher=launcher,
+                                                  cache=cache)
+            controller.insert_state()
+            first = controller.run()
+            controller.update_state({"X": 41.9})
+            controller.insert_state()
+            second = controller.run()
+            controller.remove_simfile()
+            self.assertEqual(first, second)
+            runs = [argv for argv in launcher.calls if "--version" not in argv]
+            self.assertEqual(len(runs), 1)
+            self.assertDictEqual(cache.statistics(),
+                                 {"hits": 1, "misses": 1, "entries": 1, "size": len(first)})
+
+    def test_cache_covers_streaming_and_async_runs_but_not_failures(self):
+        with sutil.Workspace() as workspace:
+            outputs = {"good": "-- Formula is satisfied.\nx:\n[0]: (0,1) (10,1)\n",
+                       "bad": "-- Formula is not satisfied.\n"}
+            launcher = sutil.FakeLauncher(lambda argv: outputs.get(argv[-1], ""))
+            cache = sutil.SynthesisCache(workspace.directory)
+            controller = sutil.StrategoController(self.modelfile, {"X": 1}, launcher=launcher,
+                                                  cache=cache)
+            controller.insert_state()
+            for learning_args in ({"seed": "good"}, {"seed": "bad"}):
+                controller.run_streaming(learning_args=learning_args)
+                controller.run(learning_args=learning_args)
+                asyncio.run(controller.arun(learning_args=learning_args))
+            output, parser = controller.run_streaming(learning_args={"seed": "good"})
+            controller.remove_simfile()
+            self.assertEqual(output, outputs["good"])
+            self.assertEqual(len(parser.trajectories["x"]), 1)
+            runs = [argv for argv in launcher.calls if "--version" not in argv]
+            self.assertEqual(len(runs), 4)
+            self.assertEqual(cache.statistics()["entries"], 1)
+
+    def test_synthesis_cache_eviction(self):
+        with sutil.Workspace() as workspace:
+            cache = sutil.SynthesisCache(workspace.directory, max_size=25)
+            keys = [cache.key(str(i), "", {}, "v") for i in range(3)]
+            for i, key in enumerate(keys):
+                cache.put(key, "0123456789")
+                # Make the access order explicit, as the entries are written within one tick.
+                os.utime(os.path.join(workspace.directory, key + ".out"), (i, i))
+            self.assertIsNone(cache.get(keys[0]))
+            self.assertEqual(cache.get(keys[2]), "0123456789")
+            self.assertEqual(cache.statistics()["entries"], 2)
+
+    def test_mpcsetup_run_pipelined(self):
+        def handler(argv):
+            # Predict that X increases by one during the first control period.
+            with open(argv[1], "r") as fin:
+                text = fin.read()
+            x = float(text.split("important_variable_X = ")[1].split(";")[0])
+            t = float(text.split("clock t = ")[1].split(";")[0])
+            return (f"t:\n[0]: ({t},{t}) ({t + 11},{t + 11})\n"
+                    f"X:\n[0]: (0,{x}) (0,{x + 1}) (11,{x + 1})\n")
+
+        class Setup(sutil.MPCsetup):
+            offset = 0.0
+            starts = []
+
+            def perform_at_start_iteration(self, control_period, horizon, duration, step,
+                                           **kwargs):
+                self.starts.append((step, self.controller.get_state("X")))
+
+            def run_external_simulator(self, chosen_action, control_period, step, **kwargs):
+                return {"t": (step + 1) * control_period, "X": chosen_action + self.offset}
+
+        for offset, expected_stats, expected_x in [
+                (0.0, {"hits": 3, "misses": 0, "hit_rate": 1.0}, 4.0),
+                (0.5, {"hits": 0, "misses": 3, "hit_rate": 0.0}, 6.0)]:
+            setup = self.make_setup(handler, Setup, model_cfg_dict={"t": 0, "X": 0.0},
+                                    external_simulator=True, action_variable="X")
+            setup.offset = offset
+            setup.starts = []
+            stats = setup.run_pipelined(10, 2, 4, tolerance={"t": 0.0, "X": 0.1})
+            setup.close()
+            self.assertDictEqual(stats, expected_stats)
+            self.assertDictEqual(setup.controller.get_states(), {"t": 40, "X": expected_x})
+        # Each miss repeats the start of the iteration for the true state.
+        self.assertListEqual(setup.starts[-2:], [(3, 4.0), (3, 4.5)])
+        setup = self.make_setup(handler, Setup, model_cfg_dict={"t": 0, "X": 0.0},
+                                external_simulator=True, action_variable="X", deadline=1.0)
+        with self.assertRaises(RuntimeError):
+            setup.run_pipelined(10, 2, 4)
+
+    def test_mpcsetup_run_pipelined_with_quantized_cache(self):
+        def handler(argv):
+            if "--version" in argv:
+                return ""
+            with open(argv[1], "r") as fin:
+                text = fin.read()
+            x = float(text.split("important_variable_X = ")[1].split(";")[0])
+            t = float(text.split("clock t = ")[1].split(";")[0])
+            return (f"-- Formula is satisfied.\nt:\n[0]: ({t},{t}) ({t + 11},{t + 11})\n"
+                    f"X:\n[0]: (0,{x}) (0,{x + 1}) (11,{x + 1})\n")
+
+        class Cache(sutil.SynthesisCache):
+            # Remember the model of each key, to check that each output is stored under the key
+            # of the state it was synthesized for.
+            models = {}
+            stored = []
+            put_event = threading.Event()
+
+            def key(self, model_text, *args):
+                key = super().key(model_text, *args)
+                self.models[key] = model_text
+                return key
+
+            def put(self, key, output):
+                super().put(key, output)
+                self.stored.append((self.models[key], output))
+                if threading.current_thread() is not threading.main_thread():
+                    self.put_event.set()
+
+        class Setup(sutil.MPCsetup):
+            def run_external_simulator(self, chosen_action, control_period, step, **kwargs):
+                # Let the speculative run finish before the state changes.
+                if step + 1 < 4:
+                    self.controller.cache.put_event.wait(10)
+                    self.controller.cache.put_event.clear()
+                return {"t": (step + 1) * control_period, "X": chosen_action}
+
+        cache = Cache(self.workspace.path("cache"),
+                      quantize=lambda states: dict(states, X=round(states["X"])))
+        setup = self.make_setup(handler, Setup, model_cfg_dict={"t": 0, "X": 0.0},
+                                external_simulator=True, action_variable="X", cache=cache)
+        stats = setup.run_pipelined(10, 2, 4, tolerance=0.1)
+        setup.close()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(len(cache.stored), 4)
+        for model_text, output in cache.stored:
+            x = model_text.split("important_variable_X = ")[1].split(";")[0]
+            self.assertEqual(round(float(output.split("X:\n[0]: (0,")[1].split(")")[0])), int(x))
+
+    def test_safe_mpcsetup_race_queries(self):
+        class Setup(sutil.SafeMPCSetup):
+            def create_alternative_query_file(self, horizon, period, final):
+                with open(self.query_file, "w") as f:
+                    f.write("alternative")
+
+        for primary, expected in [("-- Formula is satisfied.\nprimary\n", "primary"),
+                                  ("-- Formula is not satisfied.\nprimary\n", "alternative")]:
+            launcher = sutil.FakeLauncher(
+                lambda argv: ("-- Formula is satisfied.\nalternative\n"
+                              if argv[2].endswith("_alternative.q") else primary))
+            setup = Setup(self.modelfile, query_file="query.q", model_cfg_dict={"X": 0},
+                          launcher=launcher, workspace=self.workspace, race_queries=True)
+            setup.controller.insert_state()
+            self.assertIn(expected, setup.run_verifyta(1, 10, 10))
+            self.assertEqual(len(launcher.calls), 2)
+            self.assertTrue(os.path.exists(setup.alternative_query_file))
+            setup.controller.insert_state()
+            self.assertIn(expected, asyncio.run(setup.arun_verifyta(1, 10, 10)))
+            setup.close()
+
+    def test_safe_mpcsetup_with_portfolio(self):
+        class Setup(sutil.SafeMPCSetup):
+            def create_alternative_query_file(self, horizon, period, final):
+                with open(self.query_file, "w") as f:
+                    f.write("alternative")
+
+        def handler(argv):
+            with open(argv[2], "r") as fin:
+                if fin.read() == "alternative":
+                    return "-- Formula is satisfied.\nalternative\n"
+            return "-- Formula is not satisfied.\nprimary\n"
+
+        launcher = sutil.FakeLauncher(handler)
+        setup = Setup(self.modelfile, query_file="query.q", model_cfg_dict={"X": 0},
+                      launcher=launcher, workspace=self.workspace,
+                      portfolio=sutil.Portfolio(2, cores=2))
+        setup.controller.insert_state()
+        with open(setup.query_file, "w") as f:
+            f.write("primary")
+        self.assertIn("alternative", setup.run_verifyta(1, 10, 10))
+        self.assertEqual(len(setup.portfolio_outcomes), 1)
+        self.assertEqual(len(setup.portfolio_outcomes[0]), 2)
+        self.assertEqual(len(launcher.calls), 3)
+        setup.close()
+        with self.assertRaisesRegex(RuntimeError, "portfolio"):
+            Setup(self.modelfile, query_file="query.q", model_cfg_dict={"X": 0},
+                  workspace=self.workspace, race_queries=True, portfolio=sutil.Portfolio(2))
+
+    def test_mpcsetup_deadline_kills_verifyta(self):
+        # The simulation file is a python script, such that the interpreter acts as a slow verifyta.
+        with open(self.modelfile, "w") as fin:
+            fin.write("t = //TAG_t\nimport time\ntime.sleep(//TAG_X)\n")
+        setup = sutil.MPCsetup(self.modelfile, query_file="", model_cfg_dict={"t": 0, "X": 30},
+                               verifyta_command=sys.executable, action_variable="X",
+                               workspace=self.workspace, deadline=0.5, safe_action=7)
+        setup.create_query_file = lambda *args: None
+        chosen_action = setup.run_single(10, 2)
+        self.assertEqual(chosen_action, 7)
+        self.assertTrue(setup.step_metrics[0]["deadline_missed"])
+        self.assertEqual(setup.step_metrics[0]["fallback"], "safe_action")
+        self.assertLess(setup.step_metrics[0]["synthesis_time"], 10)
+
+    def test_mpcsetup_deadline_falls_back_to_previous_plan(self):
+        output = "X:\n[0]: (0,0) (0,1) (10,1) (10,2) (20,2) (20,3) (21,3)\n"
+
+        class BlockedProcess:
+            # A run of verifyta that only ends when it is killed.
+            def __init__(self):
+                self.killed = threading.Event()
+                self.returncode = None
+                self.stdout = self.stderr = self
+
+            def read(self, *args):
+                self.killed.wait()
+                return b""
+
+            def close(self):
+                pass
+
+            def poll(self):
+                return self.returncode
+
+            def wait(self, timeout=None):
+                self.killed.wait()
+                return self.returncode
+
+            def kill(self):
+                self.returncode = -9
+                self.killed.set()
+
+        class Launcher(sutil.FakeLauncher):
+            def launch(self, argv):
+                # Make every step after the first one miss its deadline.
+                process = super().launch(argv)
+                return process if len(self.calls) == 1 else BlockedProcess()
+
+        class Setup(sutil.MPCsetup):
+            def run_external_simulator(self, chosen_action, control_period, step, **kwargs):
+                return {"t": (step + 1) * control_period, "X": chosen_action}
+
+        setup = self.make_setup(setup_class=Setup, model_cfg_dict={"t": 0, "X": 0},
+                                external_simulator=True, action_variable="X",
+                                launcher=Launcher(lambda argv: output), deadline=0.5,
+                                safe_action=-1)
+        setup.run(10, 2, 4)
+        setup.close()
+        fallbacks = [metrics["fallback"] for metrics in setup.step_metrics]
+        self.assertListEqual(fallbacks, [None, "previous_plan", "previous_plan", "safe_action"])
+        self.assertEqual(setup.controller.get_state("X"), -1)
+
+    def test_explicit_controller_build_and_fallback(self):
+        def fake_verifyta(argv):
+            with open(argv[1], "r") as fin:
+                x = float(re.search(r"important_variable_X = ([^;]+);", fin.read()).group(1))
+            return f"X:\n[0]: (0,{x}) (0,{2 * x}) (10,{2 * x})\n"
+
+        def factory():
+            return self.make_setup(fake_verifyta, model_cfg_dict={"t": 0, "X": 0.0},
+                                   external_simulator=True, action_variable="X", workspace=True)
+
+        states = sutil.ExplicitController.grid({"X": [0.0, 1.0, 2.0, 3.0]})
+        table = sutil.ExplicitController.build(factory, states, 10, 1, workers=2,
+                                               interpolate=True, fallback=lambda state: -1.0)
+        self.assertListEqual(list(table.actions), [0.0, 2.0, 4.0, 6.0])
+        self.assertEqual(table.action({"X": 1.5}), 3.0)
+        self.assertEqual(table.action({"X": 4.0}), -1.0)
+        self.assertEqual((table.hits, table.misses), (1, 1))
+        self.assertEqual(table.coverage([{"X": 0.5}, {"X": 4.0}]), 0.5)
+
+    def test_explicit_controller_scattered_states(self):
+        points = [[0.0, 0.0], [1.0, 0.0], [0.0, 10.0], [1.0, 10.0], [0.5, 5.0]]
+        table = sutil.ExplicitController(["x", "y"], points, [1, 2, 3, 4, 5], max_distance=0.2)
+        self.assertIsNone(table._grid)
+        self.assertEqual(table.action({"x": 0.9, "y": 1.0}), 2.0)
+        self.assertEqual(table.action({"x": 0.45, "y": 5.5}), 5.0)
+        self.assertFalse(table.covers({"x": 0.25, "y": 2.5}))
+        table.save(self.workspace.path("table.bin"))
+        loaded = sutil.ExplicitController.load(self.workspace.path("table.bin"))
+        self.assertEqual(loaded.action({"x": 0.1, "y": 9.0}), 3.0)
+        self.assertFalse(loaded.covers({"x": 0.25, "y": 2.5}))
+
+    def test_mpcsetup_resume_from_checkpoint(self):
+        output = "X:\n[0]: (0,0) (0,1) (10,1)\n"
+
+        class Setup(sutil.MPCsetup):
+            crash_at = None
+
+            def perform_at_start_iteration(self, control_period, horizon, duration, step,
+                                           **kwargs):
+                if step == self.crash_at:
+                    raise KeyboardInterrupt()
+
+            def run_external_simulator(self, chosen_action, control_period, step, **kwargs):
+                kwargs["log"].append(step)
+                return {"t": (step + 1) * control_period,
+                        "X": self.controller.get_state("X") + chosen_action}
+
+        def make_setup(workspace):
+            return self.make_setup(output, Setup, model_cfg_dict={"t": 0, "X": 0},
+                                   external_simulator=True, action_variable="X",
+                                   workspace=workspace,
+                                   result_sink=sutil.CSVSink(workspace.path("out.csv")),
+                                   checkpoint_every=2)
+
+        with sutil.Workspace() as workspace:
+            make_setup(workspace).run(10, 2, 5, log=[])
+            with open(workspace.path("out.csv"), "r") as fin:
+                expected = fin.read()
+
+        with sutil.Workspace() as workspace:
+            setup = make_setup(workspace)
+            setup.crash_at = 3
+            with self.assertRaises(KeyboardInterrupt):
+                setup.run(10, 2, 5, log=[])
+            setup = make_setup(sutil.Workspace(directory=workspace.directory))
+            setup.resume(10, 2, 5)
+            with open(workspace.path("out.csv"), "r") as fin:
+                resumed = fin.read()
+        self.assertEqual(resumed, expected)
+        self.assertEqual(len(expected.splitlines()), 7)
+        self.assertListEqual([metrics["step"] for metrics in setup.step_metrics], list(range(5)))
+
+    def test_mpcsetup_resume_after_workspace_is_removed(self):
+        output = "t:\n[0]: (0,0) (10,10)\nX:\n[0]: (0,0) (10,1)\n"
+
+        class Setup(sutil.MPCsetup):
+            crash_at = None
+
+            def perform_at_start_iteration(self, control_period, horizon, duration, step,
+                                           **kwargs):
+                if step == self.crash_at:
+                    raise KeyboardInterrupt()
+
+        def make_setup():
+            return self.make_setup(output, Setup, model_cfg_dict={"t": 0, "X": 0},
+                                   workspace=True, checkpoint_every=1,
+                                   output_file_path=self.workspace.path("out.csv"))
+
+        setup = make_setup()
+        setup.crash_at = 2
+        with self.assertRaises(KeyboardInterrupt):
+            setup.run(10, 2, 4)
+        directory = setup.workspace.directory
+        del setup
+        gc.collect()
+        self.assertFalse(os.path.exists(directory))
+        setup = make_setup()
+        setup.resume(10, 2, 4)
+        setup.close()
+        with open(self.workspace.path("out.csv"), "r") as fin:
+            lines = fin.read().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertFalse(os.path.exists(setup.checkpoint_file))
+        with self.assertRaises(RuntimeError):
+            asyncio.run(make_setup().arun(10, 2, 4))
+
+    def test_mpcsetup_checkpoint_of_template_without_xml_extension(self):
+        workspace = self.workspace
+        template = workspace.path("model.uppaal")
+        with open(self.modelfile, "r") as fin:
+            content = fin.read() + "clock t = //TAG_t;"
+        with open(template, "w") as fout:
+            fout.write(content)
+        output = "t:\n[0]: (0,0) (10,10)\nX:\n[0]: (0,0) (10,1)\n"
+        launcher = sutil.FakeLauncher(lambda argv: output)
+        setup = sutil.MPCsetup(template, query_file=workspace.path("query.q"),
+                               model_cfg_dict={"t": 0, "X": 0}, launcher=launcher,
+                               result_sink=sutil.CSVSink(workspace.path("out.csv")),
+                               checkpoint_every=1)
+        setup.show_progress = False
+        self.assertEqual(setup.checkpoint_file, workspace.path("model_checkpoint.pickle"))
+        setup.run(10, 2, 2)
+        with self.assertRaisesRegex(RuntimeError, "lock"):
+            setup.run(10, 2, 2, lock=threading.Lock())
+        setup.close()
+        with open(template, "r") as fin:
+            self.assertEqual(fin.read(), content)
+        self.assertFalse(os.path.exists(setup.checkpoint_file))
+
+    def test_learning_tuner(self):
+        with open(self.modelfile, "a") as fin:
+            fin.write("clock c = //TAG_c;")
+
+        def handler(argv):
+            # More good runs give a lower cost.
+            good_runs = int(argv[argv.index("--good-runs") + 1])
+            return f"t:\n[0]: (0,0) (11,11)\nc:\n[0]: (0,0) (11,{11 / good_runs})\n"
+
+        class Setup(sutil.MPCsetup):
+            def run(self, *args, **kwargs):
+                super().run(*args, **kwargs)
+                # Fake step times, where more good runs take longer.
+                for metrics in self.step_metrics:
+                    metrics["synthesis_time"] = 0.01 * self.learning_args["good-runs"]
+
+        def factory(learning_args):
+            return self.make_setup(handler, Setup, output_file_path=os.devnull,
+                                   model_cfg_dict={"t": 0, "c": 0.0},
+                                   learning_args=learning_args, workspace=True)
+
+        tuner = sutil.LearningTuner(factory, 10, 2, 3, "c", base_args={"nosummary": None},
+                                    workers=4)
+        with contextlib.redirect_stdout(io.StringIO()) as progress:
+            results = tuner.successive_halving({"good-runs": [1, 5, 10], "eval-runs": [1]}, eta=3)
+            tuner.sweep({"good-runs": [1, 5, 10]})
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["learning_args"]["good-runs"], 10)
+        self.assertNotIn("progress", progress.getvalue())
+        self.assertIn("tuning (3 steps)", progress.getvalue())
+        front = tuner.pareto_front()
+        self.assertListEqual([r["learning_args"]["good-runs"] for r in front], [1, 5, 10])
+        self.assertEqual(tuner.recommend(0.08)["good-runs"], 5)
+        self.assertIsNone(tuner.recommend(0.0))
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        """
+        Build a dummy verifyta script that fails its first formula and then keeps running.
+        """
+        self.scriptfile = "fake_verifyta.py"
+        with open(self.scriptfile, "w") as fout:
+            fout.write(
+                "import sys, time\n"
+                "print('-- Formula is not satisfied.', flush=True)\n"
+                "print('x:')\n"
+                "print('[0]: (0,1) (10,2)', flush=True)\n"
+                "time.sleep(float(sys.argv[1]) if len(sys.argv) > 1 else 0)\n")
+
+    def tearDown(self):
+        """
+        Remove verifyta script.
+        """
+        os.remove(self.scriptfile)
+
+    def test_stream_stratego_yields_lines(self):
+        lines = list(sutil.stream_stratego(self.scriptfile, verifyta_command=sys.executable))
+        self.assertEqual(len(lines), 3)
+        self.assertIn("not satisfied", lines[0])
+
+    def test_run_stratego_streaming_parses_output(self):
+        output, parser = sutil.run_stratego_streaming(self.scriptfile,
+                                                      verifyta_command=sys.executable)
+        self.assertTrue(parser.failed)
+        times, values = sutil.get_trajectory(parser.trajectories, "x")
+        self.assertListEqual(list(values), [1.0, 2.0])
+        self.assertFalse(sutil.successful_result(output))
+
+    def test_run_stratego_streaming_abort_on_failure(self):
+        output, parser = sutil.run_stratego_streaming(self.scriptfile, query_file="60",
+                                                      verifyta_command=sys.executable,
+                                                      abort_on_failure=True)
+        self.assertTrue(parser.failed)
+        self.assertDictEqual(parser.trajectories, {})
+
+    def test_profiler_records_verifyta_resource_usage(self):
+        profiler = sutil.Profiler()
+        with profiler.phase("verifyta", 0):
+            sutil.run_stratego_streaming(self.scriptfile, verifyta_command=sys.executable)
+        record = profiler.records[0]
+        self.assertGreaterEqual(record["wall_time"], 0.0)
+        if hasattr(os, "wait4"):
+            self.assertGreater(record["peak_rss"], 0)
+
+    def test_parse_stratego_in_chunks(self):
+        parser = sutil.parse_stratego(self.scriptfile, verifyta_command=sys.executable,
+                                      chunk_size=4)
+        self.assertTrue(parser.failed)
+        times, values = sutil.get_trajectory(parser.trajectories, "x")
+        self.assertListEqual(list(times), [0.0, 10.0])
+        self.assertListEqual(list(values), [1.0, 2.0])
+
+    def test_simulate_parser_spills_beyond_memory_limit(self):
+        text = "x:\n" + "".join("[{}]:{}\n".format(run, "".join(
+            " ({},{})".format(i, run * 100 + i) for i in range(100))) for run in range(3))
+        parser = sutil.SimulateParser(memory_limit=1000)
+        for i in range(0, len(text), 7):
+            parser.feed_chunk(text[i:i + 7])
+        parser.close()
+        self.assertEqual(parser.spilled_bytes, 3 * 100 * 16)
+        self.assertDictEqual(
+            {var: [(list(t), list(v)) for t, v in runs] for var, runs in
+             parser.trajectories.items()},
+            {var: [(list(t), list(v)) for t, v in runs] for var, runs in
+             sutil.parse_simulate_output(text).items()})
+        self.assertEqual(sutil.value_at(*sutil.get_trajectory(parser.trajectories, "x", 2), 50),
+                         250.0)
+
+    def test_async_run_stratego(self):
+        result = asyncio.run(sutil.async_run_stratego(self.scriptfile,
+                                                      verifyta_command=sys.executable))
+        self.assertIn("not satisfied", result[0])
+        self.assertEqual(result[1], "")
+
+    def test_portfolio_time_budget_kills_slow_runs(self):
+        with open(self.scriptfile, "w") as fout:
+            fout.write(
+                "import sys, time\n"
+                "if sys.argv[2] == '2':\n"
+                "    time.sleep(30)\n"
+                "print('-- Formula is satisfied.')\n"
+                "print('E(max) = 5')\n")
+        portfolio = sutil.Portfolio(2, cores=2, time_budget=1.0)
+        start = time.perf_counter()
+        output, outcomes = portfolio.run(self.scriptfile, verifyta_command=sys.executable)
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertEqual(portfolio.cost(output), 5.0)
+        self.assertListEqual([outcome["status"] for outcome in outcomes], ["finished", "killed"])
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not available")
+    def test_remote_launcher_with_local_worker_processes(self):
+        workspace = sutil.Workspace()
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(sutil.__file__)))
+        addresses = [workspace.path(f"worker{i}.sock") for i in range(2)]
+        workers = [subprocess.Popen(
+            [sys.executable, "-c",
+             "import sys, strategoutil; strategoutil.VerifytaWorker("
+             "sys.argv[1], sys.executable, secret='key').serve_forever()",
+             address], env=env) for address in addresses]
+        try:
+            with sutil.Coordinator(addresses, health_interval=0.2, secret="key") as coordinator:
+                launcher = sutil.RemoteLauncher(coordinator)
+                start = time.perf_counter()
+                while not all(worker["healthy"] for worker in coordinator.workers):
+                    self.assertLess(time.perf_counter() - start, 10)
+                    time.sleep(0.05)
+                outputs = [sutil.run_stratego(self.scriptfile, verifyta_command=sys.executable,
+                                              launcher=launcher)[0] for _ in range(4)]
+                self.assertTrue(all("not satisfied" in output for output in outputs))
+                self.assertEqual(sum(worker["jobs"] for worker in coordinator.workers), 4)
+
+                # Killing a remote run through the launcher kills it at the worker.
+                cancellable = sutil._CancellableLauncher(launcher)
+                timer = threading.Timer(0.2, cancellable.cancel)
+                timer.start()
+                start = time.perf_counter()
+                sutil.run_stratego(self.scriptfile, "30", verifyta_command=sys.executable,
+                                   launcher=cancellable)
+                self.assertLess(time.perf_counter() - start, 10)
+        finally:
+            for worker in workers:
+                worker.kill()
+                worker.wait()
+            workspace.cleanup()
+
+    def test_verifyta_worker_runs_own_command_for_authenticated_clients(self):
+        def handler(argv):
+            contents = []
+            for path in argv[2:4]:
+                with open(path, "r") as f:
+                    contents.append(f.read())
+            return " ".join(contents)
+
+        launcher = sutil.FakeLauncher(handler)
+        worker = sutil.VerifytaWorker(("127.0.0.1", 0), "verifyta --silence-progress",
+                                      launcher=launcher, secret="key")
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+        workspace = sutil.Workspace()
+        os.mkdir(workspace.path("other"))
+        paths = [workspace.path("model.xml"),
+                 os.path.join(workspace.directory, "other", "model.xml")]
+        for content, path in zip(["first", "second"], paths):
+            with open(path, "w") as f:
+                f.write(content)
+        try:
+            with sutil.Coordinator([worker.address], secret="wrong",
+                                   health_interval=0.1) as coordinator:
+                self.assertFalse(coordinator.wait_healthy(0.5))
+            with sutil.Coordinator([worker.address], secret="key") as coordinator:
+                result = coordinator.submit(["rm", paths[0], paths[1]],
+                                            {1: paths[0], 2: paths[1]}).result(timeout=10)
+                self.assertEqual(result["stdout"], "first second")
+                self.assertListEqual(launcher.calls[-1][:2], ["verifyta", "--silence-progress"])
+                result = coordinator.submit(["rm", paths[0]], {0: paths[0]}).result(timeout=10)
+                self.assertIsNone(result["returncode"])
+                self.assertEqual(len(launcher.calls), 1)
+        finally:
+            worker.shutdown()
+            workspace.cleanup()
+
+    def test_verifyta_worker_rejects_malformed_messages(self):
+        worker = sutil.VerifytaWorker(("127.0.0.1", 0), "verifyta",
+                                      launcher=sutil.FakeLauncher(lambda argv: ""))
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+        try:
+            sock = sutil._connect(worker.address, timeout=10)
+            for message in [[1], {"id": 0}, {"type": "run", "id": 0},
+                            {"type": "run", "id": 0, "argv": ["verifyta"], "files": {"1": 2}}]:
+                sutil._send_message(sock, message)
+                self.assertEqual(sutil._receive_message(sock)["type"], "error")
+            sutil._send_message(sock, {"type": "ping"})
+            self.assertDictEqual(sutil._receive_message(sock), {"type": "pong", "running": 0})
+            sock.sendall(struct.pack("!I", sutil._MAX_MESSAGE_SIZE + 1))
+            self.assertIn("exceeds", sutil._receive_message(sock)["error"])
+            self.assertEqual(sock.recv(1), b"")
+            sock.close()
+        finally:
+            worker.shutdown()
+
+    def test_coordinator_retries_failed_connections(self):
+        # A broken worker that closes the connection as soon as it receives a job.
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+
+        def serve():
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except OSError:
+                    return
+                connection.recv(1 << 16)
+                connection.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        with sutil.Coordinator([server.getsockname()], retries=1,
+                               health_interval=0.1) as coordinator:
+            future = coordinator.submit(["verifyta", self.scriptfile], {1: self.scriptfile})
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=10)
+            self.assertEqual(coordinator.workers[0]["failures"], 2)
+        server.close()
+
+    def test_stompc_runs_manifest_and_skips_completed(self):
+        workspace = sutil.Workspace()
+        with open(workspace.path("model.py"), "w") as fout:
+            fout.write("# //TAG_t\n# //TAG_X\n"
+                       "print('t:\\n[0]: (0,0) (11,11)\\nX:\\n[0]: (0,42) (11,53)')\n")
+        with open(workspace.path("model_config.json"), "w") as fout:
+            json.dump({"t": 0, "X": 42.0}, fout)
+        with open(workspace.path("verifyta_config.json"), "w") as fout:
+            json.dump({"good-runs": 10, "nosummary": None}, fout)
+        manifest = {"verifyta_command": sys.executable,
+                    "experiments": [{"name": "fake", "template": "model.py",
+                                     "model_config": "model_config.json",
+                                     "verifyta_config": "verifyta_config.json",
+                                     "period": 10, "horizon": 2, "duration": 3,
+                                     "matrix": {"horizon": [2, 3],
+                                                "learning": {"good-runs": [5, 10]}}}]}
+        with open(workspace.path("manifest.json"), "w") as fout:
+            json.dump(manifest, fout)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = sutil.main([workspace.path("manifest.json"), "--jobs", "2"])
+        self.assertEqual(status, 0)
+        with open(os.path.join(workspace.directory, "results", "index.csv"), "r") as fin:
+            rows = list(csv.DictReader(fin))
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(all(row["status"] == "completed" for row in rows))
+        self.assertEqual(len({row["id"] for row in rows}), 4)
+        with open(rows[0]["results"], "r") as fin:
+            self.assertListEqual(fin.read().splitlines(),
+                                 ["t,X", "0,42.0"] + ["10,52.0"] * 3)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            sutil.main([workspace.path("manifest.json")])
+        with open(os.path.join(workspace.directory, "results", "index.csv"), "r") as fin:
+            self.assertTrue(all(row["status"] == "skipped" for row in csv.DictReader(fin)))
+        self.assertFalse(os.path.exists(
+            os.path.join(os.path.dirname(rows[0]["results"]), "checkpoint.pickle")))
+
+        manifest["experiments"][0]["matrix"]["horizon"] = [2, 2]
+        with self.assertRaises(RuntimeError):
+            sutil.expand_manifest(manifest, workspace.directory)
+        workspace.cleanup()